@@ -7,7 +7,7 @@ import torch
 
 def Filter(emb):
     N, L = emb.size()
-    tmp = torch.fft.rfft(emb, dim=1, norm='ortho')
+    tmp = torch.fft.rfft(emb.float(), dim=1, norm='ortho')
     N_fft, L_fft = tmp.size()
     if L_fft < L:
         tmp = torch.nn.functional.pad(tmp, (0, L - L_fft))
@@ -16,6 +16,6 @@ def Filter(emb):
     return tmp
 
 def IFilter(emb):
-    w_emb = torch.fft.irfft(emb, dim=1, n=1, norm='ortho')
+    w_emb = torch.fft.irfft(emb.float(), dim=1, n=1, norm='ortho')
     return w_emb
 
@@ -7,7 +7,15 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import dgl
+from torch.utils.checkpoint import checkpoint
 from conv import myGATConv, DropLearner, DropLearner1, DropLearner2
+from utility.amp import fp32, l2_normalize
+from utility.profiler import phase_timer
+from utility.partition import exchange
+from utility.history import History
+from utility.augment import EdgeWeightRefresh
+from utility.embedding import ConcatEmbedding, RowStack
 
 class Contrast_2view1(nn.Module):
     def __init__(self, cf_dim, kg_dim, hidden_dim, tau, cl_size):
@@ -22,7 +30,7 @@ class Contrast_2view1(nn.Module):
             nn.ELU(),
             nn.Linear(hidden_dim, hidden_dim)
         )
-        self.pos = torch.eye(cl_size).cuda()
+        self.register_buffer('pos', torch.eye(cl_size), persistent=False)
         self.tau = tau
         for model in self.projcf:
             if isinstance(model, nn.Linear):
@@ -31,14 +39,17 @@ class Contrast_2view1(nn.Module):
             if isinstance(model, nn.Linear):
                 nn.init.xavier_normal_(model.weight, gain=1.414)
     def sim1(self, z1, z2):
-        z1_norm = torch.norm(z1, dim=-1, keepdim=True)
-        z2_norm = torch.norm(z2, dim=-1, keepdim=True)
-        dot_numerator = torch.mm(z1, z2.t())
-        dot_denominator = torch.mm(z1_norm, z2_norm.t())
-        sim_matrix = torch.exp(dot_numerator / dot_denominator / self.tau)
-        sim_matrix = sim_matrix/(torch.sum(sim_matrix, dim=1).view(-1, 1) + 1e-8)
-        assert sim_matrix.size(0) == sim_matrix.size(1)
-        lori_mp = -torch.log(sim_matrix.mul(self.pos).sum(dim=-1)).mean()
+        # InfoNCE is kept in float32 under autocast
+        with fp32(z1):
+            z1, z2 = z1.float(), z2.float()
+            z1_norm = torch.norm(z1, dim=-1, keepdim=True)
+            z2_norm = torch.norm(z2, dim=-1, keepdim=True)
+            dot_numerator = torch.mm(z1, z2.t())
+            dot_denominator = torch.mm(z1_norm, z2_norm.t())
+            sim_matrix = torch.exp(dot_numerator / dot_denominator / self.tau)
+            sim_matrix = sim_matrix/(torch.sum(sim_matrix, dim=1).view(-1, 1) + 1e-8)
+            assert sim_matrix.size(0) == sim_matrix.size(1)
+            lori_mp = -torch.log(sim_matrix.mul(self.pos).sum(dim=-1)).mean()
         return lori_mp
     def forward(self, z1, z2):
         multi_loss = False
@@ -65,7 +76,7 @@ class Contrast_2view2(nn.Module):
             nn.ELU(),
             nn.Linear(hidden_dim, hidden_dim)
         )
-        self.pos = torch.eye(cl_size).cuda()
+        self.register_buffer('pos', torch.eye(cl_size), persistent=False)
         self.tau = tau
         for model in self.projcf:
             if isinstance(model, nn.Linear):
@@ -74,14 +85,17 @@ class Contrast_2view2(nn.Module):
             if isinstance(model, nn.Linear):
                 nn.init.xavier_normal_(model.weight, gain=1.414)
     def sim2(self, z1, z2):
-        z1_norm = torch.norm(z1, dim=-1, keepdim=True)
-        z2_norm = torch.norm(z2, dim=-1, keepdim=True)
-        dot_numerator = torch.mm(z1, z2.t())
-        dot_denominator = torch.mm(z1_norm, z2_norm.t())
-        sim_matrix = torch.exp(dot_numerator / dot_denominator / self.tau)
-        sim_matrix = sim_matrix/(torch.sum(sim_matrix, dim=1).view(-1, 1) + 1e-8)
-        assert sim_matrix.size(0) == sim_matrix.size(1)
-        lori_mp = -torch.log(sim_matrix.mul(self.pos).sum(dim=-1)).mean()
+        # InfoNCE is kept in float32 under autocast
+        with fp32(z1):
+            z1, z2 = z1.float(), z2.float()
+            z1_norm = torch.norm(z1, dim=-1, keepdim=True)
+            z2_norm = torch.norm(z2, dim=-1, keepdim=True)
+            dot_numerator = torch.mm(z1, z2.t())
+            dot_denominator = torch.mm(z1_norm, z2_norm.t())
+            sim_matrix = torch.exp(dot_numerator / dot_denominator / self.tau)
+            sim_matrix = sim_matrix/(torch.sum(sim_matrix, dim=1).view(-1, 1) + 1e-8)
+            assert sim_matrix.size(0) == sim_matrix.size(1)
+            lori_mp = -torch.log(sim_matrix.mul(self.pos).sum(dim=-1)).mean()
         return lori_mp
     def forward(self, z1, z2):
         multi_loss = False
@@ -108,16 +122,42 @@ class DistMult(nn.Module):
         right_emb = torch.unsqueeze(right_emb, 2)
         return torch.bmm(torch.bmm(left_emb, thW), right_emb).squeeze()
 
+def batch_nodes(*ids):
+    # the unique nodes of the id arrays and the ids as positions in it.
+    ids = [np.asarray(i, dtype=np.int64) for i in ids]
+    nodes, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+    bounds = np.cumsum([0] + [len(i) for i in ids])
+    return torch.from_numpy(nodes), [torch.from_numpy(inverse[bounds[k]: bounds[k + 1]]) for k in range(len(ids))]
+
+def gat_stack(in_dim, num_hidden, num_classes, num_layers, heads, activation, feat_drop, attn_drop,
+              negative_slope, residual, alpha):
+    layers = nn.ModuleList()
+    # input projection (no residual)
+    layers.append(myGATConv(in_dim, num_hidden, heads[0],
+        feat_drop, attn_drop, negative_slope, False, activation, bias=True, alpha=alpha))
+    # hidden layers
+    for l in range(1, num_layers):
+        # due to multi-head, the in_dim = num_hidden * num_heads
+        layers.append(myGATConv(num_hidden * heads[l-1],
+             num_hidden, heads[l],
+            feat_drop, attn_drop, negative_slope, residual, activation, bias=True, alpha=alpha))
+    # output projection
+    layers.append(myGATConv(num_hidden * heads[-2],
+         num_classes, heads[-1],
+        feat_drop, attn_drop, negative_slope, residual, None, bias=True, alpha=alpha))
+    return layers
+
 class myGAT(nn.Module):
+    # the GAT stack, embedding table and cached DropLearner edge weights of every propagation.
+    VIEWS = {'cf': ('gat_layers', 'embed', None),
+             'ui': ('sub_gat_layers', 'embed', 'ui_edge_weight'),
+             'kg': ('kg_gat_layers', 'kg_embed', 'kg_edge_weight'),
+             'subkg': ('subkg_gat_layers', 'subkg_embed', 'subkg_edge_weight')}
 
     def __init__(self, args, num_entity, num_etypes, num_hidden, num_classes, num_layers,
                  heads, activation, feat_drop, attn_drop, negative_slope, residual, pretrain=None):
         super(myGAT, self).__init__()
         self.num_layers = num_layers
-        self.gat_layers = nn.ModuleList()
-        self.sub_gat_layers = nn.ModuleList()
-        self.kg_gat_layers = nn.ModuleList()
-        self.subkg_gat_layers = nn.ModuleList()
         self.drop_learner = False
         self.activation = activation
         self.cfe_size = args.embed_size
@@ -130,6 +170,9 @@ class myGAT(nn.Module):
         self.weight_decay = args.weight_decay
         self.kg_weight_decay = args.kg_weight_decay
         self.batch_size = args.batch_size
+        # width added by concatenating the hidden and output layers to the input embedding, 48 for [64, 32, 16].
+        self.layer_dim = sum([num_hidden * heads[l] for l in range(num_layers)]) + num_classes
+        self.grad_checkpoint = args.grad_checkpoint == 1
         
         if pretrain is not None:
             user_embed = pretrain['user_embed']
@@ -141,190 +184,262 @@ class myGAT(nn.Module):
             self.cl_embed = nn.Parameter(torch.zeros((self.ret_num, self.cfe_size)))
             nn.init.xavier_normal_(self.embed, gain=1.414)
             nn.init.xavier_normal_(self.cl_embed, gain=1.414)
-            self.ini = torch.FloatTensor(np.concatenate([user_embed, item_embed], axis=0)).cuda()
+            self.register_buffer('ini', torch.FloatTensor(np.concatenate([user_embed, item_embed], axis=0)), persistent=False)
 
         self.kg_embed = nn.Parameter(torch.zeros((num_entity, args.kge_size)))
         self.subkg_embed = nn.Parameter(torch.zeros((num_entity, args.kge_size)))
-        self.user_embed = nn.Parameter(torch.zeros((self.user_size, args.kge_size + 48)))
+        self.user_embed = nn.Parameter(torch.zeros((self.user_size, args.kge_size + self.layer_dim)))
         
         nn.init.xavier_normal_(self.kg_embed, gain=1.414)
         nn.init.xavier_normal_(self.subkg_embed, gain=1.414)
-        self.gat_layers.append(myGATConv(self.cfe_size, num_hidden, heads[0],
-            feat_drop, attn_drop, negative_slope, False, self.activation, bias=True, alpha=alpha))
-        # hidden layers
-        for l in range(1, num_layers):
-            # due to multi-head, the in_dim = num_hidden * num_heads
-            self.gat_layers.append(myGATConv(num_hidden * heads[l-1],
-                 num_hidden, heads[l],
-                feat_drop, attn_drop, negative_slope, residual, self.activation, bias=True, alpha=alpha))
-        # output projection
-        self.gat_layers.append(myGATConv(num_hidden * heads[-2],
-             num_classes, heads[-1],
-            feat_drop, attn_drop, negative_slope, residual, None, bias=True, alpha=alpha))
-
-        # input projection (no residual)
-        self.sub_gat_layers.append(myGATConv(self.cfe_size, num_hidden, heads[0],
-            feat_drop, attn_drop, negative_slope, False, self.activation, bias=True, alpha=alpha))
-        # hidden layers
-        for l in range(1, num_layers):
-            # due to multi-head, the in_dim = num_hidden * num_heads
-            self.sub_gat_layers.append(myGATConv(num_hidden * heads[l-1],
-                 num_hidden, heads[l],
-                feat_drop, attn_drop, negative_slope, residual, self.activation, bias=True, alpha=alpha))
-        # output projection
-        self.sub_gat_layers.append(myGATConv(num_hidden * heads[-2],
-             num_classes, heads[-1],
-            feat_drop, attn_drop, negative_slope, residual, None, bias=True, alpha=alpha))
-        
-        # input projection (no residual)
-        self.kg_gat_layers.append(myGATConv(self.kge_size, num_hidden, heads[0],
-            feat_drop, attn_drop, negative_slope, False, self.activation, bias=True, alpha=alpha))
-        # hidden layers
-        for l in range(1, num_layers):
-            # due to multi-head, the in_dim = num_hidden * num_heads
-            self.kg_gat_layers.append(myGATConv(num_hidden * heads[l-1],
-                 num_hidden, heads[l],
-                feat_drop, attn_drop, negative_slope, residual, self.activation, bias=True, alpha=alpha))
-        # output projection
-        self.kg_gat_layers.append(myGATConv(num_hidden * heads[-2],
-             num_classes, heads[-1],
-            feat_drop, attn_drop, negative_slope, residual, None, bias=True, alpha=alpha))
-
-        # input projection (no residual)
-        self.subkg_gat_layers.append(myGATConv(self.kge_size, num_hidden, heads[0],
-                                            feat_drop, attn_drop, negative_slope, False, self.activation, bias=True,
-                                            alpha=alpha))
-        # hidden layers
-        for l in range(1, num_layers):
-            # due to multi-head, the in_dim = num_hidden * num_heads
-            self.subkg_gat_layers.append(myGATConv(num_hidden * heads[l - 1],
-                                                num_hidden, heads[l],
-                                                feat_drop, attn_drop, negative_slope, residual, self.activation,
-                                                bias=True, alpha=alpha))
-        # output projection
-        self.subkg_gat_layers.append(myGATConv(num_hidden * heads[-2],
-                                            num_classes, heads[-1],
-                                            feat_drop, attn_drop, negative_slope, residual, None, bias=True,
-                                            alpha=alpha))
-
-        self.epsilon = torch.FloatTensor([1e-12]).cuda()
-        self.contrast1 = Contrast_2view1(self.cfe_size + 48, self.kge_size + 48, cl_dim, tau, args.batch_size_cl)
-        self.contrast2 = Contrast_2view2(self.kge_size + 48, self.kge_size + 48, self.edge_dim, tau, args.batch_size_cl)
-        self.decoder = DistMult(num_etypes, self.kge_size + 48)
+        self.gat_layers = gat_stack(self.cfe_size, num_hidden, num_classes, num_layers, heads, self.activation,
+                                    feat_drop, attn_drop, negative_slope, residual, alpha)
+        self.sub_gat_layers = gat_stack(self.cfe_size, num_hidden, num_classes, num_layers, heads, self.activation,
+                                        feat_drop, attn_drop, negative_slope, residual, alpha)
+        self.kg_gat_layers = gat_stack(self.kge_size, num_hidden, num_classes, num_layers, heads, self.activation,
+                                       feat_drop, attn_drop, negative_slope, residual, alpha)
+        self.subkg_gat_layers = gat_stack(self.kge_size, num_hidden, num_classes, num_layers, heads, self.activation,
+                                          feat_drop, attn_drop, negative_slope, residual, alpha)
+
+        for layers in [self.gat_layers, self.sub_gat_layers, self.kg_gat_layers, self.subkg_gat_layers]:
+            for layer in layers:
+                layer.set_fused(args.fused_gat == 1)
+
+        self.register_buffer('epsilon', torch.FloatTensor([1e-12]), persistent=False)
+        self.contrast1 = Contrast_2view1(self.cfe_size + self.layer_dim, self.kge_size + self.layer_dim, cl_dim, tau, args.batch_size_cl)
+        self.contrast2 = Contrast_2view2(self.kge_size + self.layer_dim, self.kge_size + self.layer_dim, self.edge_dim, tau, args.batch_size_cl)
+        self.decoder = DistMult(num_etypes, self.kge_size + self.layer_dim)
         self.learner2 = DropLearner2(self.cfe_size, self.cfe_size)
         self.learner1 = DropLearner1(self.kge_size, self.kge_size, self.edge_dim)
         self.learner = DropLearner(self.kge_size, self.kge_size, self.edge_dim)
         self.ui_edge_weight = None
         self.kg_edge_weight = None
         self.subkg_edge_weight = None
-    
-    def calc_subkg_emb(self, g, drop_learn = False):
+        self.weight_refresh = {view: EdgeWeightRefresh(args.aug_refresh) for view in ['ui', 'kg', 'subkg']}
+        # --history 1: the training losses propagate only the batch nodes, see batch_emb.
+        self.histories = None
+        if args.history == 1:
+            dims = [num_hidden * heads[l] for l in range(num_layers)]
+            self.histories = {view: History(self.ret_num if view in ['cf', 'ui'] else num_entity, dims,
+                                            args.hist_refresh, args.hist_staleness)
+                              for view in self.VIEWS}
+
+    def get_extra_state(self):
+        # the cached DropLearner edge weights and their refresh policies go into state_dict()
+        # with the parameters.
+        return {'ui_edge_weight': self.ui_edge_weight, 'kg_edge_weight': self.kg_edge_weight,
+                'subkg_edge_weight': self.subkg_edge_weight,
+                'weight_refresh': {view: policy.state_dict() for view, policy in self.weight_refresh.items()}}
+
+    def set_extra_state(self, state):
+        device = self.epsilon.device
+        state = dict(state)
+        for view, policy_state in state.pop('weight_refresh', {}).items():
+            self.weight_refresh[view].load_state_dict(
+                {k: v.to(device) if torch.is_tensor(v) else v for k, v in policy_state.items()})
+        for name, w in state.items():
+            setattr(self, name, None if w is None else w.to(device))
+
+    def resume(self, kg):
+        # after load_state_dict: the kg view propagates over the full KG, which is rebuilt
+        # identically, so its cached weights stay valid. The other views run on the dropout
+        # subgraphs of a new epoch and recompute theirs on the first step anyway.
+        if self.kg_edge_weight is not None:
+            self.weight_refresh['kg'].rebind(kg)
+
+    def phase_parameters(self, mode):
+        # (embedding tables, other parameters) that get gradients from the loss of each phase.
+        # cl_embed and user_embed are not used by any loss.
+        if mode == "cf":
+            tables = [self.embed]
+            modules = [self.gat_layers, self.sub_gat_layers, self.learner2]
+        elif mode == "kg":
+            tables = [self.kg_embed, self.subkg_embed]
+            modules = [self.kg_gat_layers, self.subkg_gat_layers, self.learner1, self.learner, self.decoder]
+        elif mode == "cl":
+            tables = [self.embed, self.kg_embed, self.subkg_embed]
+            modules = [self.sub_gat_layers, self.kg_gat_layers, self.subkg_gat_layers, self.contrast1, self.contrast2]
+        return tables, [p for m in modules for p in m.parameters()]
+
+    def run_layer(self, layer, g, h, res_attn=None, edge_weight=None):
+        # recompute the layer during backward instead of keeping its node/edge tensors alive.
+        if self.grad_checkpoint and torch.is_grad_enabled():
+            return checkpoint(layer, g, h, res_attn, edge_weight, use_reentrant=False)
+        return layer(g, h, res_attn=res_attn, edge_weight=edge_weight)
+
+    def learn_edge_weight(self, view, learner, x, g):
+        # (reg, edge weights) of the DropLearner of view on g. Under the --aug_refresh policy the
+        # learner only runs (and is trained) in refresh steps, the other steps reuse the cached
+        # detached weights and report the regularizer of the last refresh.
+        name = self.VIEWS[view][2]
+        policy = self.weight_refresh[view]
+        if getattr(self, name) is not None and not policy.due(g, x):
+            policy.reused()
+            return policy.reg, getattr(self, name)
+        with phase_timer.phase('drop_learner'):
+            reg, edge_weight = learner(x, g, temperature=0.7)
+        setattr(self, name, edge_weight.detach())
+        policy.refreshed(g, x, reg)
+        return reg, edge_weight
+
+    def new_epoch(self):
+        for policy in self.weight_refresh.values():
+            policy.new_epoch()
+
+    def refresh_counts(self):
+        # {view: (refreshes, reuses)} of the DropLearner edge weights since the last call.
+        return {view: policy.counts() for view, policy in self.weight_refresh.items()}
+
+    def calc_subkg_emb(self, g, drop_learn = False, history = None):
         all_embed = []
         h = self.subkg_embed
-        tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True),self.epsilon)))
         edge_weight = None
         reg = 0
         if drop_learn:
-            reg, edge_weight = self.learner(tmp, g, temperature = 0.7)
-            self.subkg_edge_weight = edge_weight.detach()
+            reg, edge_weight = self.learn_edge_weight('subkg', self.learner, l2_normalize(h, self.epsilon), g)
         else:
             edge_weight = self.subkg_edge_weight
-        all_embed.append(tmp)
+        all_embed.append(h)
         res_attn = None
         for l in range(self.num_layers):
-            h, res_attn = self.subkg_gat_layers[l](g, h, res_attn=res_attn, edge_weight = edge_weight)
+            h, res_attn = self.run_layer(self.subkg_gat_layers[l], g, h, res_attn, edge_weight)
             h = h.flatten(1)
-            tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True),self.epsilon)))
-            all_embed.append(tmp)
+            if history is not None:
+                history.fill(l, h)
+            all_embed.append(h)
         # output projection
-        logits, _ = self.subkg_gat_layers[-1](g, h, res_attn=res_attn, edge_weight = edge_weight)
-        logits = logits.mean(1)
-        all_embed.append(logits / (torch.max(torch.norm(logits, dim=1, keepdim=True),self.epsilon)))
-        all_embed = torch.cat(all_embed, 1)
+        logits, _ = self.run_layer(self.subkg_gat_layers[-1], g, h, res_attn, edge_weight)
+        all_embed.append(logits.mean(1))
+        all_embed = ConcatEmbedding(all_embed, self.epsilon)
         if drop_learn:
             return all_embed, reg
         else:
             return all_embed
     
-    def calc_kg_emb(self, g, drop_learn = False):
+    def calc_kg_emb(self, g, drop_learn = False, history = None):
         all_embed = []
         h = self.kg_embed
-        tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True),self.epsilon)))
         edge_weight = None
         reg = 0
         if drop_learn:
-            reg, edge_weight = self.learner1(tmp, g, temperature = 0.7)
-            self.kg_edge_weight = edge_weight.detach()
+            reg, edge_weight = self.learn_edge_weight('kg', self.learner1, l2_normalize(h, self.epsilon), g)
         else:
             edge_weight = self.kg_edge_weight
-        all_embed.append(tmp)
+        all_embed.append(h)
         res_attn = None
         for l in range(self.num_layers):
-            h, res_attn = self.kg_gat_layers[l](g, h, res_attn=res_attn, edge_weight = edge_weight)
+            h, res_attn = self.run_layer(self.kg_gat_layers[l], g, h, res_attn, edge_weight)
             h = h.flatten(1)
-            tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True),self.epsilon)))
-            all_embed.append(tmp)
+            if history is not None:
+                history.fill(l, h)
+            all_embed.append(h)
         # output projection
-        logits, _ = self.kg_gat_layers[-1](g, h, res_attn=res_attn, edge_weight = edge_weight)
-        logits = logits.mean(1)
-        all_embed.append(logits / (torch.max(torch.norm(logits, dim=1, keepdim=True),self.epsilon)))
-        all_embed = torch.cat(all_embed, 1)
+        logits, _ = self.run_layer(self.kg_gat_layers[-1], g, h, res_attn, edge_weight)
+        all_embed.append(logits.mean(1))
+        all_embed = ConcatEmbedding(all_embed, self.epsilon)
         if drop_learn:
             return all_embed, reg
         else:
             return all_embed
 
-    def calc_ui_emb(self, g, drop_learn = False):
+    def calc_ui_emb(self, g, drop_learn = False, history = None):
         all_embed = []
         h = self.embed
-        tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True), self.epsilon)))
         edge_weight = None
         reg = 0
         if drop_learn:
-            reg, edge_weight = self.learner2(tmp, g, temperature=0.7)
-            self.ui_edge_weight = edge_weight.detach()
+            reg, edge_weight = self.learn_edge_weight('ui', self.learner2, l2_normalize(h, self.epsilon), g)
         else:
             edge_weight = self.ui_edge_weight
-        all_embed.append(tmp)
+        all_embed.append(h)
         res_attn = None
         for l in range(self.num_layers):
-            h, res_attn = self.sub_gat_layers[l](g, h, res_attn=res_attn, edge_weight=edge_weight)
+            h, res_attn = self.run_layer(self.sub_gat_layers[l], g, h, res_attn, edge_weight)
             h = h.flatten(1)
-            tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True), self.epsilon)))
-            all_embed.append(tmp)
+            if history is not None:
+                history.fill(l, h)
+            all_embed.append(h)
         # output projection
-        logits, _ = self.sub_gat_layers[-1](g, h, res_attn=res_attn, edge_weight=edge_weight)
-        logits = logits.mean(1)
-        all_embed.append(logits / (torch.max(torch.norm(logits, dim=1, keepdim=True), self.epsilon)))
-        all_embed = torch.cat(all_embed, 1)
+        logits, _ = self.run_layer(self.sub_gat_layers[-1], g, h, res_attn, edge_weight)
+        all_embed.append(logits.mean(1))
+        all_embed = ConcatEmbedding(all_embed, self.epsilon)
         if drop_learn:
             return all_embed, reg
         else:
             return all_embed
 
-    def calc_cf_emb(self, g):
+    def calc_cf_emb(self, g, history = None):
         all_embed = []
         h = self.embed
-        tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True),self.epsilon)))
-        all_embed.append(tmp)
+        all_embed.append(h)
         res_attn = None
         for l in range(self.num_layers):
-            h, res_attn = self.gat_layers[l](g, h, res_attn=res_attn)
+            h, res_attn = self.run_layer(self.gat_layers[l], g, h, res_attn)
             h = h.flatten(1)
-            tmp = (h / (torch.max(torch.norm(h, dim=1, keepdim=True),self.epsilon)))
-            all_embed.append(tmp)
+            if history is not None:
+                history.fill(l, h)
+            all_embed.append(h)
         # output projection
-        logits, _ = self.gat_layers[-1](g, h, res_attn=res_attn)
-        logits = logits.mean(1)
-        all_embed.append(logits / (torch.max(torch.norm(logits, dim=1, keepdim=True),self.epsilon)))
-        all_embed = torch.cat(all_embed, 1)
+        logits, _ = self.run_layer(self.gat_layers[-1], g, h, res_attn)
+        all_embed.append(logits.mean(1))
+        all_embed = ConcatEmbedding(all_embed, self.epsilon)
         return all_embed
 
+    def full_emb(self, view, g, drop_learn=False, history=None):
+        if view == 'cf':
+            return self.calc_cf_emb(g, history), 0
+        calc = {'ui': self.calc_ui_emb, 'kg': self.calc_kg_emb, 'subkg': self.calc_subkg_emb}[view]
+        if drop_learn:
+            return calc(g, True, history)
+        return calc(g, False, history), 0
+
+    def batch_emb(self, view, g, nodes, drop_learn=False):
+        # rows `nodes` (unique) of full_emb(view, g): the layers run over the in-edges of the
+        # batch nodes only, the inputs of the other neighbors come from the history of the view.
+        # Refresh steps run full_emb and rewrite the history; the DropLearner is only trained
+        # and its edge weights only recomputed in those steps.
+        history = self.histories[view]
+        layers_name, table_name, weight_name = self.VIEWS[view]
+        layers, table = getattr(self, layers_name), getattr(self, table_name)
+        nodes = torch.as_tensor(nodes, dtype=torch.long, device=table.device)
+        block = history.block(g, nodes)
+        src = block.srcdata[dgl.NID]
+        n = len(nodes)
+        edge_weight = getattr(self, weight_name) if weight_name is not None else None
+        # forward("test") drops the cached edge weights; like learn_edge_weight, a DropLearner
+        # view then recomputes them instead of propagating without.
+        if history.needs_refresh(g, src[n:]) or (drop_learn and weight_name is not None and edge_weight is None):
+            embedding, reg = self.full_emb(view, g, drop_learn, history)
+            history.refreshed(g, reg)
+            history.step += 1
+            return embedding[nodes], reg
+        if edge_weight is not None:
+            edge_weight = edge_weight[block.edata[dgl.EID]]
+        all_embed = [l2_normalize(table[nodes], self.epsilon)]
+        h = table[src]
+        res_attn = None
+        for l in range(self.num_layers):
+            out, res_attn = self.run_layer(layers[l], block, h, res_attn, edge_weight)
+            out = out.flatten(1)
+            all_embed.append(l2_normalize(out, self.epsilon))
+            history.push(l, nodes, out)
+            h = torch.cat([out, history.pull(l, src[n:]).to(out.dtype)], 0)
+        logits, _ = self.run_layer(layers[-1], block, h, res_attn, edge_weight)
+        all_embed.append(l2_normalize(logits.mean(1), self.epsilon))
+        history.step += 1
+        return torch.cat(all_embed, 1), history.reg
+
     def calc_cf_loss(self, g, sub_g, kg, sub_kg, user_id, pos_item, neg_item):
         reg_ui, reg_kg = 0, 0
-        embedding_cf = self.calc_cf_emb(g)
-        embedding_ui, reg_ui = self.calc_ui_emb(sub_g, True)
-        embedding = torch.cat([embedding_cf, embedding_ui, self.ini], 1)
+        if self.histories is None:
+            embedding_cf = self.calc_cf_emb(g)
+            embedding_ui, reg_ui = self.calc_ui_emb(sub_g, True)
+            embedding = ConcatEmbedding([embedding_cf, embedding_ui, self.ini])
+        else:
+            nodes, (user_id, pos_item, neg_item) = batch_nodes(user_id, pos_item, neg_item)
+            embedding_cf, _ = self.batch_emb('cf', g, nodes)
+            embedding_ui, reg_ui = self.batch_emb('ui', sub_g, nodes, True)
+            embedding = torch.cat([embedding_cf, embedding_ui, self.ini[nodes]], 1)
         u_emb = embedding[user_id]
         p_emb = embedding[pos_item]
         n_emb = embedding[neg_item]
@@ -337,19 +452,24 @@ class myGAT(nn.Module):
 
     def calc_kg_loss(self, kg, sub_kg, h, r, pos_t, neg_t):
         weight = False
-        embedding, reg_kg = self.calc_kg_emb(kg, True)
-        sub_embedding, reg_subkg = self.calc_subkg_emb(sub_kg, True)
+        if self.histories is None:
+            embedding, reg_kg = self.calc_kg_emb(kg, True)
+            sub_embedding, reg_subkg = self.calc_subkg_emb(sub_kg, True)
+        else:
+            nodes, (h, pos_t, neg_t) = batch_nodes(h, pos_t, neg_t)
+            embedding, reg_kg = self.batch_emb('kg', kg, nodes, True)
+            sub_embedding, reg_subkg = self.batch_emb('subkg', sub_kg, nodes, True)
 
         h_emb = torch.cat([embedding[h], sub_embedding[h]], 0)
         pos_t_emb = torch.cat([embedding[pos_t], sub_embedding[pos_t]], 0)
         neg_t_emb = torch.cat([embedding[neg_t], sub_embedding[neg_t]], 0)
 
-        pos_score = self.decoder(h_emb, pos_t_emb, r)
-        neg_score = self.decoder(h_emb, neg_t_emb, r)
+        pos_score = self.decoder(h_emb, pos_t_emb, r).float()
+        neg_score = self.decoder(h_emb, neg_t_emb, r).float()
         aug_edge_weight = 1
         if weight:
             emb = torch.cat([self.kg_embed, self.subkg_embed], 0)
-            emb = (emb / (torch.max(torch.norm(emb, dim=1, keepdim=True),self.epsilon)))
+            emb = l2_normalize(emb, self.epsilon)
             _, aug_edge_weight = self.learner1.get_weight(emb[h], emb[pos_t], temperature = 0.7)
             #print(aug_edge_weight.size(), neg_score.size())
         #loss
@@ -357,6 +477,13 @@ class myGAT(nn.Module):
         return base_loss, reg_kg
 
     def calc_cl_loss(self, sub_g, sub_kg, kg, item):
+        if self.histories is not None:
+            nodes, (idx,) = batch_nodes(item)
+            kg_emb = self.batch_emb('kg', kg, nodes)[0][idx]
+            subkg_emb = self.batch_emb('subkg', sub_kg, nodes)[0][idx]
+            ui_emb = self.batch_emb('ui', sub_g, nodes + self.user_size)[0][idx]
+            loss = self.cl_alpha * self.contrast1(ui_emb, subkg_emb) + self.cl_alpha * self.contrast2(kg_emb, subkg_emb)
+            return loss
         embedding = self.calc_ui_emb(sub_g)
         # embedding, reg = self.calc_ui_emb(g, True)
         kg_embedding = self.calc_kg_emb(kg)
@@ -384,7 +511,59 @@ class myGAT(nn.Module):
             embedding_ui = self.calc_ui_emb(g)
             embedding_cf = self.calc_cf_emb(g)
             embedding_kg = self.calc_kg_emb(kg)
-            embedding_kg = torch.cat([self.user_embed, embedding_kg[:self.item_size]], 0)
-            embedding = torch.cat([embedding_ui, embedding_cf, embedding_kg, self.ini], 1)
+            embedding_kg = RowStack([self.user_embed, embedding_kg], [self.user_size, self.item_size])
+            # indexed by the evaluator, only the requested rows are gathered and concatenated.
+            embedding = ConcatEmbedding([embedding_ui, embedding_cf, embedding_kg, self.ini])
+
+            return embedding
+
+class PartitionedKG(nn.Module):
+    # The KG view of myGAT (kg_embed, kg_gat_layers, decoder) on one partition: kg_embed only
+    # holds the rows of the inner entities of this rank, the halo rows are exchanged before
+    # every layer. The GAT layers and the decoder are replicated on every rank. Only the
+    # DistMult loss of the kg view is trained, without the subkg view and the DropLearner.
+    def __init__(self, args, n_inner, num_etypes, num_hidden, num_classes, num_layers,
+                 heads, activation, feat_drop, attn_drop, negative_slope, residual):
+        super(PartitionedKG, self).__init__()
+        self.num_layers = num_layers
+        self.kge_size = args.kge_size
+        self.layer_dim = sum([num_hidden * heads[l] for l in range(num_layers)]) + num_classes
+        self.kg_embed = nn.Parameter(torch.zeros((n_inner, args.kge_size)))
+        nn.init.xavier_normal_(self.kg_embed, gain=1.414)
+        # distributed.sync_grads leaves the partitioned rows to their owner.
+        self.kg_embed.partitioned = True
+        self.kg_gat_layers = gat_stack(self.kge_size, num_hidden, num_classes, num_layers, heads, activation,
+                                       feat_drop, attn_drop, negative_slope, residual, args.alpha)
+        self.decoder = DistMult(num_etypes, self.kge_size + self.layer_dim)
+        self.register_buffer('epsilon', torch.FloatTensor([1e-12]), persistent=False)
+
+    def phase_parameters(self, mode):
+        return [self.kg_embed], [p for m in [self.kg_gat_layers, self.decoder] for p in m.parameters()]
+
+    def calc_kg_emb(self, block, halo_plan):
+        # calc_kg_emb of myGAT for the inner entities.
+        all_embed = []
+        h = self.kg_embed
+        all_embed.append(l2_normalize(h, self.epsilon))
+        res_attn = None
+        for l in range(self.num_layers):
+            h, res_attn = self.kg_gat_layers[l](block, torch.cat([h, exchange(h, halo_plan)], 0), res_attn)
+            h = h.flatten(1)
+            all_embed.append(l2_normalize(h, self.epsilon))
+        # output projection
+        logits, _ = self.kg_gat_layers[-1](block, torch.cat([h, exchange(h, halo_plan)], 0), res_attn)
+        logits = logits.mean(1)
+        all_embed.append(l2_normalize(logits, self.epsilon))
+        return torch.cat(all_embed, 1)
 
-            return embedding
\ No newline at end of file
+    def forward(self, block, halo_plan, tail_plan, h, r, n_tails):
+        # h are local ids of inner heads; tail_plan fetches the positive tails followed by the
+        # negative tails from their owners.
+        embedding = self.calc_kg_emb(block, halo_plan)
+        t_emb = exchange(embedding, tail_plan)
+        h_emb = embedding[h]
+        thW = self.decoder.W[r]
+        left = torch.bmm(torch.unsqueeze(h_emb, 1), thW)
+        pos_score = torch.bmm(left, torch.unsqueeze(t_emb[:n_tails], 2)).squeeze(-1).squeeze(-1).float()
+        neg_score = torch.bmm(left, torch.unsqueeze(t_emb[n_tails:], 2)).squeeze(-1).squeeze(-1).float()
+        return F.softplus(-neg_score + pos_score).mean()
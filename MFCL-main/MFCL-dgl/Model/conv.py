@@ -8,7 +8,9 @@ Author: Yiran Shi
 import torch as th
 from torch import nn
 import torch
+import weakref
 from dgl import function as fn
+from dgl import ops as dgl_ops
 from dgl.nn.pytorch import edge_softmax
 from dgl._ffi.base import DGLError
 from dgl.nn.pytorch.utils import Identity
@@ -16,7 +18,9 @@ from dgl.utils import expand_as_pair
 from Filter import Filter, IFilter
 from Normal import prob
 import numpy as np
-from scipy import signal
+from utility.amp import fp32
+
+_in_degree_checked = weakref.WeakSet()
 
 class DropLearner(nn.Module):
     def __init__(self, node_dim, edge_dim = None, mlp_edge_model_dim = 64):
@@ -81,6 +85,7 @@ class DropLearner(nn.Module):
         return reg.detach(), aug_edge_weight.detach()
     
     def forward(self, node_emb, graph, temperature = 0.5, relation_emb = None, edge_type = None):
+        from scipy import signal
         if self.concat:
             w_con = node_emb
             graph.srcdata.update({'in': w_con})
@@ -124,21 +129,21 @@ class DropLearner(nn.Module):
             filtered_w_src_high_id = filtered_w_src_high[
                                      np.random.choice(filtered_w_src_high.shape[0], size_high, replace=False), :]
             w_src_high = torch.tensor(filtered_w_src_high_id)
-            w_src_high = w_src_high.cuda()
+            w_src_high = w_src_high.to(node_emb.device)
 
             filtered_w_src_low = np.float32(filtered_x11)
             size_low = int(0.2 * filtered_w_src_low.shape[0])
             filtered_w_src_low_id = filtered_w_src_low[
                                     np.random.choice(filtered_w_src_low.shape[0], size_low, replace=False), :]
             w_src_low = torch.tensor(filtered_w_src_low_id)
-            w_src_low = w_src_low.cuda()
+            w_src_low = w_src_low.to(node_emb.device)
 
             filtered_w_src_band = np.float32(filtered_xp1)
             size_band = filtered_w_src_band.shape[0] - size_high - size_low
             filtered_w_src_band_id = filtered_w_src_band[
                                      np.random.choice(filtered_w_src_band.shape[0], size_band, replace=False), :]
             w_src_band = torch.tensor(filtered_w_src_band_id)
-            w_src_band = w_src_band.cuda()
+            w_src_band = w_src_band.to(node_emb.device)
 
             w_src = torch.cat([w_src_low, w_src_band, w_src_high], 0)
             # MLP
@@ -172,19 +177,19 @@ class DropLearner(nn.Module):
             filtered_w_dst_high_id = filtered_w_dst_high[
                                      np.random.choice(filtered_w_dst_high.shape[0], size_high, replace=False), :]
             w_dst_high = torch.tensor(filtered_w_dst_high_id)
-            w_dst_high = w_dst_high.cuda()
+            w_dst_high = w_dst_high.to(node_emb.device)
 
             filtered_w_dst_low = np.float32(filtered_x22)
             filtered_w_dst_low_id = filtered_w_dst_low[
                                     np.random.choice(filtered_w_dst_low.shape[0], size_low, replace=False), :]
             w_dst_low = torch.tensor(filtered_w_dst_low_id)
-            w_dst_low = w_dst_low.cuda()
+            w_dst_low = w_dst_low.to(node_emb.device)
 
             filtered_w_dst_band = np.float32(filtered_xp2)
             filtered_w_dst_band_id = filtered_w_dst_band[
                                      np.random.choice(filtered_w_dst_band.shape[0], size_band, replace=False), :]
             w_dst_band = torch.tensor(filtered_w_dst_band_id)
-            w_dst_band = w_dst_band.cuda()
+            w_dst_band = w_dst_band.to(node_emb.device)
 
             w_dst = torch.cat([w_dst_low, w_dst_band, w_dst_high], 0)
             # MLP
@@ -257,6 +262,7 @@ class myGATConv(nn.Module):
         if bias:
             self.bias_param = nn.Parameter(th.zeros((1, num_heads, out_feats)))
         self.alpha = alpha
+        self._fused = False
 
     def reset_parameters(self):
         gain = nn.init.calculate_gain('relu')
@@ -273,9 +279,13 @@ class myGATConv(nn.Module):
     def set_allow_zero_in_degree(self, set_value):
         self._allow_zero_in_degree = set_value
 
+    def set_fused(self, set_value):
+        self._fused = set_value
+
     def forward(self, graph, feat, res_attn=None, edge_weight = None):
         with graph.local_scope():
-            if not self._allow_zero_in_degree:
+            # graphs are not mutated after construction, so every graph is checked once.
+            if not self._allow_zero_in_degree and graph not in _in_degree_checked:
                 if (graph.in_degrees() == 0).any():
                     raise DGLError('There are 0-in-degree nodes in the graph, '
                                    'output for those nodes will be invalid. '
@@ -286,6 +296,9 @@ class myGATConv(nn.Module):
                                    'the issue. Setting ``allow_zero_in_degree`` '
                                    'to be `True` when constructing this module will '
                                    'suppress the check and let the code run.')
+                _in_degree_checked.add(graph)
+            if self._fused and not isinstance(feat, tuple) and not graph.is_block:
+                return self._fused_forward(graph, feat, res_attn, edge_weight)
             if isinstance(feat, tuple):
                 h_src = self.feat_drop(feat[0])
                 h_dst = self.feat_drop(feat[1])
@@ -297,6 +310,7 @@ class myGATConv(nn.Module):
                 h_src = h_dst = self.feat_drop(feat)
                 feat_src = feat_dst = self.fc(h_src).view(-1, self._num_heads, self._out_feats)
                 if graph.is_block:
+                    h_dst = h_src[:graph.number_of_dst_nodes()]
                     feat_dst = feat_src[:graph.number_of_dst_nodes()]
             el = (feat_src * self.attn_l).sum(dim=-1).unsqueeze(-1)
             er = (feat_dst * self.attn_r).sum(dim=-1).unsqueeze(-1)
@@ -304,12 +318,14 @@ class myGATConv(nn.Module):
             graph.dstdata.update({'er': er})
             graph.apply_edges(fn.u_add_v('el', 'er', 'e'))
             e = self.leaky_relu(graph.edata.pop('e'))
-            # compute softmax
-            graph.edata['a'] = self.attn_drop(edge_softmax(graph, e))
-            if edge_weight is not None:
-                graph.edata['a'] = graph.edata['a'] * edge_weight
-            if res_attn is not None:
-                graph.edata['a'] = graph.edata['a'] * (1-self.alpha) + res_attn * self.alpha
+            # compute softmax, kept in float32 under autocast
+            with fp32(e):
+                a = self.attn_drop(edge_softmax(graph, e.float()))
+                if edge_weight is not None:
+                    a = a * edge_weight
+                if res_attn is not None:
+                    a = a * (1-self.alpha) + res_attn * self.alpha
+            graph.edata['a'] = a.to(feat_src.dtype)
             # message passing
             graph.update_all(fn.u_mul_e('ft', 'a', 'm'),
                              fn.sum('m', 'ft'))
@@ -323,7 +339,33 @@ class myGATConv(nn.Module):
             # activation
             if self.activation:
                 rst = self.activation(rst)
-            return rst, graph.edata.pop('a').detach()
+            return rst, a.detach()
+
+    def _fused_forward(self, graph, feat, res_attn=None, edge_weight=None):
+        # Same output as the default path with fewer materialized edge tensors:
+        # el/er come out of one batched product, the edge score is one SDDMM,
+        # edge weighting/res_attn blending stay on one edge tensor and the
+        # aggregation is one SpMM without going through graph.update_all.
+        h = self.feat_drop(feat)
+        feat_src = self.fc(h).view(-1, self._num_heads, self._out_feats)
+        attn = th.stack([self.attn_l[0], self.attn_r[0]], -1)
+        elr = th.einsum('nhd,hdk->nhk', feat_src, attn.to(feat_src.dtype))
+        e = dgl_ops.u_add_v(graph, elr[..., :1].contiguous(), elr[..., 1:].contiguous())
+        e = self.leaky_relu(e)
+        with fp32(e):
+            a = self.attn_drop(edge_softmax(graph, e.float()))
+            if edge_weight is not None:
+                a = a * edge_weight
+            if res_attn is not None:
+                a = th.lerp(a, res_attn, self.alpha)
+        rst = dgl_ops.u_mul_e_sum(graph, feat_src, a.to(feat_src.dtype))
+        if self.res_fc is not None:
+            rst = rst + self.res_fc(h).view(h.shape[0], -1, self._out_feats)
+        if self.bias:
+            rst = rst + self.bias_param
+        if self.activation:
+            rst = self.activation(rst)
+        return rst, a.detach()
 
 class DropLearner1(nn.Module):
     def __init__(self, node_dim, edge_dim=None, mlp_edge_model_dim=64):
@@ -388,6 +430,7 @@ class DropLearner1(nn.Module):
         return reg.detach(), aug_edge_weight.detach()
 
     def forward(self, node_emb, graph, temperature=0.5, relation_emb=None, edge_type=None):
+        from scipy import signal
         if self.concat1:
             w_con = node_emb
             graph.srcdata.update({'in': w_con})
@@ -431,21 +474,21 @@ class DropLearner1(nn.Module):
             filtered_w_src_high_id = filtered_w_src_high[
                                      np.random.choice(filtered_w_src_high.shape[0], size_high, replace=False), :]
             w_src_high = torch.tensor(filtered_w_src_high_id)
-            w_src_high = w_src_high.cuda()
+            w_src_high = w_src_high.to(node_emb.device)
 
             filtered_w_src_low = np.float32(filtered_x11)
             size_low = int(0.2 * filtered_w_src_low.shape[0])
             filtered_w_src_low_id = filtered_w_src_low[
                                     np.random.choice(filtered_w_src_low.shape[0], size_low, replace=False), :]
             w_src_low = torch.tensor(filtered_w_src_low_id)
-            w_src_low = w_src_low.cuda()
+            w_src_low = w_src_low.to(node_emb.device)
 
             filtered_w_src_band = np.float32(filtered_xp1)
             size_band = filtered_w_src_band.shape[0] - size_high - size_low
             filtered_w_src_band_id = filtered_w_src_band[
                                      np.random.choice(filtered_w_src_band.shape[0], size_band, replace=False), :]
             w_src_band = torch.tensor(filtered_w_src_band_id)
-            w_src_band = w_src_band.cuda()
+            w_src_band = w_src_band.to(node_emb.device)
 
             w_src = torch.cat([w_src_low, w_src_band, w_src_high], 0)
             # MLP
@@ -479,19 +522,19 @@ class DropLearner1(nn.Module):
             filtered_w_dst_high_id = filtered_w_dst_high[
                                      np.random.choice(filtered_w_dst_high.shape[0], size_high, replace=False), :]
             w_dst_high = torch.tensor(filtered_w_dst_high_id)
-            w_dst_high = w_dst_high.cuda()
+            w_dst_high = w_dst_high.to(node_emb.device)
 
             filtered_w_dst_low = np.float32(filtered_x22)
             filtered_w_dst_low_id = filtered_w_dst_low[
                                     np.random.choice(filtered_w_dst_low.shape[0], size_low, replace=False), :]
             w_dst_low = torch.tensor(filtered_w_dst_low_id)
-            w_dst_low = w_dst_low.cuda()
+            w_dst_low = w_dst_low.to(node_emb.device)
 
             filtered_w_dst_band = np.float32(filtered_xp2)
             filtered_w_dst_band_id = filtered_w_dst_band[
                                      np.random.choice(filtered_w_dst_band.shape[0], size_band, replace=False), :]
             w_dst_band = torch.tensor(filtered_w_dst_band_id)
-            w_dst_band = w_dst_band.cuda()
+            w_dst_band = w_dst_band.to(node_emb.device)
 
             w_dst = torch.cat([w_dst_low, w_dst_band, w_dst_high], 0)
             # MLP
@@ -561,6 +604,7 @@ class DropLearner2(nn.Module):
                     m.bias.data.fill_(0.0)
 
     def forward(self, node_emb, graph, temperature=0.5, relation_emb=None, edge_type=None):
+        from scipy import signal
         if self.concat2:
             w_con = node_emb
             graph.srcdata.update({'in': w_con})
@@ -597,13 +641,13 @@ class DropLearner2(nn.Module):
             size_high = int(0.2 * filtered_w_src_high.shape[0])
             filtered_w_src_high_id = filtered_w_src_high[np.random.choice(filtered_w_src_high.shape[0], size_high, replace=False), : ]
             w_src_high = torch.tensor(filtered_w_src_high_id)
-            w_src_high = w_src_high.cuda()
+            w_src_high = w_src_high.to(node_emb.device)
 
             filtered_w_src_low = np.float32(filtered_x11)
             size_low = filtered_w_src_low.shape[0]- size_high
             filtered_w_src_low_id = filtered_w_src_low[np.random.choice(filtered_w_src_low.shape[0], size_low, replace=False), :]
             w_src_low = torch.tensor(filtered_w_src_low_id)
-            w_src_low = w_src_low.cuda()
+            w_src_low = w_src_low.to(node_emb.device)
 
             w_src = torch.cat([w_src_low, w_src_high], 0)
             # MLP
@@ -632,14 +676,14 @@ class DropLearner2(nn.Module):
             filtered_w_dst_high_id = filtered_w_dst_high[
                                      np.random.choice(filtered_w_dst_high.shape[0], size_high, replace=False), :]
             w_dst_high = torch.tensor(filtered_w_dst_high_id)
-            w_dst_high = w_dst_high.cuda()
+            w_dst_high = w_dst_high.to(node_emb.device)
 
             filtered_w_dst_low = np.float32(filtered_x22)
             size_low = filtered_w_dst_low.shape[0] - size_high
             filtered_w_dst_low_id = filtered_w_dst_low[
                                     np.random.choice(filtered_w_dst_low.shape[0], size_low, replace=False), :]
             w_dst_low = torch.tensor(filtered_w_dst_low_id)
-            w_dst_low = w_dst_low.cuda()
+            w_dst_low = w_dst_low.to(node_emb.device)
 
             w_dst = torch.cat([w_dst_low, w_dst_high], 0)
             # MLP
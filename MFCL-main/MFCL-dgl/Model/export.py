@@ -0,0 +1,87 @@
+"""
+Exports the user and item embeddings of a trained model for serve.py: the rows of
+model("test") the Evaluator scores with, together with the training interactions (as a CSR)
+the server excludes from the recommendations. Written to --emb_path, by default
+{proj_path}output/{dataset}/embeddings.npz. With --export_graph the propagation is also
+written as a DGL-free graph (see inference.py) next to it, inference.pt for torchscript
+(torch.jit.load(path)() returns model("test"), in the renumbered ids with --node_order)
+or inference.onnx. The embeddings are always written by the dataset ids. With
+--export_ckpt none --kg_state <part_dir>/kg_state.pt the KG view trained by
+partition_train.py is exported.
+
+$ python export.py --dataset movie-lens --export_ckpt best
+$ python export.py --dataset movie-lens --export_ckpt best --export_graph torchscript
+"""
+from utility.helper import ensureDir
+from utility.parser import parse_args
+from utility.amp import get_device
+from utility.checkpoint import Checkpointer
+from utility.serving import emb_path, save_embeddings
+from main import load_data, load_pretrained_data, build_model, build_graphs
+from time import time
+import os
+import sys
+import torch
+
+def load_weights(args, model, num_layers, device):
+    # returns the checkpoint file the weights were loaded from, None for --export_ckpt none.
+    if args.export_ckpt == 'none':
+        return None
+    if os.path.isfile(args.export_ckpt):
+        path = args.export_ckpt
+    else:
+        ckpt_dir = args.ckpt_dir or '{}weights/{}/{}/{}_{}/'.format(args.weights_path, args.dataset, args.model_type, num_layers, args.heads)
+        path = None
+        if os.path.isdir(ckpt_dir):
+            checkpointer = Checkpointer(ckpt_dir, args.keep_best)
+            path = checkpointer.best() if args.export_ckpt == 'best' else checkpointer.latest()
+            checkpointer.close()
+        if path is None:
+            sys.exit('no %s checkpoint in %s' % (args.export_ckpt, ckpt_dir))
+    state = torch.load(path, map_location=device, weights_only=False)
+    model.load_state_dict(state['model'])
+    return path
+
+def export_graph(args, model, g, kg, save_dir):
+    from inference import InferenceGAT
+    # the onnx exporter has no sparse csr tensors, the onnx graph aggregates with index_add.
+    infer = InferenceGAT.from_model(model, g, kg, spmm=args.export_graph != 'onnx')
+    if args.export_graph == 'torchscript':
+        path = os.path.join(save_dir, 'inference.pt')
+        torch.jit.script(infer).save(path)
+    else:
+        path = os.path.join(save_dir, 'inference.onnx')
+        try:
+            torch.onnx.export(infer, (), path, output_names=['embedding'], opset_version=17)
+        except Exception as e:
+            print('onnx export failed (%s: %s), the graph was not exported.' % (type(e).__name__, e))
+            return None
+    return path
+
+if __name__ == '__main__':
+    args = parse_args()
+    t0 = time()
+    data_generator = load_data(args)
+    device = get_device(args)
+    model, num_layers = build_model(args, data_generator, load_pretrained_data(args), device)
+    path = load_weights(args, model, num_layers, device)
+    g, kg, _ = build_graphs(data_generator, device)
+    model.eval()
+    n_users, n_items = data_generator.n_users, data_generator.n_items
+    with torch.no_grad():
+        embedding = model("test", g, kg)
+        user = embedding[:n_users].cpu().numpy()
+        item = embedding[n_users: n_users + n_items].cpu().numpy()
+    # served by the dataset ids, also when the model was trained with --node_order.
+    user, item, seen = data_generator.to_dataset_ids(user, item, data_generator.train_store)
+    save_path = emb_path(args)
+    ensureDir(save_path)
+    save_embeddings(save_path, user, item, seen,
+                    dataset=args.dataset, checkpoint=path or 'none')
+    print('exported %d users and %d items of dim %d from %s to %s [%.1fs]' % (
+        n_users, n_items, user.shape[1], path or 'the untrained model', save_path, time() - t0))
+    if args.export_graph != 'none':
+        t1 = time()
+        graph_path = export_graph(args, model, g, kg, os.path.dirname(save_path))
+        if graph_path is not None:
+            print('exported the %s inference graph to %s [%.1fs]' % (args.export_graph, graph_path, time() - t1))
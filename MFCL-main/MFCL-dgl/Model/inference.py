@@ -0,0 +1,130 @@
+"""
+Inference-only version of myGAT.forward("test") on plain tensors, without DGL and the
+DropLearners, for torch.jit.script or ONNX export. The in-edges of every node are sorted by
+destination once when the module is built (a CSR of the graph); every GAT layer computes the
+edge scores from the per-node attention terms, a segment softmax over the in-edges and one
+CSR SpMM per head (torch.sparse). With spmm=False the softmax and the aggregation use
+scatter_reduce/index_add instead, which the ONNX exporter supports but which is slower.
+
+    infer = InferenceGAT.from_model(model, g, kg)
+    torch.jit.script(infer).save('inference.pt')
+    embedding = torch.jit.load('inference.pt')()      # == model("test", g, kg)[:]
+"""
+from typing import Optional, Tuple
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+def in_edges(g):
+    # (indptr, src, dst) of the edges of g sorted by destination, as int64 tensors.
+    src, dst = [e.cpu().long() for e in g.edges()]
+    order = torch.argsort(dst, stable=True)
+    src, dst = src[order].contiguous(), dst[order].contiguous()
+    indptr = torch.zeros(g.num_nodes() + 1, dtype=torch.long)
+    indptr[1:] = torch.cumsum(torch.bincount(dst, minlength=g.num_nodes()), 0)
+    return indptr, src, dst
+
+# the activations of myGATConv the scripted layer can apply, by name.
+ACTIVATIONS = {None: '', F.elu: 'elu', F.relu: 'relu'}
+
+class SparseGATConv(nn.Module):
+    # myGATConv in eval mode (no dropout) without edge weights.
+    def __init__(self, conv):
+        super(SparseGATConv, self).__init__()
+        self.num_heads = conv._num_heads
+        self.out_feats = conv._out_feats
+        self.register_buffer('weight', conv.fc.weight.detach().clone())
+        self.register_buffer('attn_l', conv.attn_l.detach()[0].clone())
+        self.register_buffer('attn_r', conv.attn_r.detach()[0].clone())
+        self.register_buffer('bias', conv.bias_param.detach().clone() if conv.bias else torch.zeros(1, self.num_heads, self.out_feats))
+        # 0: no residual, 1: identity, 2: linear.
+        self.residual = 0 if conv.res_fc is None else (2 if isinstance(conv.res_fc, nn.Linear) else 1)
+        self.register_buffer('res_weight', conv.res_fc.weight.detach().clone() if self.residual == 2 else torch.zeros(0))
+        self.negative_slope = float(conv.leaky_relu.negative_slope)
+        self.alpha = float(conv.alpha)
+        if conv.activation not in ACTIVATIONS:
+            raise ValueError('myGATConv activation %r has no inference version, add it to ACTIVATIONS.' % (conv.activation,))
+        self.activation = ACTIVATIONS[conv.activation]
+
+    def forward(self, h, indptr, src, dst, res_attn: Optional[torch.Tensor], spmm: bool) -> Tuple[torch.Tensor, torch.Tensor]:
+        n = h.shape[0]
+        feat = F.linear(h, self.weight).view(n, self.num_heads, self.out_feats)
+        el = (feat * self.attn_l).sum(-1)
+        er = (feat * self.attn_r).sum(-1)
+        e = F.leaky_relu(el[src] + er[dst], self.negative_slope)
+        # edge softmax over the in-edges of every node.
+        if spmm:
+            ex = torch.exp(e - torch.segment_reduce(e, 'max', offsets=indptr)[dst])
+            denom = torch.segment_reduce(ex, 'sum', offsets=indptr)
+        else:
+            index = dst.unsqueeze(1).expand(e.shape[0], e.shape[1])
+            e_max = torch.full((n, e.shape[1]), float('-inf'), dtype=e.dtype, device=e.device)
+            ex = torch.exp(e - e_max.scatter_reduce(0, index, e, reduce='amax', include_self=True)[dst])
+            denom = torch.zeros((n, e.shape[1]), dtype=e.dtype, device=e.device).index_add(0, dst, ex)
+        a = ex / denom[dst]
+        if res_attn is not None:
+            # the output layer (1 head) broadcasts against the attention of a multi-head layer.
+            a = a * (1 - self.alpha) + res_attn * self.alpha
+        if spmm:
+            rst = torch.stack([torch.sparse.mm(torch.sparse_csr_tensor(indptr, src, a[:, k], (n, n)),
+                                               feat[:, k if self.num_heads > 1 else 0])
+                               for k in range(a.shape[1])], 1)
+        else:
+            msg = feat[src] * a.unsqueeze(-1)
+            rst = torch.zeros((n, msg.shape[1], self.out_feats), dtype=msg.dtype, device=msg.device).index_add(0, dst, msg)
+        if self.residual == 1:
+            rst = rst + h.view(n, -1, self.out_feats)
+        elif self.residual == 2:
+            rst = rst + F.linear(h, self.res_weight).view(n, -1, self.out_feats)
+        rst = rst + self.bias
+        if self.activation == 'elu':
+            rst = F.elu(rst)
+        elif self.activation == 'relu':
+            rst = F.relu(rst)
+        return rst, a
+
+class SparseGATStack(nn.Module):
+    # calc_cf_emb/calc_ui_emb/calc_kg_emb of myGAT: the normalized input and layer outputs, concatenated.
+    def __init__(self, layers, graph, spmm=True):
+        super(SparseGATStack, self).__init__()
+        self.layers = nn.ModuleList([SparseGATConv(layer) for layer in layers])
+        indptr, src, dst = graph
+        self.register_buffer('indptr', indptr)
+        self.register_buffer('src', src)
+        self.register_buffer('dst', dst)
+        self.spmm = spmm
+
+    def forward(self, h):
+        all_embed = [F.normalize(h, dim=1, eps=1e-12)]
+        res_attn: Optional[torch.Tensor] = None
+        n_layers = len(self.layers)
+        for i, layer in enumerate(self.layers):
+            out, res_attn = layer(h, self.indptr, self.src, self.dst, res_attn, self.spmm)
+            if i < n_layers - 1:
+                h = out.flatten(1)
+            else:
+                h = out.mean(1)
+            all_embed.append(F.normalize(h, dim=1, eps=1e-12))
+        return torch.cat(all_embed, 1)
+
+class InferenceGAT(nn.Module):
+    # forward() returns the full (users + items) x dim embedding of myGAT.forward("test").
+    def __init__(self, model, g, kg, spmm=True):
+        super(InferenceGAT, self).__init__()
+        cf_graph, kg_graph = in_edges(g), in_edges(kg)
+        self.ui = SparseGATStack(model.sub_gat_layers, cf_graph, spmm)
+        self.cf = SparseGATStack(model.gat_layers, cf_graph, spmm)
+        self.kg = SparseGATStack(model.kg_gat_layers, kg_graph, spmm)
+        self.register_buffer('embed', model.embed.detach().cpu().clone())
+        self.register_buffer('kg_embed', model.kg_embed.detach().cpu().clone())
+        self.register_buffer('user_embed', model.user_embed.detach().cpu().clone())
+        self.register_buffer('ini', model.ini.detach().cpu().clone())
+        self.item_size = int(model.item_size)
+
+    @classmethod
+    def from_model(cls, model, g, kg, spmm=True):
+        return cls(model, g, kg, spmm).cpu().eval()
+
+    def forward(self):
+        embedding_kg = torch.cat([self.user_embed, self.kg(self.kg_embed)[:self.item_size]], 0)
+        return torch.cat([self.ui(self.embed), self.cf(self.embed), embedding_kg, self.ini], 1)
@@ -4,15 +4,28 @@ Author: Yiran Shi
 """
 
 from utility.helper import *
-from utility.batch_test import *
+from utility.parser import parse_args
+from utility.loader_kgat import KGAT_loader
+from utility.batch_test import Evaluator
+from utility.amp import get_device, autocast, get_scaler, step
+from utility.optim import build_optimizers
+from utility.checkpoint import Checkpointer, capture, restore
+from utility.augment import SubgraphProducer
+from utility.partition import data_signature
+from utility.async_eval import AsyncEvaluator
+from utility import distributed
+from utility.profiler import phase_timer
 from time import time
 from GNN import myGAT
+import numpy as np
 import torch
 import torch.nn.functional as F
 import dgl
-import multiprocessing
 import os
-cores = multiprocessing.cpu_count() // 2
+import sys
+
+def load_data(args):
+    return KGAT_loader(args=args, path=args.data_path + args.dataset)
 
 def load_pretrained_data(args):
     pre_model = 'mf'
@@ -24,47 +37,48 @@ def load_pretrained_data(args):
         pretrain_data = None
     return pretrain_data
 
-if __name__ == '__main__':
-    torch.manual_seed(2023)
-    np.random.seed(2023)
-    args = parse_args()
-    os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
-    """
-    *********************************************************
-    Load Data from data_generator function.
-    """
-    config = dict()
-    config['n_users'] = data_generator.n_users
-    config['n_items'] = data_generator.n_items
-    config['n_relations'] = data_generator.n_relations
-    config['n_entities'] = data_generator.n_entities
-    t0 = time()
-    """
-    *********************************************************
-    Use the pretrained data to initialize the embeddings.
-    """
-    # parser.add_argument('--pretrain', type=int, default=-1, help = '0: No pretrain, -1: Pretrain with the learned embeddings, 1:Pretrain with stored models.')
-    if args.pretrain in [-1, -2]:
-        pretrain_data = load_pretrained_data(args)
-    else:
-        pretrain_data = None
-    """
-    *********************************************************
-    Select one of the models.
-    """
+def build_model(args, data_generator, pretrain_data, device):
     # parser.add_argument('--layer_size', nargs='?', default='[64, 32, 16]', help='Output sizes of every layer')
     weight_size = eval(args.layer_size)
     num_layers = len(weight_size) - 2
     heads = [args.heads] * num_layers + [1]
-    print(config['n_users'], config['n_entities'], args.kge_size, config['n_relations'])
+    print(data_generator.n_users, data_generator.n_entities, args.kge_size, data_generator.n_relations)
+
+    model = myGAT(args, data_generator.n_entities, data_generator.n_relations + 1, weight_size[-2], weight_size[-1], num_layers, heads, F.elu, 0.1, 0., 0.01, False, pretrain=data_generator.reorder_pretrained(pretrain_data)).to(device)
+    if args.kg_state:
+        load_kg_state(model, args, device)
+    return model, num_layers
+
+def load_kg_state(model, args, device):
+    # the rows and layers trained by partition_train.py, under the myGAT state_dict names;
+    # everything else keeps its initialization. The rows are only valid for the entity ids
+    # of the same data files and --node_order.
+    saved = torch.load(args.kg_state, map_location=device)
+    if not isinstance(saved, dict) or saved.get('signature') != data_signature(args):
+        raise ValueError('%s was not trained on these data files and --node_order %s, re-run partition_train.py.'
+                         % (args.kg_state, args.node_order))
+    if saved['n_nodes'] != model.kg_embed.shape[0]:
+        raise ValueError('%s has %d entities, the model %d.' % (args.kg_state, saved['n_nodes'], model.kg_embed.shape[0]))
+    state = saved['state']
+    _, unexpected = model.load_state_dict(state, strict=False)
+    if unexpected:
+        raise ValueError('%s has parameters myGAT does not have: %s' % (args.kg_state, ', '.join(unexpected)))
+    print('load the KG state (%s) from %s' % (', '.join(sorted({k.split('.')[0] for k in state})), args.kg_state))
+
+def build_kg_graph(data_generator):
+    kg_adjM = sum(data_generator.kg_lap_list)
+    kg = dgl.DGLGraph(kg_adjM)
+    kg = dgl.remove_self_loop(kg)
+    kg = dgl.add_self_loop(kg)
+    return kg
 
-    model = myGAT(args, config['n_entities'], config['n_relations'] + 1, weight_size[-2], weight_size[-1], num_layers, heads, F.elu, 0.1, 0., 0.01, False, pretrain=pretrain_data).cuda()
+def build_graphs(data_generator, device):
     adjM = data_generator.lap_list
     print(len(adjM.nonzero()[0]))
     g = dgl.DGLGraph(adjM)
     g = dgl.remove_self_loop(g)
     g = dgl.add_self_loop(g)
-    g = g.to('cuda')
+    g = g.to(device)
     
     edge2type = {}
     for i,mat in enumerate(data_generator.kg_lap_list):
@@ -73,10 +87,7 @@ if __name__ == '__main__':
     for i in range(data_generator.n_entities):
         edge2type[(i,i)] = len(data_generator.kg_lap_list)
     
-    kg_adjM = sum(data_generator.kg_lap_list)
-    kg = dgl.DGLGraph(kg_adjM)
-    kg = dgl.remove_self_loop(kg)
-    kg = dgl.add_self_loop(kg)
+    kg = build_kg_graph(data_generator)
     e_feat = []
     for u, v in zip(*kg.edges()):
         u = u.item()
@@ -86,16 +97,119 @@ if __name__ == '__main__':
         e_feat.append(edge2type[(u,v)])
     for i in range(data_generator.n_entities):
         e_feat.append(edge2type[(i,i)])
-    e_feat = torch.tensor(e_feat, dtype=torch.long).to('cuda')
-    kg = kg.to('cuda')
+    e_feat = torch.tensor(e_feat, dtype=torch.long).to(device)
+    kg = kg.to(device)
+    return g, kg, e_feat
+
+def build_subgraphs(data_generator, dropout_rate, device, rng=None):
+    sub_cf_adjM = data_generator._get_cf_adj_list(is_subgraph = True, dropout_rate = dropout_rate, rng = rng)
+    sub_cf_lap = data_generator._get_lap_list(is_subgraph = True, subgraph_adj = sub_cf_adjM)
+    sub_cf_g = dgl.DGLGraph(sub_cf_lap)
+    sub_cf_g = dgl.add_self_loop(sub_cf_g)
+    sub_cf_g = sub_cf_g.to(device)
+    
+    sub_kg_adjM, _ = data_generator._get_kg_adj_list(is_subgraph = True, dropout_rate = dropout_rate, rng = rng)
+    sub_kg_lap = sum(data_generator._get_kg_lap_list(is_subgraph = True, subgraph_adj = sub_kg_adjM))
+    sub_kg = dgl.DGLGraph(sub_kg_lap)
+    sub_kg = dgl.remove_self_loop(sub_kg)
+    sub_kg = dgl.add_self_loop(sub_kg)
+    sub_kg = sub_kg.to(device)
+    return sub_cf_g, sub_kg
+
+def cf_step(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizer, scaler, device):
+    model.train()
+    with phase_timer.trace():
+        with phase_timer.phase('cf_sample'):
+            batch_data = data_generator.generate_train_batch()
+        with phase_timer.phase('cf_forward'), autocast(args, device):
+            loss, cf_drop, kg_drop = model("cf", g, sub_cf_g, kg, sub_kg, batch_data['users'], np.array(batch_data['pos_items']) + data_generator.n_users, np.array(batch_data['neg_items']) + data_generator.n_users)
+        step(loss, optimizer, scaler, 'cf')
+    return loss, cf_drop, kg_drop
+
+def kg_step(args, data_generator, model, kg, sub_kg, optimizer, scaler, device):
+    model.train()
+    with phase_timer.trace():
+        with phase_timer.phase('kg_sample'):
+            batch_data = data_generator.generate_train_kg_batch()
+        with phase_timer.phase('kg_forward'), autocast(args, device):
+            kge_loss, kg_drop = model("kg", kg, sub_kg, batch_data['heads'], batch_data['relations'], batch_data['pos_tails'], batch_data['neg_tails'])
+        step(kge_loss, optimizer, scaler, 'kg')
+    return kge_loss, kg_drop
+
+def cl_step(args, data_generator, model, kg, sub_cf_g, sub_kg, optimizer, scaler, device):
+    model.train()
+    with phase_timer.trace():
+        with phase_timer.phase('cl_sample'):
+            batch_data = data_generator.generate_train_cl_batch()
+        with phase_timer.phase('cl_forward'), autocast(args, device):
+            cl_loss = model("cl", sub_cf_g, sub_kg, kg, batch_data['items'])
+        step(cl_loss, optimizer, scaler, 'cl')
+    return cl_loss
+
+def train_epoch(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizers, scalers, device):
+    optimizer, optimizer2, optimizer3 = optimizers
+    scaler, scaler2, scaler3 = scalers
+    model.new_epoch()
+    loss, kge_loss, cl_loss = 0., 0., 0.
+    cf_drop, kg_drop = 0., 0.
+    # with --world_size > 1 every rank runs its share of the steps of each phase.
+    n_batch = distributed.shard(data_generator.n_train // args.batch_size + 1)
+    n_kg_batch = distributed.shard(data_generator.n_triples // args.batch_size_kg + 1)
+    n_cl_batch = distributed.shard(data_generator.n_items // args.batch_size_cl + 1)
     """
     *********************************************************
-    Save the model parameters.
+    Alternative Training for KGAT:
+    ... phase 1: to train the recommender.
+    """
+    for idx in range(n_batch):
+        loss, cf_drop, kg_drop = cf_step(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizer, scaler, device)
+
+    for idx in range(n_kg_batch):
+        kge_loss, kg_drop = kg_step(args, data_generator, model, kg, sub_kg, optimizer2, scaler2, device)
+    
+    for idx in range(n_cl_batch):
+        cl_loss = cl_step(args, data_generator, model, kg, sub_cf_g, sub_kg, optimizer3, scaler3, device)
+    return loss, kge_loss, cl_loss, cf_drop, kg_drop
+
+def print_refresh_counts(model):
+    # DropLearner runs vs. steps that reused the cached edge weights, under --aug_refresh.
+    print('drop learner refresh/reuse: ' + ', '.join('%s=[%d/%d]' % (view, n, m) for view, (n, m) in model.refresh_counts().items()))
+
+if __name__ == '__main__':
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    args = parse_args()
+    if args.world_size > 1 and not distributed.is_worker():
+        sys.exit(distributed.launch(args.world_size, args.dist_port))
+    rank, world_size = distributed.init()
+    data_generator = load_data(args)
+    evaluator = Evaluator(args, data_generator)
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
+    device = get_device(args)
+    if args.profile_dir:
+        phase_timer.configure(args.profile_dir, eval(args.profile_steps), device)
+    if args.report == 1:
+        # test users grouped by their number of interactions, reported at every evaluation.
+        split_uids, split_state = data_generator.get_sparsity_split()
+    t0 = time()
+    """
+    *********************************************************
+    Use the pretrained data to initialize the embeddings.
     """
-    if args.save_flag == 1:
-        weights_save_path = '{}weights/{}/{}/{}_{}.pt'.format(args.weights_path, args.dataset, args.model_type, num_layers, args.heads)
-        ensureDir(weights_save_path)
-        torch.save(model, weights_save_path)
+    # parser.add_argument('--pretrain', type=int, default=-1, help = '0: No pretrain, -1: Pretrain with the learned embeddings, 1:Pretrain with stored models.')
+    if args.pretrain in [-1, -2]:
+        pretrain_data = load_pretrained_data(args)
+    else:
+        pretrain_data = None
+    """
+    *********************************************************
+    Select one of the models.
+    """
+    model, num_layers = build_model(args, data_generator, pretrain_data, device)
+    g, kg, _ = build_graphs(data_generator, device)
+    distributed.broadcast_parameters(model)
+    if world_size > 1:
+        distributed.seed(2023)
     cur_best_pre_0 = 0.
     """
     *********************************************************
@@ -104,80 +218,48 @@ if __name__ == '__main__':
     loss_loger, pre_loger, rec_loger, ndcg_loger, hit_loger = [], [], [], [], []
     stopping_step = 0
     should_stop = False
-    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
-    optimizer2 = torch.optim.Adam(model.parameters(), lr=args.kg_lr)
-    optimizer3 = torch.optim.Adam(model.parameters(), lr=args.cl_lr)
+    optimizers = build_optimizers(args, model)
+    scalers = tuple(get_scaler(args, device) for _ in optimizers)
     dropout_rate = args.drop_rate
-    for epoch in range(args.epoch):
-        t1 = time()
-        sub_cf_adjM = data_generator._get_cf_adj_list(is_subgraph = True, dropout_rate = dropout_rate)
-        sub_cf_lap = data_generator._get_lap_list(is_subgraph = True, subgraph_adj = sub_cf_adjM)
-        sub_cf_g = dgl.DGLGraph(sub_cf_lap)
-        sub_cf_g = dgl.add_self_loop(sub_cf_g)
-        sub_cf_g = sub_cf_g.to('cuda')
-        
-        sub_kg_adjM, _ = data_generator._get_kg_adj_list(is_subgraph = True, dropout_rate = dropout_rate)
-        sub_kg_lap = sum(data_generator._get_kg_lap_list(is_subgraph = True, subgraph_adj = sub_kg_adjM))
-        sub_kg = dgl.DGLGraph(sub_kg_lap)
-        sub_kg = dgl.remove_self_loop(sub_kg)
-        sub_kg = dgl.add_self_loop(sub_kg)
-        sub_kg = sub_kg.to('cuda')
-        loss, base_loss, kge_loss, reg_loss, cl_loss = 0., 0., 0., 0., 0.
-        cf_drop, kg_drop = 0., 0.
-        n_batch = data_generator.n_train // args.batch_size + 1
-        n_kg_batch = data_generator.n_triples // args.batch_size_kg + 1
-        n_cl_batch = data_generator.n_items // args.batch_size_cl + 1
-        """
-        *********************************************************
-        Alternative Training for KGAT:
-        ... phase 1: to train the recommender.
-        """
-        for idx in range(n_batch):
-            model.train()
-            btime= time()
-            batch_data = data_generator.generate_train_batch()
-            loss, cf_drop, kg_drop = model("cf", g, sub_cf_g, kg, sub_kg, batch_data['users'], batch_data['pos_items'] + data_generator.n_users, batch_data['neg_items'] + data_generator.n_users)
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+    """
+    *********************************************************
+    Save the model parameters / resume from the latest checkpoint.
+    """
+    checkpointer = None
+    start_epoch = 0
+    if args.save_flag == 1 or args.resume == 1:
+        ckpt_dir = args.ckpt_dir or '{}weights/{}/{}/{}_{}/'.format(args.weights_path, args.dataset, args.model_type, num_layers, args.heads)
+        # a run without --resume does not continue the index of an earlier one.
+        checkpointer = Checkpointer(ckpt_dir, args.keep_best, resume=args.resume == 1)
+    if args.resume == 1:
+        state = checkpointer.load(map_location=device)
+        if state is None:
+            print('no checkpoint in %s, training from scratch.' % checkpointer.ckpt_dir)
+        else:
+            last_epoch, loop = restore(state, model, optimizers, scalers)
+            model.resume(kg)
+            cur_best_pre_0, stopping_step = loop['cur_best_pre_0'], loop['stopping_step']
+            loss_loger, pre_loger, rec_loger, ndcg_loger, hit_loger = loop['loggers']
+            start_epoch = last_epoch + 1
+            print('resume from epoch %d of %s' % (last_epoch, checkpointer.latest()))
+            del state
+            if world_size > 1:
+                # the checkpoint holds the rng state of rank 0.
+                distributed.seed(2023 + start_epoch * world_size)
 
-        for idx in range(n_kg_batch):
-            model.train()
-            batch_data = data_generator.generate_train_kg_batch()
-            kge_loss, kg_drop = model("kg", kg, sub_kg, batch_data['heads'], batch_data['relations'], batch_data['pos_tails'], batch_data['neg_tails'])
-            optimizer2.zero_grad()
-            kge_loss.backward()
-            optimizer2.step()
-        
-        for idx in range(n_cl_batch):
-            model.train()
-            batch_data = data_generator.generate_train_cl_batch()
-            cl_loss = model("cl", sub_cf_g, sub_kg, kg, batch_data['items'])
-            optimizer3.zero_grad()
-            cl_loss.backward()
-            optimizer3.step()
+    # the dropout subgraphs of the coming epochs are built while the current one trains.
+    # the views are seeded by the epoch (and rank), a resumed run builds the same ones.
+    producer = SubgraphProducer(lambda rng: build_subgraphs(data_generator, dropout_rate, device, rng),
+                                args.aug_pool, seed=2023 + rank, prefetch=args.aug_prefetch == 1, start=start_epoch)
 
-        del sub_cf_g, sub_kg
-        show_step = 10
-        if (epoch + 1) % show_step != 0:
-            if args.verbose > 0 and epoch % args.verbose == 0:
-                perf_str = 'Epoch %d [%.1fs]: train==[%.5f + %.5f + %.5f] drop==[%.2f + %.2f]' % (
-                    epoch, time() - t1, float(loss), float(kge_loss), float(cl_loss), float(cf_drop), float(kg_drop))
-                print(perf_str)
-            continue
-        """
-        *********************************************************
-        Test.
-        """
-        t2 = time()
-        users_to_test = list(data_generator.test_user_dict.keys())
+    def loop_state():
+        return {'cur_best_pre_0': cur_best_pre_0, 'stopping_step': stopping_step,
+                'loggers': [loss_loger, pre_loger, rec_loger, ndcg_loger, hit_loger]}
 
-        ret = test(g, kg, model, users_to_test)      # batch_test.py中的def test()
-        """
-        *********************************************************
-        Performance logging.
-        """
-        t3 = time()
+    def evaluated(epoch, state, train_time, eval_time, loss, kge_loss, ret, rets):
+        # logs the evaluation of epoch, updates early stopping and saves the checkpoint state of
+        # the epoch with its score. Returns whether to stop.
+        global cur_best_pre_0, stopping_step
         loss_loger.append(float(loss))
         rec_loger.append(ret['recall'])
         pre_loger.append(ret['precision'])
@@ -187,28 +269,95 @@ if __name__ == '__main__':
         if args.verbose > 0:
             perf_str = 'Epoch %d [%.1fs + %.1fs]: train==[%.5f + %.5f], recall=[%.5f, %.5f], ' \
                        'precision=[%.5f, %.5f], hit=[%.5f, %.5f], ndcg=[%.5f, %.5f]' % \
-                       (epoch, t2 - t1, t3 - t2, float(loss), float(kge_loss), ret['recall'][0], ret['recall'][-1],
+                       (epoch, train_time, eval_time, float(loss), float(kge_loss), ret['recall'][0], ret['recall'][-1],
                         ret['precision'][0], ret['precision'][-1], ret['hit_ratio'][0], ret['hit_ratio'][-1],
                         ret['ndcg'][0], ret['ndcg'][-1])
             print(perf_str)
+            if args.aug_refresh != 'step':
+                print_refresh_counts(model)
+        if rets is not None:
+            for state_str, r in zip(split_state, rets):
+                print('%s: recall=[%s], precision=[%s], hit=[%s], ndcg=[%s]' % (
+                    state_str, ', '.join('%.5f' % x for x in r['recall']), ', '.join('%.5f' % x for x in r['precision']),
+                    ', '.join('%.5f' % x for x in r['hit_ratio']), ', '.join('%.5f' % x for x in r['ndcg'])))
         cur_best_pre_0, stopping_step, should_stop = early_stopping(ret['recall'][0], cur_best_pre_0,
                                                                     stopping_step, expected_order='acc', flag_step=10)
+        # *********************************************************
+        # save the checkpoint, evaluated epochs compete for the best-K by recall@K[0].
+        if checkpointer is not None:
+            state['loop'] = loop_state()
+            checkpointer.save(state, score=float(ret['recall'][0]))
+        return should_stop
+
+    # --eval_async: rank 0 evaluates snapshots on a background thread, the results (and early
+    # stopping) follow training with a lag of at most eval_async evaluations.
+    async_evaluator = None
+    if args.eval_async > 0 and rank == 0:
+        async_evaluator = AsyncEvaluator(evaluator, model, g, kg, list(data_generator.test_user_dict.keys()),
+                                         split_uids if args.report == 1 else None, args.eval_async)
+
+    for epoch in range(start_epoch, args.epoch):
+        t1 = time()
+        with phase_timer.phase('subgraph'):
+            sub_cf_g, sub_kg = producer.get(epoch)
+        loss, kge_loss, cl_loss, cf_drop, kg_drop = train_epoch(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizers, scalers, device)
+
+        del sub_cf_g, sub_kg
+        show_step = 10
+        if (epoch + 1) % show_step != 0:
+            if args.verbose > 0 and epoch % args.verbose == 0 and rank == 0:
+                perf_str = 'Epoch %d [%.1fs]: train==[%.5f + %.5f + %.5f] drop==[%.2f + %.2f]' % (
+                    epoch, time() - t1, float(loss), float(kge_loss), float(cl_loss), float(cf_drop), float(kg_drop))
+                print(perf_str)
+                if args.aug_refresh != 'step':
+                    print_refresh_counts(model)
+            phase_timer.end_epoch(epoch)
+            if checkpointer is not None and rank == 0 and (epoch + 1) % args.ckpt_every == 0:
+                checkpointer.save(capture(model, optimizers, scalers, epoch, loop_state()))
+            continue
+        if rank != 0:
+            # rank 0 evaluates and decides about early stopping.
+            phase_timer.end_epoch(epoch)
+            if distributed.broadcast_object(None):
+                break
+            continue
+        """
+        *********************************************************
+        Test.
+        """
+        t2 = time()
+        users_to_test = list(data_generator.test_user_dict.keys())
+        # the full training state only when it is checkpointed, the evaluation needs the parameters.
+        state = capture(model, optimizers, scalers, epoch, loop_state()) if checkpointer is not None else {'model': model.state_dict()}
+
+        if async_evaluator is not None:
+            # the snapshot is evaluated while the next epochs train; the results that are in
+            # drive early stopping.
+            async_evaluator.submit(epoch, state, (t2 - t1, loss, kge_loss))
+            phase_timer.end_epoch(epoch)
+            for e, s, (train_time, l, kge_l), ret, rets, eval_time in async_evaluator.done():
+                should_stop = evaluated(e, s, train_time, eval_time, l, kge_l, ret, rets) or should_stop
+        else:
+            with phase_timer.phase('evaluation'):
+                ret = evaluator.test(g, kg, model, users_to_test)      # batch_test.py中的Evaluator.test()
+                rets = evaluator.test_groups(g, kg, model, split_uids) if args.report == 1 else None
+            phase_timer.end_epoch(epoch)
+            should_stop = evaluated(epoch, state, t2 - t1, time() - t2, loss, kge_loss, ret, rets)
 
         # *********************************************************
         # early stopping when cur_best_pre_0 is decreasing for ten successive steps.
+        distributed.broadcast_object(should_stop)
         if should_stop == True:
             break
-        # *********************************************************
-        # save the user & item embeddings for pretraining.
-        if ret['recall'][0] == cur_best_pre_0 and args.save_flag == 1:
-            # save_saver.save(sess, weights_save_path + '/weights', global_step=epoch)
-            torch.save(model, weights_save_path)
-            print('save the weights in path: ', weights_save_path)
-            print('saving prediction')
-            #save_file(g, e_feat, model, users_to_test)
-            print('saved')
-            # print(test_saved_file(users_to_test))
 
+    if async_evaluator is not None:
+        for e, s, (train_time, l, kge_l), ret, rets, eval_time in async_evaluator.close():
+            evaluated(e, s, train_time, eval_time, l, kge_l, ret, rets)
+    producer.close()
+    if checkpointer is not None:
+        checkpointer.close()
+    if rank != 0:
+        sys.exit(0)
     recs = np.array(rec_loger)
     pres = np.array(pre_loger)
     ndcgs = np.array(ndcg_loger)
@@ -0,0 +1,117 @@
+"""
+Model-parallel training of the KG view (kg_embed, kg_gat_layers and the DistMult decoder)
+over --partitions worker processes. The KG is partitioned once into --part_dir, every worker
+loads only its part, keeps the kg_embed rows of its entities and exchanges the halo entity
+features before every myGATConv layer. The trained rows are gathered into
+<part_dir>/kg_state.pt under the myGAT state_dict names; main.py and export.py load it with
+--kg_state <part_dir>/kg_state.pt, with the same data files and --node_order.
+
+The objective is reduced against the KG phase of main.py: only the DistMult loss of the full
+kg view is trained, there is no subkg view (subkg_embed, subkg_gat_layers), no DropLearner
+edge weights and no DropLearner regularizer. The CF graph is not partitioned, and main.py
+still holds the full dense kg_embed, so a KG larger than the memory of one process can be
+pre-trained here but not trained with the full model.
+
+$ python partition_train.py --dataset movie-lens --partitions 4 --part_method metis --device cpu --epoch 10
+"""
+from utility.parser import parse_args
+from utility.optim import build_optimizer
+from utility.amp import get_device
+from utility.partition import data_signature, assign, write_partitions, partitions_exist, Partition, fetch_plan, gather_rows
+from utility import distributed
+from GNN import PartitionedKG
+from time import time
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+import os
+import resource
+import sys
+
+def get_part_dir(args):
+    return args.part_dir or '%s%s/partitions/%s%d/' % (args.data_path, args.dataset, args.part_method, args.partitions)
+
+def partition_signature(args):
+    # the data, node order and method the partitions were built from, a part directory
+    # written for anything else is re-partitioned.
+    return '%s;method=%s' % (data_signature(args), args.part_method)
+
+def prepare_partitions(args):
+    # the only step that reads the whole KG, it runs once per partitioning.
+    part_dir = get_part_dir(args)
+    signature = partition_signature(args)
+    if partitions_exist(part_dir, args.partitions, signature):
+        return part_dir
+    from main import load_data, build_kg_graph
+    data_generator = load_data(args)
+    kg = build_kg_graph(data_generator)
+    t1 = time()
+    assignment = assign(kg, args.partitions, args.part_method)
+    print('%s partitioning into %d parts [%.1fs]' % (args.part_method, args.partitions, time() - t1))
+    write_partitions(kg, assignment, part_dir, args.partitions, kg_dict=data_generator.all_kg_dict,
+                     n_relations=data_generator.n_relations, n_nodes=kg.num_nodes(), signature=signature)
+    return part_dir
+
+def train(args, part_dir):
+    rank, world_size = distributed.init()
+    device = get_device(args)
+    torch.manual_seed(2023)
+    part = Partition(part_dir, rank)
+    block = part.block(device)
+    halo_plan = fetch_plan(part, part.halo, device)
+
+    weight_size = eval(args.layer_size)
+    num_layers = len(weight_size) - 2
+    heads = [args.heads] * num_layers + [1]
+    model = PartitionedKG(args, part.n_inner, int(part.meta['n_relations']) + 1, weight_size[-2], weight_size[-1],
+                          num_layers, heads, F.elu, 0.1, 0., 0.01, False).to(device)
+    distributed.broadcast_parameters(model)
+    distributed.seed(2023)
+    optimizer = build_optimizer(model, "kg", args.kg_lr, args.sparse_adam)
+
+    # every rank samples its share of the global batch from the heads it owns.
+    n_triples = torch.tensor([int(part.indptr[-1])])
+    dist.all_reduce(n_triples)
+    n_triples = int(n_triples)
+    n_kg_batch = n_triples // args.batch_size_kg + 1
+    batch_size = max(1, args.batch_size_kg // world_size)
+    for epoch in range(args.epoch):
+        t1 = time()
+        model.train()
+        kge_loss = 0.
+        for idx in range(n_kg_batch):
+            h, r, pos_t, neg_t = part.sample_kg_batch(batch_size)
+            tail_plan = fetch_plan(part, np.concatenate([pos_t, neg_t]), device)
+            loss = model(block, halo_plan, tail_plan, h, r, len(pos_t))
+            optimizer.zero_grad()
+            # the gradients of the partitioned rows come from every rank's loss, so the
+            # losses are scaled by 1/world_size and the replicated gradients summed.
+            (loss / world_size).backward()
+            distributed.sync_grads(optimizer, average=False)
+            optimizer.step()
+            kge_loss += float(loss) / n_kg_batch
+        loss_t = torch.tensor([kge_loss])
+        dist.all_reduce(loss_t)
+        if rank == 0 and args.verbose > 0 and epoch % args.verbose == 0:
+            print('Epoch %d [%.1fs]: kge_loss=%.5f' % (epoch, time() - t1, float(loss_t) / world_size))
+    print('rank %d: %d inner + %d halo entities, %d edges, peak rss %.0fMB' % (
+        rank, part.n_inner, part.n_halo, len(part.eid), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10))
+
+    kg_embed = gather_rows(part, model.kg_embed)
+    if rank == 0:
+        state = {'kg_embed': kg_embed}
+        for name, t in model.state_dict().items():
+            if name != 'kg_embed':
+                state[name] = t.cpu()
+        # the rows are in the entity ids of the data and --node_order, load_kg_state checks them.
+        torch.save({'signature': data_signature(args), 'n_nodes': part.n_nodes, 'state': state},
+                   os.path.join(part_dir, 'kg_state.pt'))
+        print('save the KG state in path: ', os.path.join(part_dir, 'kg_state.pt'))
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not distributed.is_worker():
+        part_dir = prepare_partitions(args)
+        sys.exit(distributed.launch(args.partitions, args.dist_port))
+    train(args, get_part_dir(args))
@@ -0,0 +1,39 @@
+"""
+Local top-K recommendation server on the embeddings written by export.py. Concurrent
+requests are coalesced into micro-batches of at most --serve_max_batch users, closed
+--serve_max_wait ms after their first request, and scored with one matrix multiply and
+top-K; the items a user interacted with in training are excluded. Only the embeddings file
+is read, neither the dataset nor DGL are needed.
+Results are cached by (version of the embeddings, user, k, filter flags) in an LRU cache of
+--cache_size entries that expire after --cache_ttl seconds. The server picks up a new
+export.py run within --serve_reload seconds (or on POST /reload) and drops the cache; a
+POST /fold_in of a user drops the user's cached results.
+
+$ python export.py --dataset movie-lens
+$ python serve.py --dataset movie-lens --serve_port 8080 --serve_max_batch 256 --serve_max_wait 2
+$ curl 'http://127.0.0.1:8080/recommend?user=42&k=10'
+$ curl -d '{"users": [1, 2, 3], "k": 10}' http://127.0.0.1:8080/recommend
+$ curl http://127.0.0.1:8080/stats                 # latency percentiles, qps, mean batch size, cache hit rate
+$ curl -d '{"user": 42, "items": [7, 8]}' http://127.0.0.1:8080/fold_in
+
+See benchmarks/bench_serve.py for a load test.
+"""
+from utility.parser import parse_args
+from utility.serving import emb_path, load_topk, MicroBatcher, ResultCache, Server
+import asyncio
+
+if __name__ == '__main__':
+    args = parse_args()
+    path = emb_path(args)
+    topk = load_topk(path)
+    batcher = MicroBatcher(topk, args.serve_max_batch, args.serve_max_wait / 1000.)
+    server = Server(batcher, args.serve_k, cache=ResultCache(args.cache_size, args.cache_ttl),
+                    path=path, reload_every=args.serve_reload)
+
+    def ready(s):
+        print('serving %d users and %d items from %s (version %s) on http://%s:%d' % (
+            topk.n_users, topk.n_items, path, topk.version, args.serve_host, args.serve_port), flush=True)
+    try:
+        asyncio.run(server.serve(args.serve_host, args.serve_port, ready))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,217 @@
+"""
+Hyperparameter sweep over one loaded dataset. The KGAT_loader, its Laplacians and the
+full CF/KG graphs are built once in this process; the trial workers are forked from it and
+share them copy-on-write instead of re-parsing the dataset for every configuration.
+Every trial evaluates every --sweep_eval_every epochs and stops on the early_stopping signal
+of main.py (--sweep_patience evaluations without a better recall@K[0]) or, with
+--sweep_prune 1, as soon as its best recall falls below the median of the other trials at the
+same epoch. The results are written to {proj_path}output/{dataset}/sweep.csv.
+
+$ python sweep.py --dataset movie-lens --epoch 200 --sweep_workers 4 \
+    --sweep_grid '{"temperature": [0.5, 0.7, 0.9], "drop_rate": [0.5, 0.7], "kg_lr": [1e-4, 1e-3]}'
+
+The speed/quality trade-off of the DropLearner refresh policy on a dataset (time, best_recall
+and the drop_refresh/drop_reuse counts of every policy in sweep.csv):
+
+$ python sweep.py --dataset movie-lens --epoch 100 \
+    --sweep_grid '{"aug_refresh": ["step", "10", "epoch", "drift:0.05"]}'
+"""
+from utility.helper import ensureDir, early_stopping
+from utility.parser import parse_args
+from utility.batch_test import Evaluator
+from utility.amp import get_device, get_scaler
+from utility.optim import build_optimizers
+from main import load_data, load_pretrained_data, build_model, build_graphs, build_subgraphs, train_epoch
+from time import time
+import copy
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import random
+import numpy as np
+import torch
+
+def trial_configs(args):
+    grid = json.loads(args.sweep_grid)
+    for name in grid:
+        if not hasattr(args, name):
+            raise ValueError('unknown argument in --sweep_grid: %s' % name)
+    names = sorted(grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+    if 0 < args.sweep_trials < len(configs):
+        configs = random.Random(2023).sample(configs, args.sweep_trials)
+    return configs
+
+def run_trial(args, data_generator, evaluator, graphs, pretrain_data, trial_id, config, report):
+    # trains one configuration, report(epoch, best_recall) returns False to stop the trial.
+    args = copy.copy(args)
+    for name, value in config.items():
+        setattr(args, name, value)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    random.seed(2023)
+    device = get_device(args)
+    model, _ = build_model(args, data_generator, pretrain_data, device)
+    g, kg = [x.to(device) for x in graphs]
+    optimizers = build_optimizers(args, model)
+    scalers = tuple(get_scaler(args, device) for _ in optimizers)
+    users_to_test = list(data_generator.test_user_dict.keys())
+    result = dict(config, trial=trial_id, status='finished', epochs=0, best_epoch=-1, best_recall=0.)
+    cur_best_pre_0, stopping_step = 0., 0
+    t0 = time()
+    for epoch in range(args.epoch):
+        sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+        loss, kge_loss, cl_loss, _, _ = train_epoch(args, data_generator, model, g, kg, sub_cf_g, sub_kg,
+                                                    optimizers, scalers, device)
+        del sub_cf_g, sub_kg
+        for n_refresh, n_reuse in model.refresh_counts().values():
+            result['drop_refresh'] = result.get('drop_refresh', 0) + n_refresh
+            result['drop_reuse'] = result.get('drop_reuse', 0) + n_reuse
+        result['epochs'] = epoch + 1
+        result['loss'] = float(loss)
+        if not np.isfinite(float(loss)):
+            result['status'] = 'diverged'
+            break
+        if (epoch + 1) % args.sweep_eval_every != 0:
+            continue
+        ret = evaluator.test(g, kg, model, users_to_test)
+        if ret['recall'][0] >= cur_best_pre_0:
+            result.update(best_epoch=epoch, best_recall=float(ret['recall'][0]),
+                          best_ndcg=float(ret['ndcg'][0]), best_precision=float(ret['precision'][0]),
+                          best_hit=float(ret['hit_ratio'][0]))
+        cur_best_pre_0, stopping_step, should_stop = early_stopping(ret['recall'][0], cur_best_pre_0, stopping_step,
+                                                                    expected_order='acc', flag_step=args.sweep_patience)
+        if should_stop:
+            result['status'] = 'early_stopped'
+            break
+        if not report(epoch, cur_best_pre_0):
+            result['status'] = 'pruned'
+            break
+    result['time'] = time() - t0
+    return result
+
+def worker(worker_id, args, shared, tasks, messages, decision):
+    # a forked trial process, shared holds the data loaded by the parent.
+    torch.set_num_threads(max(1, os.cpu_count() // args.sweep_workers))
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        trial_id, config = task
+        messages.put(('start', worker_id, trial_id))
+
+        def report(epoch, best):
+            messages.put(('eval', worker_id, trial_id, epoch, best))
+            return decision.get()
+        try:
+            result = run_trial(args, shared['data'], shared['evaluator'], shared['graphs'], shared['pretrain'],
+                               trial_id, config, report)
+        except Exception as e:
+            result = dict(config, trial=trial_id, status='failed: %s' % e)
+        messages.put(('done', worker_id, trial_id, result))
+
+class MedianPruner(object):
+    # median stopping rule on the best recall@K[0] reported by the trials at every evaluated epoch.
+    def __init__(self, enabled, min_trials=2):
+        self.enabled = enabled
+        self.min_trials = min_trials
+        self.history = {}
+
+    def keep(self, trial_id, epoch, best):
+        others = [b for t, b in self.history.get(epoch, {}).items() if t != trial_id]
+        self.history.setdefault(epoch, {})[trial_id] = best
+        if not self.enabled or len(others) < self.min_trials:
+            return True
+        return best >= np.median(others)
+
+def write_results(results, path):
+    ensureDir(path)
+    fields = []
+    for r in results:
+        fields += [k for k in r if k not in fields]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in results:
+            writer.writerow(r)
+
+if __name__ == '__main__':
+    args = parse_args()
+    configs = trial_configs(args)
+    t0 = time()
+    data_generator = load_data(args)
+    # the graphs are built on the cpu: cuda must not be initialized before forking.
+    g, kg, _ = build_graphs(data_generator, 'cpu')
+    pretrain_data = load_pretrained_data(args) if args.pretrain in [-1, -2] else None
+    shared = {'data': data_generator, 'evaluator': Evaluator(args, data_generator), 'graphs': (g, kg),
+              'pretrain': pretrain_data}
+    print('loaded the data and graphs once for %d trials [%.1fs]' % (len(configs), time() - t0))
+
+    ctx = multiprocessing.get_context('fork')
+    n_workers = max(1, min(args.sweep_workers, len(configs)))
+    tasks, messages = ctx.Queue(), ctx.Queue()
+    decisions = [ctx.Queue() for _ in range(n_workers)]
+    for trial_id, config in enumerate(configs):
+        tasks.put((trial_id, config))
+    for _ in range(n_workers):
+        tasks.put(None)
+    # not daemonic: the evaluation of every trial runs its own multiprocessing.Pool.
+    workers = [ctx.Process(target=worker, args=(i, args, shared, tasks, messages, decisions[i]))
+               for i in range(n_workers)]
+    for w in workers:
+        w.start()
+
+    pruner = MedianPruner(args.sweep_prune == 1)
+    results = []
+    # the trial every worker runs, a worker that dies (oom kill, segfault) never posts its result.
+    running, dead = {}, set()
+    while len(results) < len(configs):
+        try:
+            msg = messages.get(timeout=5)
+        except queue.Empty:
+            for worker_id, w in enumerate(workers):
+                if worker_id in dead or w.is_alive():
+                    continue
+                dead.add(worker_id)
+                if worker_id in running:
+                    trial_id = running.pop(worker_id)
+                    results.append(dict(configs[trial_id], trial=trial_id,
+                                        status='failed: worker exited with code %s' % w.exitcode))
+                    print('trial %d %s: %s' % (trial_id, results[-1]['status'], json.dumps(configs[trial_id])))
+            if len(dead) == n_workers:
+                break
+            continue
+        if msg[0] == 'start':
+            _, worker_id, trial_id = msg
+            running[worker_id] = trial_id
+        elif msg[0] == 'eval':
+            _, worker_id, trial_id, epoch, best = msg
+            keep = pruner.keep(trial_id, epoch, best)
+            decisions[worker_id].put(keep)
+            print('trial %d epoch %d: best recall=%.5f%s' % (trial_id, epoch, best, '' if keep else ', pruned'))
+        else:
+            _, worker_id, trial_id, result = msg
+            running.pop(worker_id, None)
+            results.append(result)
+            print('trial %d %s: %s' % (trial_id, result['status'], json.dumps(configs[trial_id])))
+    # trials no worker was left to run (or whose start message was lost with its worker).
+    finished = {r['trial'] for r in results}
+    for trial_id, config in enumerate(configs):
+        if trial_id not in finished:
+            results.append(dict(config, trial=trial_id, status='failed: no worker left'))
+    for w in workers:
+        w.join()
+
+    results.sort(key=lambda r: -r.get('best_recall', 0.))
+    save_path = '%soutput/%s/sweep.csv' % (args.proj_path, args.dataset)
+    write_results(results, save_path)
+    names = sorted(configs[0]) if configs else []
+    print('%-6s %-14s %10s %6s %7s  %s' % ('trial', 'status', 'recall', 'epoch', 'time', ' '.join(names)))
+    for r in results:
+        print('%-6d %-14s %10.5f %6d %7.1f  %s' % (r['trial'], r['status'][:14], r.get('best_recall', 0.),
+                                                  r.get('best_epoch', -1), r.get('time', 0.),
+                                                  ' '.join(str(r[n]) for n in names)))
+    print('sweep finished in %.1fs, results in %s' % (time() - t0, save_path))
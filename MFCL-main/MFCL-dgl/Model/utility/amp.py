@@ -0,0 +1,47 @@
+import contextlib
+import torch
+from utility.profiler import phase_timer
+from utility.distributed import sync_grads
+
+AMP_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+def get_device(args):
+    device = torch.device(args.device)
+    if args.device == 'cuda' and not torch.cuda.is_available():
+        print('cuda is not available, fall back to cpu.')
+        device = torch.device('cpu')
+    if args.amp == 'fp16' and device.type == 'cpu':
+        # DGL sparse kernels only take bfloat16/float32/float64 features on cpu.
+        print('fp16 is not supported on cpu, fall back to bf16.')
+        args.amp = 'bf16'
+    return device
+
+def autocast(args, device):
+    # mixed precision is opt-in: --amp none keeps the whole step in float32.
+    if args.amp not in AMP_DTYPES:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=AMP_DTYPES[args.amp])
+
+def get_scaler(args, device):
+    # only fp16 needs loss scaling, bf16 has the exponent range of float32.
+    enabled = args.amp == 'fp16' and device.type == 'cuda'
+    return torch.amp.GradScaler('cuda', enabled=enabled)
+
+def fp32(x):
+    # run numerically sensitive ops (softmax, log, normalization) in float32 under autocast.
+    return torch.autocast(device_type=x.device.type, enabled=False)
+
+def l2_normalize(h, epsilon):
+    with fp32(h):
+        h = h.float()
+        return h / torch.max(torch.norm(h, dim=1, keepdim=True), epsilon)
+
+def step(loss, optimizer, scaler, name='train'):
+    optimizer.zero_grad()
+    with phase_timer.phase(name + '_backward'):
+        scaler.scale(loss).backward()
+    with phase_timer.phase(name + '_allreduce'):
+        sync_grads(optimizer)
+    with phase_timer.phase(name + '_optimizer'):
+        scaler.step(optimizer)
+        scaler.update()
@@ -0,0 +1,93 @@
+import copy
+import queue
+import threading
+from time import time
+from utility.checkpoint import to_cpu
+
+def eval_copy(model):
+    # a second instance of the model for the evaluation thread, without the history
+    # embeddings of --history (the test forward propagates the full graph).
+    histories, model.histories = model.histories, None
+    try:
+        return copy.deepcopy(model).eval()
+    finally:
+        model.histories = histories
+
+class AsyncEvaluator(object):
+    # Evaluates snapshots of the model on a background thread while training goes on.
+    # submit() copies the state dict (parameters and cached edge weights) of an epoch, the
+    # thread loads it into its own copy of the model and runs Evaluator.test (and test_groups
+    # of groups); done() returns the finished results in epoch order. At most max_pending
+    # snapshots are in flight, submit() waits for the oldest one beyond that, so the results
+    # lag training by a bounded number of evaluations. The pool of the evaluator is created
+    # once here, in the training thread, and the thread propagates over clones of g and kg:
+    # they share the structure, but local_scope() swaps the feature frames of the graph
+    # object, which the training thread uses at the same time.
+    def __init__(self, evaluator, model, g, kg, users, groups=None, max_pending=1):
+        self.evaluator = evaluator
+        self.model = eval_copy(model)
+        self.g, self.kg = g.clone(), kg.clone()
+        self.users = users
+        self.groups = groups
+        self.pool = evaluator.pool()
+        self.slots = threading.Semaphore(max_pending)
+        self.todo = queue.Queue()
+        self.results = queue.Queue()
+        self.n_pending = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._evaluate, daemon=True)
+        self.thread.start()
+
+    def submit(self, epoch, state, info=None):
+        # state: a dict with the state_dict of the model under 'model', e.g. capture(); info is
+        # handed back with the result.
+        self._check()
+        self.slots.acquire()
+        self.n_pending += 1
+        self.todo.put((epoch, to_cpu(state), info))
+
+    def done(self, wait=False):
+        # [(epoch, state, info, ret, group_rets, eval_seconds)] of the finished evaluations,
+        # with wait all pending ones.
+        finished = []
+        while self.n_pending > 0:
+            try:
+                item = self.results.get(block=wait)
+            except queue.Empty:
+                break
+            self.n_pending -= 1
+            if item is None:
+                self._check()
+            finished.append(item)
+        return finished
+
+    def close(self):
+        # the results of the evaluations still pending.
+        finished = self.done(wait=True)
+        self.todo.put(None)
+        self.thread.join()
+        self.pool.close()
+        return finished
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('asynchronous evaluation failed') from self.error
+
+    def _evaluate(self):
+        while True:
+            item = self.todo.get()
+            if item is None:
+                return
+            epoch, state, info = item
+            try:
+                t1 = time()
+                self.model.load_state_dict(state['model'])
+                ret = self.evaluator.test(self.g, self.kg, self.model, self.users, pool=self.pool)
+                group_rets = None
+                if self.groups is not None:
+                    group_rets = self.evaluator.test_groups(self.g, self.kg, self.model, self.groups, pool=self.pool)
+                self.results.put((epoch, state, info, ret, group_rets, time() - t1))
+            except Exception as e:
+                self.error = e
+                self.results.put(None)
+            self.slots.release()
@@ -0,0 +1,175 @@
+import queue
+import threading
+import numpy as np
+import torch
+
+class SubgraphProducer(object):
+    # Augmented views (sub_cf_g, sub_kg) of the training epochs, built by build(rng) on a
+    # background thread so the edge dropout and the Laplacians of the next epoch are built
+    # while the current one trains.
+    #   pool_size == 0: a fresh view every epoch, double-buffered: the thread builds the next
+    #                   view as soon as the current one is handed over.
+    #   pool_size > 0:  pool_size views are built once and reused round-robin across epochs.
+    #   prefetch False: the views are built inline on get(), as without the producer.
+    # The views of epoch e (pool slot e) draw from their own random state seeded with
+    # (seed, e): the dropout draws do not interleave with the batch samplers and a run resumed
+    # at epoch start builds the same views as an uninterrupted one.
+    def __init__(self, build, pool_size=0, seed=None, prefetch=True, start=0):
+        self.build = build
+        self.pool_size = pool_size
+        self.prefetch = prefetch
+        self.seed = seed
+        self.next_epoch = start
+        self.pool = []
+        self.error = None
+        self.stopped = False
+        self.ready = queue.Queue(maxsize=1)
+        self.slot = threading.Semaphore(1)
+        self.pool_ready = threading.Condition()
+        self.thread = None
+        if prefetch:
+            self.thread = threading.Thread(target=self._fill_pool if pool_size > 0 else self._produce, daemon=True)
+            self.thread.start()
+
+    def get(self, epoch):
+        if self.pool_size > 0:
+            return self._from_pool(epoch)
+        if not self.prefetch:
+            # the global random state, it is part of the checkpoints.
+            return self.build(None)
+        views = self.ready.get()
+        if views is None:
+            self._check()
+        # the consumer holds this view, the thread may build the next one.
+        self.slot.release()
+        return views
+
+    def close(self):
+        self.stopped = True
+        self.slot.release()
+        if self.thread is not None:
+            while self.thread.is_alive():
+                try:
+                    self.ready.get_nowait()
+                except queue.Empty:
+                    pass
+                self.thread.join(timeout=0.1)
+        self.pool = []
+
+    def _rng(self, epoch):
+        return np.random.RandomState(None if self.seed is None else [self.seed, epoch])
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('building the augmented subgraphs failed') from self.error
+
+    def _from_pool(self, epoch):
+        idx = epoch % self.pool_size
+        if not self.prefetch:
+            while len(self.pool) <= idx:
+                self.pool.append(self.build(self._rng(len(self.pool))))
+            return self.pool[idx]
+        with self.pool_ready:
+            while len(self.pool) <= idx and self.error is None:
+                self.pool_ready.wait()
+        self._check()
+        return self.pool[idx]
+
+    def _produce(self):
+        while True:
+            self.slot.acquire()
+            if self.stopped:
+                return
+            try:
+                views = self.build(self._rng(self.next_epoch))
+            except Exception as e:
+                self.error = e
+                self.ready.put(None)
+                return
+            self.next_epoch += 1
+            self.ready.put(views)
+
+    def _fill_pool(self):
+        for idx in range(self.pool_size):
+            if self.stopped:
+                return
+            try:
+                views = self.build(self._rng(idx))
+            except Exception as e:
+                self.error = e
+            with self.pool_ready:
+                if self.error is None:
+                    self.pool.append(views)
+                self.pool_ready.notify_all()
+            if self.error is not None:
+                return
+
+class EdgeWeightRefresh(object):
+    # When a DropLearner recomputes its edge weights (and gets trained) instead of reusing the
+    # cached ones of its last refresh. The weights are always recomputed on a new graph.
+    #   'step':    every step, as without the policy.
+    #   'epoch':   once per epoch, on the first step after new_epoch().
+    #   'N':       every N steps.
+    #   'drift:T': when the learner input moved by more than T (relative L2) since the last refresh.
+    def __init__(self, spec='step'):
+        self.spec = spec
+        self.every, self.threshold = 1, None
+        if spec == 'epoch':
+            self.every = None
+        elif spec.startswith('drift:'):
+            self.every, self.threshold = None, float(spec[len('drift:'):])
+        elif spec != 'step':
+            self.every = int(spec)
+            if self.every < 1:
+                raise ValueError('--aug_refresh must be step, epoch, drift:T or a positive number of steps, got %s' % spec)
+        self.graph = None
+        self.ref = None
+        self.since = 0
+        self.reg = 0
+        self.epoch_start = False
+        self.n_refresh, self.n_reuse = 0, 0
+
+    def new_epoch(self):
+        self.epoch_start = True
+
+    def due(self, g, x):
+        if g is not self.graph:
+            return True
+        if self.every is not None:
+            return self.since >= self.every
+        if self.threshold is not None:
+            return float((x.detach() - self.ref).norm() / self.ref.norm().clamp_min(1e-12)) > self.threshold
+        return self.epoch_start
+
+    def refreshed(self, g, x, reg=0):
+        self.graph = g
+        self.reg = reg.detach() if torch.is_tensor(reg) else reg
+        self.ref = x.detach().clone() if self.threshold is not None else None
+        self.since = 1
+        self.epoch_start = False
+        self.n_refresh += 1
+
+    def reused(self):
+        self.since += 1
+        self.n_reuse += 1
+
+    def state_dict(self):
+        # everything but the graph, which does not survive a restart; see rebind().
+        return {'since': self.since, 'reg': self.reg, 'ref': self.ref, 'epoch_start': self.epoch_start,
+                'n_refresh': self.n_refresh, 'n_reuse': self.n_reuse}
+
+    def load_state_dict(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.graph = None
+
+    def rebind(self, g):
+        # g is the graph the cached weights were computed on (a graph rebuilt identically
+        # after a restart), they are reused on it under the policy instead of recomputed.
+        self.graph = g
+
+    def counts(self):
+        # (refreshes, reuses) since the last call.
+        counts = (self.n_refresh, self.n_reuse)
+        self.n_refresh, self.n_reuse = 0, 0
+        return counts
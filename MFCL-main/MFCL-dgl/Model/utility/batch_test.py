@@ -1,24 +1,17 @@
 import utility.metrics as metrics
-from utility.parser import parse_args
 import multiprocessing
 import heapq
 import numpy as np
-import torch
-import torch.nn.functional as F
-from utility.loader_kgat import KGAT_loader
 
-cores = multiprocessing.cpu_count() // 2
+cores = max(1, multiprocessing.cpu_count() // 2)
 
-args = parse_args()
-Ks = eval(args.Ks)
+# per-process state of the evaluation pool workers, set by init_worker() so the
+# workers get the train/test dictionaries once instead of re-loading the dataset.
+_worker = None
 
-data_generator = KGAT_loader(args=args, path=args.data_path + args.dataset)
-batch_test_flag = False
-
-
-USR_NUM, ITEM_NUM = data_generator.n_users, data_generator.n_items
-N_TRAIN, N_TEST = data_generator.n_train, data_generator.n_test
-BATCH_SIZE = args.batch_size
+def init_worker(state):
+    global _worker
+    _worker = state
 
 def ranklist_by_heapq(user_pos_test, test_items, rating, Ks):
     item_score = {}
@@ -88,135 +81,219 @@ def test_one_user(x):
     rating = x[0]
     #uid
     u = x[1]
+    Ks = _worker['Ks']
     #user u's items in the training set
     try:
-        training_items = data_generator.train_user_dict[u]
+        training_items = _worker['train_user_dict'][u]
     except Exception:
         training_items = []
     #user u's items in the test set
-    user_pos_test = data_generator.test_user_dict[u]
+    user_pos_test = _worker['test_user_dict'][u]
 
-    all_items = set(range(ITEM_NUM))
+    all_items = set(range(_worker['n_items']))
 
     test_items = list(all_items - set(training_items))
 
-    if args.test_flag == 'part':
+    if _worker['test_flag'] == 'part':
         r, auc = ranklist_by_heapq(user_pos_test, test_items, rating, Ks)
     else:
         r, auc = ranklist_by_sorted(user_pos_test, test_items, rating, Ks)
 
     return get_performance(user_pos_test, r, auc, Ks)
 
-def test(g, kg, model, users_to_test):
-    model.eval()
-    result = {'precision': np.zeros(len(Ks)), 'recall': np.zeros(len(Ks)), 'ndcg': np.zeros(len(Ks)),
-              'hit_ratio': np.zeros(len(Ks)), 'auc': 0.}
-
-    pool = multiprocessing.Pool(cores)       # multiprocessing.Pool 是一个用于管理和分配多个进程的工具。通过创建进程池，可以在多核CPU上并行执行任务，从而提高程序的运行效率。
-
-    u_batch_size = BATCH_SIZE
-
-    test_users = users_to_test
-    n_test_users = len(test_users)
-    n_user_batchs = n_test_users // u_batch_size + 1
-
-    count = 0
-
-    for u_batch_id in range(n_user_batchs):
-        start = u_batch_id * u_batch_size
-        end = (u_batch_id + 1) * u_batch_size
-
-        user_batch = test_users[start: end]
-
-        item_batch = range(ITEM_NUM)
+def test_one_user_topk(x):
+    # x: the top items of user u from blocked_topk (training items excluded, -1 padded) and u.
+    top_items, u = x
+    user_pos_test = _worker['test_user_dict'][u]
+    r = [1 if i in user_pos_test else 0 for i in top_items if i >= 0]
+    return get_performance(user_pos_test, r, 0., _worker['Ks'])
+
+def blocked_topk(user, item, k, block_size, seen=None, users=None):
+    # top-k items of every row of user by inner product, scoring block_size items at a time
+    # and merging each block into the running top-k, so at most users x (k + block_size)
+    # scores exist at once. The items of users[i] in the seen CSR are skipped; rows with
+    # fewer than k scorable items are padded with -1. Returns an int64 numpy array.
+    import torch
+    n_items = item.shape[0]
+    k = min(k, n_items)
+    top = torch.zeros((user.shape[0], 0), dtype=user.dtype, device=user.device)
+    top_items = torch.zeros((user.shape[0], 0), dtype=torch.long, device=user.device)
+    starts = list(range(0, n_items, block_size))
+    if seen is not None:
+        # the seen (row, item) pairs sorted by item, so every block masks a contiguous slice.
+        users = np.asarray(users, dtype=np.int64)
+        rows = np.nonzero(users < seen.n_rows)[0]
+        pos, cols = seen.gather(users[rows])
+        order = np.argsort(cols, kind='stable')
+        pos, cols = torch.from_numpy(rows[pos[order]]).to(user.device), cols[order].astype(np.int64)
+        bounds = np.searchsorted(cols, starts + [n_items])
+        cols = torch.from_numpy(cols).to(user.device)
+    for b, start in enumerate(starts):
+        block = item[start: start + block_size]
+        scores = torch.mm(user, block.t())
+        if seen is not None and bounds[b] < bounds[b + 1]:
+            lo, hi = bounds[b], bounds[b + 1]
+            scores[pos[lo:hi], cols[lo:hi] - start] = -np.inf
+        ids = torch.arange(start, start + block.shape[0], device=user.device).expand(user.shape[0], -1)
+        top, j = torch.topk(torch.cat([top, scores], 1), min(k, top.shape[1] + block.shape[0]), dim=1)
+        top_items = torch.gather(torch.cat([top_items, ids], 1), 1, j)
+    top_items[top == -np.inf] = -1
+    return top_items.cpu().numpy()
+
+class Evaluator(object):
+    # Top-K evaluation of a model on the test split of a loaded dataset (a KGAT_loader).
+    def __init__(self, args, data):
+        self.args = args
+        self.data = data
+        self.Ks = eval(args.Ks)
+        self.batch_size = args.batch_size
+        self.n_users, self.n_items = data.n_users, data.n_items
+        self.eval_block = args.eval_block
+        if self.eval_block > 0 and args.test_flag == 'full':
+            # the blocked top-K has no full score rows to compute the auc from.
+            print('warning: --test_flag full computes the auc from the full score rows, with --eval_block %d '
+                  'it is not computed and reported as 0.' % self.eval_block)
+
+    def worker_state(self):
+        return {'train_user_dict': self.data.train_user_dict, 'test_user_dict': self.data.test_user_dict,
+                'n_items': self.n_items, 'Ks': self.Ks, 'test_flag': self.args.test_flag}
+
+    def pool(self):
+        return multiprocessing.Pool(cores, initializer=init_worker, initargs=(self.worker_state(),))
+
+    def rate(self, user, item, user_batch):
+        # what the workers rank user_batch by: the full score rows, or only the top-K items
+        # without the training items with --eval_block.
+        import torch
+        if self.eval_block > 0:
+            return blocked_topk(user, item, max(self.Ks), self.eval_block, self.data.train_store, user_batch)
+        return torch.mm(user, item.t()).detach().cpu().numpy()
+
+    def evaluate_batches(self, pool, batches, n_test_users, topk=False):
+        # batches yields (rate_batch, user_batch) pairs; rate_batch holds the top items of
+        # blocked_topk with topk, the full score rows otherwise.
+        Ks = self.Ks
+        result = {'precision': np.zeros(len(Ks)), 'recall': np.zeros(len(Ks)), 'ndcg': np.zeros(len(Ks)),
+                  'hit_ratio': np.zeros(len(Ks)), 'auc': 0.}
+        count = 0
+        for rate_batch, user_batch in batches:
+            user_batch_rating_uid = zip(rate_batch, user_batch)
+            batch_result = pool.map(test_one_user_topk if topk else test_one_user, user_batch_rating_uid)
+            count += len(batch_result)
+
+            for re in batch_result:
+                result['precision'] += re['precision']/n_test_users
+                result['recall'] += re['recall']/n_test_users
+                result['ndcg'] += re['ndcg']/n_test_users
+                result['hit_ratio'] += re['hit_ratio']/n_test_users
+                result['auc'] += re['auc']/n_test_users
+
+        assert count == n_test_users
+        return result
+
+    def test(self, g, kg, model, users_to_test, pool=None):
+        # pool: a pool() kept open by the caller, a new one is created (and closed) otherwise.
+        import torch
+        model.eval()
+
+        own_pool = pool is None
+        pool = self.pool() if own_pool else pool       # multiprocessing.Pool 是一个用于管理和分配多个进程的工具。通过创建进程池，可以在多核CPU上并行执行任务，从而提高程序的运行效率。
+
+        u_batch_size = self.batch_size
+
+        test_users = users_to_test
+        n_test_users = len(test_users)
+        n_user_batchs = n_test_users // u_batch_size + 1
+
+        item_batch = np.arange(self.n_items)
         with torch.no_grad():
+            # one forward pass; the item rows are gathered once, the user rows per batch.
             embedding = model("test", g, kg)       # GNN.py中的def forward()
-            user = embedding[user_batch]
-            item = embedding[item_batch+data_generator.n_users]
-            rate_batch = torch.mm(user, torch.transpose(item, 0, 1)).detach().cpu().numpy()
-
-        user_batch_rating_uid = zip(rate_batch, user_batch)
-        batch_result = pool.map(test_one_user, user_batch_rating_uid)
-        count += len(batch_result)
-
-        for re in batch_result:
-            result['precision'] += re['precision']/n_test_users
-            result['recall'] += re['recall']/n_test_users
-            result['ndcg'] += re['ndcg']/n_test_users
-            result['hit_ratio'] += re['hit_ratio']/n_test_users
-            result['auc'] += re['auc']/n_test_users
-
-    assert count == n_test_users
-    pool.close()
-    return result
+            item = embedding[item_batch+self.n_users]
 
-def save_file(g, e_feat, model, users_to_test):
-    model.eval()
+        def batches():
+            for u_batch_id in range(n_user_batchs):
+                start = u_batch_id * u_batch_size
+                end = (u_batch_id + 1) * u_batch_size
 
-    u_batch_size = BATCH_SIZE
+                user_batch = test_users[start: end]
 
-    test_users = users_to_test
-    n_test_users = len(test_users)
-    n_user_batchs = n_test_users // u_batch_size + 1
+                with torch.no_grad():
+                    user = embedding[user_batch]
+                    rate_batch = self.rate(user, item, user_batch)
+                yield rate_batch, user_batch
 
-    res = []
+        result = self.evaluate_batches(pool, batches(), n_test_users, self.eval_block > 0)
+        if own_pool:
+            pool.close()
+        return result
 
-    for u_batch_id in range(n_user_batchs):
-        start = u_batch_id * u_batch_size
-        end = (u_batch_id + 1) * u_batch_size
-
-        user_batch = test_users[start: end]
-
-        item_batch = range(ITEM_NUM)
+    def test_groups(self, g, kg, model, groups, pool=None):
+        # test() of every user group (e.g. the sparsity split) with one forward pass.
+        import torch
+        model.eval()
         with torch.no_grad():
-            embedding = model(g, e_feat)
-            user = embedding[user_batch]
-            item = embedding[item_batch+data_generator.n_users]
-            rate_batch = torch.mm(user, torch.transpose(item, 0, 1)).cpu().numpy()
-            res.append(rate_batch)
-
-    res = np.concatenate(res, axis=0)
-    np.savetxt('{}_test_rate.txt'.format(args.dataset), res, fmt="%.06f")
-
-
-
-def test_saved_file(users_to_test):
-    res = np.loadtxt('{}_test_rate.txt'.format(args.dataset))
-    result = {'precision': np.zeros(len(Ks)), 'recall': np.zeros(len(Ks)), 'ndcg': np.zeros(len(Ks)),
-              'hit_ratio': np.zeros(len(Ks)), 'auc': 0.}
-
-    pool = multiprocessing.Pool(cores)
-    
-    u_batch_size = BATCH_SIZE * 2
-
-    test_users = users_to_test
-    n_test_users = len(test_users)
-    n_user_batchs = n_test_users // u_batch_size + 1
-
-    count = 0
-
-    for u_batch_id in range(n_user_batchs):
-        start = u_batch_id * u_batch_size
-        end = (u_batch_id + 1) * u_batch_size
-
-        user_batch = test_users[start: end]
-
-        item_batch = range(ITEM_NUM)
-        rate_batch = res[start:end]
-
-        user_batch_rating_uid = zip(rate_batch, user_batch)
-        batch_result = pool.map(test_one_user, user_batch_rating_uid)
-        count += len(batch_result)
-
-        for re in batch_result:
-            result['precision'] += re['precision']/n_test_users
-            result['recall'] += re['recall']/n_test_users
-            result['ndcg'] += re['ndcg']/n_test_users
-            result['hit_ratio'] += re['hit_ratio']/n_test_users
-            result['auc'] += re['auc']/n_test_users
-
-
-    assert count == n_test_users
-    pool.close()
-    return result
-
+            embedding = model("test", g, kg)
+            item = embedding[self.n_users: self.n_users + self.n_items]
+        u_batch_size = self.batch_size
+
+        def batches(users):
+            for start in range(0, len(users), u_batch_size):
+                user_batch = users[start: start + u_batch_size]
+                with torch.no_grad():
+                    rate_batch = self.rate(embedding[user_batch], item, user_batch)
+                yield rate_batch, user_batch
+
+        own_pool = pool is None
+        pool = self.pool() if own_pool else pool
+        results = [self.evaluate_batches(pool, batches(list(users)), len(users), self.eval_block > 0) for users in groups]
+        if own_pool:
+            pool.close()
+        return results
+
+    def save_file(self, g, e_feat, model, users_to_test):
+        import torch
+        model.eval()
+
+        u_batch_size = self.batch_size
+
+        test_users = users_to_test
+        n_test_users = len(test_users)
+        n_user_batchs = n_test_users // u_batch_size + 1
+
+        res = []
+
+        for u_batch_id in range(n_user_batchs):
+            start = u_batch_id * u_batch_size
+            end = (u_batch_id + 1) * u_batch_size
+
+            user_batch = test_users[start: end]
+
+            item_batch = np.arange(self.n_items)
+            with torch.no_grad():
+                embedding = model(g, e_feat)
+                user = embedding[user_batch]
+                item = embedding[item_batch+self.n_users]
+                rate_batch = torch.mm(user, torch.transpose(item, 0, 1)).cpu().numpy()
+                res.append(rate_batch)
+
+        res = np.concatenate(res, axis=0)
+        np.savetxt('{}_test_rate.txt'.format(self.args.dataset), res, fmt="%.06f")
+
+    def test_saved_file(self, users_to_test):
+        res = np.loadtxt('{}_test_rate.txt'.format(self.args.dataset))
+
+        pool = self.pool()
+
+        u_batch_size = self.batch_size * 2
+
+        test_users = users_to_test
+        n_test_users = len(test_users)
+        n_user_batchs = n_test_users // u_batch_size + 1
+
+        batches = ((res[u_batch_id * u_batch_size: (u_batch_id + 1) * u_batch_size],
+                    test_users[u_batch_id * u_batch_size: (u_batch_id + 1) * u_batch_size])
+                   for u_batch_id in range(n_user_batchs))
+        result = self.evaluate_batches(pool, batches, n_test_users)
+        pool.close()
+        return result
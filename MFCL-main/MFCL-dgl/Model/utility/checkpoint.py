@@ -0,0 +1,175 @@
+import copy
+import json
+import os
+import queue
+import random
+import shutil
+import threading
+import numpy as np
+import torch
+
+def to_cpu(obj):
+    # detached cpu copy of the tensors in a (nested) state dict, so training can go on
+    # updating the parameters while the copy is written.
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+def rng_state():
+    # the samplers of KGAT_loader draw from the global random and numpy generators.
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def capture(model, optimizers, scalers, epoch, loop):
+    return {'epoch': epoch,
+            'model': model.state_dict(),
+            'optimizers': [optimizer.state_dict() for optimizer in optimizers],
+            'scalers': [scaler.state_dict() for scaler in scalers],
+            'rng': rng_state(),
+            'loop': loop}
+
+def restore(state, model, optimizers, scalers):
+    # returns the epoch the checkpoint was written after and the saved training loop state.
+    model.load_state_dict(state['model'])
+    for optimizer, s in zip(optimizers, state['optimizers']):
+        optimizer.load_state_dict(s)
+    for scaler, s in zip(scalers, state['scalers']):
+        # a disabled GradScaler saves an empty state.
+        if s:
+            scaler.load_state_dict(s)
+    set_rng_state(state['rng'])
+    return state['epoch'], state['loop']
+
+class Checkpointer(object):
+    # Writes checkpoints on a background thread. latest.pt is replaced on every save and
+    # the keep_best checkpoints with the highest score are kept as best_epoch<N>.pt,
+    # index.json lists them. Files are written to a temporary name and renamed, so an
+    # interrupted write never leaves a truncated checkpoint behind. A state older than
+    # latest.pt (scored late by --eval_async) is only kept if it makes the best-K.
+    # With resume=False a new run starts with an empty index; the checkpoints of an earlier
+    # run in ckpt_dir are moved to ckpt_dir/previous<N>/ first.
+    def __init__(self, ckpt_dir, keep_best=3, resume=True):
+        self.ckpt_dir = ckpt_dir
+        self.keep_best = keep_best
+        if not os.path.exists(ckpt_dir):
+            os.makedirs(ckpt_dir)
+        if not resume:
+            self._archive()
+        self.index = {'latest': None, 'best': []}
+        if os.path.exists(self.path('index.json')):
+            with open(self.path('index.json')) as f:
+                self.index = json.load(f)
+        self.error = None
+        # the newest epoch this process wrote to latest.pt.
+        self.last_epoch = None
+        # at most one snapshot waits while another is written, a slow disk then stalls
+        # training instead of piling up copies of the model in memory.
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def path(self, name):
+        return os.path.join(self.ckpt_dir, name)
+
+    def latest(self):
+        if self.index['latest'] is None or not os.path.exists(self.path('latest.pt')):
+            return None
+        return self.path('latest.pt')
+
+    def best(self):
+        # the kept checkpoint with the highest score.
+        for score, epoch in self.index['best']:
+            if os.path.exists(self.path('best_epoch%d.pt' % epoch)):
+                return self.path('best_epoch%d.pt' % epoch)
+        return None
+
+    def load(self, path=None, map_location='cpu'):
+        path = path or self.latest()
+        if path is None:
+            return None
+        return torch.load(path, map_location=map_location, weights_only=False)
+
+    def save(self, state, score=None):
+        self._check()
+        self.queue.put((to_cpu(state), score))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+    def _archive(self):
+        names = [n for n in os.listdir(self.ckpt_dir)
+                 if n in ['index.json', 'latest.pt'] or (n.startswith('best_epoch') and n.endswith('.pt'))]
+        if not names:
+            return
+        n = 0
+        while os.path.exists(self.path('previous%d' % n)):
+            n += 1
+        os.makedirs(self.path('previous%d' % n))
+        for name in names:
+            os.replace(self.path(name), self.path(os.path.join('previous%d' % n, name)))
+        print('moved the checkpoints of an earlier run to %s' % self.path('previous%d' % n))
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('checkpoint writer failed') from self.error
+
+    def _write(self, state, name):
+        tmp = self.path(name + '.tmp')
+        torch.save(state, tmp)
+        os.replace(tmp, self.path(name))
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self._save(*item)
+            except Exception as e:
+                self.error = e
+
+    def _save(self, state, score):
+        epoch = state['epoch']
+        # stale against the saves of this process only, not against an index read from disk.
+        stale = self.last_epoch is not None and epoch < self.last_epoch
+        if not stale:
+            self._write(state, 'latest.pt')
+            self.index['latest'] = self.last_epoch = epoch
+        best = [b for b in self.index['best'] if b[1] != epoch]
+        if score is not None and self.keep_best > 0:
+            best.append([score, epoch])
+            best.sort(key=lambda b: -b[0])
+            if [score, epoch] in best[:self.keep_best]:
+                name = 'best_epoch%d.pt' % epoch
+                if stale:
+                    self._write(state, name)
+                else:
+                    tmp = self.path(name + '.tmp')
+                    shutil.copyfile(self.path('latest.pt'), tmp)
+                    os.replace(tmp, self.path(name))
+            for b in best[self.keep_best:]:
+                if os.path.exists(self.path('best_epoch%d.pt' % b[1])):
+                    os.remove(self.path('best_epoch%d.pt' % b[1]))
+            best = best[:self.keep_best]
+        self.index['best'] = best
+        tmp = self.path('index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.path('index.json'))
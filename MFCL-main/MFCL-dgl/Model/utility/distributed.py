@@ -0,0 +1,106 @@
+import datetime
+import math
+import os
+import random
+import subprocess
+import sys
+import numpy as np
+import torch
+import torch.distributed as dist
+
+# Data-parallel training over local processes with the gloo backend. The workers are
+# configured through the torchrun environment (RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT),
+# so `torchrun --nproc_per_node N main.py ...` works as well as `main.py --world_size N`.
+
+def launch(world_size, port):
+    # re-runs the current command line in world_size worker processes and waits for them.
+    # returns the exit code, the first failing worker's if any.
+    env = dict(os.environ, WORLD_SIZE=str(world_size), MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port),
+               OMP_NUM_THREADS=str(max(1, os.cpu_count() // world_size)))
+    workers = [subprocess.Popen([sys.executable] + sys.argv, env=dict(env, RANK=str(rank), LOCAL_RANK=str(rank)))
+               for rank in range(world_size)]
+    codes = [w.wait() for w in workers]
+    return next((c for c in codes if c != 0), 0)
+
+def is_worker():
+    return 'RANK' in os.environ and int(os.environ.get('WORLD_SIZE', 1)) > 1
+
+def init():
+    # joins the process group when started as a worker, returns (rank, world_size).
+    if not is_worker():
+        return 0, 1
+    # the other ranks wait in a broadcast while rank 0 evaluates.
+    dist.init_process_group('gloo', init_method='env://', timeout=datetime.timedelta(hours=2))
+    torch.set_num_threads(max(1, os.cpu_count() // dist.get_world_size()))
+    return dist.get_rank(), dist.get_world_size()
+
+def initialized():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+def rank():
+    return dist.get_rank() if initialized() else 0
+
+def world_size():
+    return dist.get_world_size() if initialized() else 1
+
+def is_main():
+    return rank() == 0
+
+def seed(base):
+    # every rank draws its own CF/KG/CL batches and subgraphs.
+    s = base + rank()
+    random.seed(s)
+    np.random.seed(s)
+    torch.manual_seed(s)
+
+def shard(n_steps):
+    # steps of one phase per rank: all ranks run the same number so the all-reduces pair up.
+    return int(math.ceil(n_steps / world_size()))
+
+def broadcast_parameters(model, src=0):
+    if not initialized():
+        return
+    with torch.no_grad():
+        for t in list(model.parameters()) + list(model.buffers()):
+            if not getattr(t, 'partitioned', False):
+                dist.broadcast(t.data, src)
+
+def broadcast_object(obj, src=0):
+    if not initialized():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src)
+    return objs[0]
+
+def barrier():
+    if initialized():
+        dist.barrier()
+
+def sync_grads(optimizer, average=True):
+    # averages (or sums) the gradients of the replicated parameters of the optimizer with one
+    # all-reduce, parameters marked partitioned hold different rows on every rank and are skipped.
+    # a parameter without gradient on every rank keeps grad None, so the optimizer skips it
+    # exactly as in single-process training.
+    if not initialized():
+        return
+    params = [p for group in optimizer.param_groups for p in group['params'] if not getattr(p, 'partitioned', False)]
+    if not params:
+        return
+    flat = [p.grad.reshape(-1).float() if p.grad is not None else p.new_zeros(p.numel(), dtype=torch.float)
+            for p in params]
+    has_grad = torch.tensor([float(p.grad is not None) for p in params], device=params[0].device)
+    buf = torch.cat(flat + [has_grad])
+    dist.all_reduce(buf)
+    if average:
+        buf /= dist.get_world_size()
+    has_grad = buf[-len(params):].tolist()
+    offset = 0
+    for p, h in zip(params, has_grad):
+        n = p.numel()
+        if h > 0:
+            g = buf[offset: offset + n].view(p.shape).to(p.dtype)
+            if p.grad is None:
+                p.grad = g.clone()
+            else:
+                p.grad.copy_(g)
+        offset += n
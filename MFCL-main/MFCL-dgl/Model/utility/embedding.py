@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+from utility.amp import l2_normalize
+
+# Lazy views of the concatenated embedding tables of myGAT. The losses and the evaluation only
+# use a few rows of them, so the rows are gathered from every component first and only those
+# are (normalized and) concatenated, instead of building the full table and indexing it.
+
+def as_index(idx, n, device):
+    if isinstance(idx, slice):
+        return torch.arange(*idx.indices(n), device=device)
+    if torch.is_tensor(idx):
+        return idx.to(device=device, dtype=torch.long)
+    return torch.as_tensor(np.asarray(idx), dtype=torch.long, device=device)
+
+class ConcatEmbedding(object):
+    # torch.cat(parts, 1), or torch.cat([l2_normalize(p, epsilon) for p in parts], 1) when epsilon
+    # is given. A part is a tensor or another lazy view with the same number of rows.
+    def __init__(self, parts, epsilon=None):
+        self.parts = parts
+        self.epsilon = epsilon
+
+    def __len__(self):
+        return len(self.parts[0])
+
+    @property
+    def shape(self):
+        return torch.Size([len(self), sum(p.shape[1] for p in self.parts)])
+
+    @property
+    def device(self):
+        return self.parts[0].device
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, slice):
+            idx = as_index(idx, len(self), self.device)
+        rows = [p[idx] for p in self.parts]
+        if self.epsilon is not None:
+            rows = [l2_normalize(r, self.epsilon) for r in rows]
+        return torch.cat(rows, 1)
+
+class RowStack(object):
+    # torch.cat([t[:n] for t, n in zip(tables, lengths)], 0); a table is a tensor or a lazy view.
+    def __init__(self, tables, lengths=None):
+        self.tables = tables
+        lengths = lengths or [len(t) for t in tables]
+        self.offsets = np.cumsum([0] + list(lengths))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def shape(self):
+        return torch.Size([len(self), self.tables[0].shape[1]])
+
+    @property
+    def device(self):
+        return self.tables[0].device
+
+    def __getitem__(self, idx):
+        idx = as_index(idx, len(self), self.device)
+        part = torch.bucketize(idx, torch.as_tensor(self.offsets[1:-1], device=idx.device), right=True)
+        rows, pos = [], []
+        for p, t in enumerate(self.tables):
+            sel = torch.nonzero(part == p).flatten()
+            if len(sel) > 0:
+                rows.append(t[idx[sel] - int(self.offsets[p])])
+                pos.append(sel)
+        if not rows:
+            return self.tables[0][idx[:0]]
+        # back to the order of idx.
+        return torch.cat(rows, 0)[torch.argsort(torch.cat(pos))]
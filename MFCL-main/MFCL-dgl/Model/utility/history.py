@@ -0,0 +1,59 @@
+import torch
+
+class History(object):
+    # Historical embeddings of one propagation (one GAT stack on one graph), GNNAutoScale-style:
+    # tables[l] holds the last computed output of layer l of every node. A batch step runs
+    # the layers only for the batch nodes over their in-edges, reading the layer inputs of the
+    # neighbors outside the batch from the tables; a refresh step runs the exact full-graph
+    # propagation and rewrites the tables.
+    #   refresh_every: every refresh_every-th step of this propagation is a refresh step.
+    #   max_staleness: also refresh when a neighbor row read by a batch step was written more
+    #                  than max_staleness steps ago, 0 to disable.
+    def __init__(self, n_nodes, dims, refresh_every=10, max_staleness=0):
+        self.n_nodes = n_nodes
+        self.dims = dims
+        self.refresh_every = max(1, refresh_every)
+        self.max_staleness = max_staleness
+        self.tables = None
+        self.written = None
+        self.graph = None
+        self.reg = 0
+        self.step = 0
+
+    def block(self, g, nodes):
+        # in-edges of the batch nodes; the batch nodes come first among the sources and
+        # block.edata[dgl.EID] are the edge ids in g.
+        import dgl
+        frontier = dgl.in_subgraph(g, nodes)
+        block = dgl.to_block(frontier, dst_nodes=nodes)
+        # to_block numbers the edges of the frontier.
+        block.edata[dgl.EID] = frontier.edata[dgl.EID][block.edata[dgl.EID]]
+        return block
+
+    def needs_refresh(self, g, src):
+        # src: the neighbors outside the batch whose rows a batch step would read.
+        if self.tables is None or g is not self.graph or self.step % self.refresh_every == 0:
+            return True
+        if self.max_staleness > 0 and len(src) > 0:
+            return int((self.step - self.written[src]).max()) > self.max_staleness
+        return False
+
+    def refreshed(self, g, reg=0):
+        self.graph = g
+        self.reg = reg
+
+    def fill(self, l, h):
+        # the output of layer l for all nodes, from a refresh step.
+        h = h.detach()
+        if self.tables is None:
+            self.tables = [None] * len(self.dims)
+            self.written = torch.zeros(self.n_nodes, dtype=torch.long, device=h.device)
+        self.tables[l] = h.clone()
+        self.written.fill_(self.step)
+
+    def push(self, l, nodes, h):
+        self.tables[l][nodes] = h.detach().to(self.tables[l].dtype)
+        self.written[nodes] = self.step
+
+    def pull(self, l, nodes):
+        return self.tables[l][nodes]
@@ -0,0 +1,120 @@
+import array
+from collections.abc import Mapping
+import numpy as np
+from utility.reader import iter_lines
+
+class CSR(object):
+    # Read-only user-item (or item-user) interactions: the sorted, deduplicated neighbors of
+    # row r are indices[indptr[r]:indptr[r + 1]].
+    def __init__(self, indptr, indices, n_cols):
+        self.indptr = indptr
+        self.indices = indices
+        self.n_rows = len(indptr) - 1
+        self.n_cols = n_cols
+        self.degree = np.diff(indptr).astype(np.int32)
+
+    @classmethod
+    def from_pairs(cls, rows, cols, n_rows=None, n_cols=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        n_rows = n_rows if n_rows is not None else (int(rows.max()) + 1 if len(rows) else 0)
+        n_cols = n_cols if n_cols is not None else (int(cols.max()) + 1 if len(cols) else 0)
+        key = np.unique(rows * max(n_cols, 1) + cols)
+        rows, cols = key // max(n_cols, 1), key % max(n_cols, 1)
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+        return cls(indptr, cols.astype(np.int32), n_cols)
+
+    @classmethod
+    def from_file(cls, file_name):
+        # lines "user item item ...", as in train.txt / test.txt.
+        users, counts, items = array.array('q'), array.array('q'), array.array('q')
+        for l in iter_lines(file_name):
+            ids = l.split()
+            if not ids:
+                continue
+            users.append(int(ids[0]))
+            counts.append(len(ids) - 1)
+            items.extend(int(i) for i in ids[1:])
+        users, counts = np.frombuffer(users, dtype=np.int64), np.frombuffer(counts, dtype=np.int64)
+        return cls.from_pairs(np.repeat(users, counts), np.frombuffer(items, dtype=np.int64))
+
+    def __len__(self):
+        return int(self.indptr[-1])
+
+    def neighbors(self, r):
+        if not 0 <= r < self.n_rows:
+            return self.indices[:0]
+        return self.indices[self.indptr[r]: self.indptr[r + 1]]
+
+    def contains(self, r, c):
+        # binary search in the neighbors of r, O(log d).
+        nbrs = self.neighbors(r)
+        pos = np.searchsorted(nbrs, c)
+        return pos < len(nbrs) and nbrs[pos] == c
+
+    def contains_batch(self, rows, cols):
+        # contains for every (rows[i], cols[i]) pair, one vectorized binary search step per
+        # halving of the largest degree.
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        valid = (rows >= 0) & (rows < self.n_rows)
+        rows = np.where(valid, rows, 0)
+        lo, hi = self.indptr[rows], self.indptr[rows + 1]
+        hi = np.where(valid, hi, lo)
+        end = hi.copy()
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            less = self.indices[np.minimum(mid, len(self.indices) - 1)] < cols
+            lo = np.where(active & less, mid + 1, lo)
+            hi = np.where(active & ~less, mid, hi)
+        found = lo < end
+        found[found] = self.indices[lo[found]] == cols[found]
+        return found
+
+    def gather(self, rows):
+        # (i, col) pairs of the neighbors of every rows[i], as two arrays.
+        rows = np.asarray(rows, dtype=np.int64)
+        degree = self.degree[rows].astype(np.int64)
+        pos = np.repeat(np.arange(len(rows)), degree)
+        offset = np.arange(len(pos)) - np.repeat(np.cumsum(degree) - degree, degree)
+        return pos, self.indices[np.repeat(self.indptr[rows], degree) + offset]
+
+    def nonempty(self):
+        return np.nonzero(self.degree)[0]
+
+    def pairs(self):
+        # (n, 2) array of the (row, col) interactions.
+        rows = np.repeat(np.arange(self.n_rows, dtype=np.int64), self.degree)
+        return np.stack([rows, self.indices.astype(np.int64)], 1)
+
+    def transpose(self, n_rows=None):
+        pairs = self.pairs()
+        return CSR.from_pairs(pairs[:, 1], pairs[:, 0], n_rows or self.n_cols, self.n_rows)
+
+    def as_dict(self):
+        return NeighborDict(self)
+
+class NeighborDict(Mapping):
+    # dict view of a CSR for the callers of the former user_dict/item_dict: the keys are the
+    # rows with at least one interaction, the values their sorted neighbor arrays.
+    def __init__(self, csr):
+        self.csr = csr
+        self._keys = csr.nonempty()
+
+    def __getitem__(self, r):
+        if not 0 <= r < self.csr.n_rows or self.csr.degree[r] == 0:
+            raise KeyError(r)
+        return self.csr.neighbors(r)
+
+    def __contains__(self, r):
+        return 0 <= r < self.csr.n_rows and self.csr.degree[r] > 0
+
+    def __iter__(self):
+        return iter(self._keys.tolist())
+
+    def __len__(self):
+        return len(self._keys)
@@ -1,7 +1,7 @@
 import collections
-import numpy as np
-import random as rd
-from time import time
+from utility.reader import unique_rows
+from utility.interactions import CSR
+from utility import stats
 class Data(object):
     def __init__(self, args, path):
         self.path = path
@@ -18,8 +18,10 @@ class Data(object):
         self.n_train, self.n_test = 0, 0
         self.n_users, self.n_items = 0, 0
 
-        self.train_data, self.train_user_dict, self.train_item_dict = self._load_ratings(train_file)
-        self.test_data, self.test_user_dict, self.test_item_dict = self._load_ratings(test_file)
+        # CSR stores of the interactions, the dicts are read-only views of them.
+        self.train_store, self.test_store = self._load_ratings(train_file), self._load_ratings(test_file)
+        self.train_user_dict, self.train_item_dict = self._views(self.train_store)
+        self.test_user_dict, self.test_item_dict = self._views(self.test_store)
         
         self.exist_users = self.train_user_dict.keys()
         self.exist_items = self.train_item_dict.keys()
@@ -38,33 +40,26 @@ class Data(object):
 
     # reading train & test interaction data.
     def _load_ratings(self, file_name):
-        user_dict = dict()
-        item_dict = dict()
-        inter_mat = list()
-        
-        lines = open(file_name, 'r').readlines()
-        for l in lines:
-            tmps = l.strip()
-            inters = [int(i) for i in tmps.split(' ')]
-
-            u_id, pos_ids = inters[0], inters[1:]
-            pos_ids = list(set(pos_ids))
-
-            for i_id in pos_ids:
-                inter_mat.append([u_id, i_id])
-                if i_id not in item_dict.keys():
-                    item_dict[i_id] = []
-                item_dict[i_id].append(u_id)
-            
-            if len(pos_ids) > 0:
-                user_dict[u_id] = pos_ids
-        return np.array(inter_mat), user_dict, item_dict
+        return CSR.from_file(file_name)
+
+    def _views(self, store):
+        # the user -> items and item -> users dicts.
+        return store.as_dict(), store.transpose().as_dict()
+
+    # the (user, item) interaction matrices, rebuilt from the stores when needed.
+    @property
+    def train_data(self):
+        return self.train_store.pairs()
+
+    @property
+    def test_data(self):
+        return self.test_store.pairs()
 
     def _statistic_ratings(self):
-        self.n_users = max(max(self.train_data[:, 0]), max(self.test_data[:, 0])) + 1
-        self.n_items = max(max(self.train_data[:, 1]), max(self.test_data[:, 1])) + 1
-        self.n_train = len(self.train_data)
-        self.n_test = len(self.test_data)
+        self.n_users = max(self.train_store.n_rows, self.test_store.n_rows)
+        self.n_items = max(self.train_store.n_cols, self.test_store.n_cols)
+        self.n_train = len(self.train_store)
+        self.n_test = len(self.test_store)
 
     # reading train & test interaction data.
     def _load_kg(self, file_name):
@@ -80,16 +75,15 @@ class Data(object):
                 rd[relation].append((head, tail))
             return kg, rd
 
-        kg_np = np.loadtxt(file_name, dtype=np.int32)
-        kg_np = np.unique(kg_np, axis=0)
+        kg_np = unique_rows(file_name, 3, chunk_lines=self.args.chunk_lines, n_buckets=self.args.dedup_buckets,
+                            tmp_dir=self.args.tmp_dir)
         
-        self.n_relations = max(kg_np[:, 1]) + 1
-        self.n_entities = max(max(kg_np[:, 0]), max(kg_np[:, 2])) + 1
-        #self.n_triples = len(kg_np)
+        self.n_relations = kg_np[:, 1].max() + 1
+        self.n_entities = max(kg_np[:, 0].max(), kg_np[:, 2].max()) + 1
+        # the triples are unique, so every one of them ends up in relation_dict.
+        self.n_triples = len(kg_np)
+        self.relation_freq = stats.relation_frequency(kg_np[:, 1], self.n_relations)
         kg_dict, relation_dict = _construct_kg(kg_np)
-        self.n_triples = 0
-        for r in relation_dict.keys():
-            self.n_triples += len(relation_dict[r])
         return kg_dict, relation_dict
         
 
@@ -99,76 +93,15 @@ class Data(object):
         print('[n_entities, n_relations, n_triples]=[%d, %d, %d]' % (self.n_entities, self.n_relations, self.n_triples))
         print('[batch_size, batch_size_kg]=[%d, %d]' % (self.batch_size, self.batch_size_kg))
 
-    def get_sparsity_split(self):
-        try:
-            split_uids, split_state = [], []
-            lines = open(self.path + '/sparsity.split', 'r').readlines()
-
-            for idx, line in enumerate(lines):
-                if idx % 2 == 0:
-                    split_state.append(line.strip())
-                    print(line.strip())
-                else:
-                    split_uids.append([int(uid) for uid in line.strip().split(' ')])
-            print('get sparsity split.')
-
-        except Exception:
-            split_uids, split_state = self.create_sparsity_split()
-            f = open(self.path + '/sparsity.split', 'w')
-            for idx in range(len(split_state)):
-                f.write(split_state[idx] + '\n')
-                f.write(' '.join([str(uid) for uid in split_uids[idx]]) + '\n')
-            print('create sparsity split.')
+    def get_statistics(self, fold=4):
+        # degree histograms, relation frequencies and the sparsity split, see utility/stats.py.
+        return stats.load_or_compute(self, fold)
 
+    def get_sparsity_split(self):
+        split_uids, split_state = stats.split_lists(self.get_statistics())
+        for state in split_state:
+            print(state)
         return split_uids, split_state
 
     def create_sparsity_split(self):
-        all_users_to_test = list(self.test_user_dict.keys())
-        user_n_iid = dict()
-
-        # generate a dictionary to store (key=n_iids, value=a list of uid).
-        for uid in all_users_to_test:
-            train_iids = self.train_user_dict[uid]
-            test_iids = self.test_user_dict[uid]
-
-            n_iids = len(train_iids) + len(test_iids)
-
-            if n_iids not in user_n_iid.keys():
-                user_n_iid[n_iids] = [uid]
-            else:
-                user_n_iid[n_iids].append(uid)
-        split_uids = list()
-
-        # split the whole user set into four subset.
-        temp = []
-        count = 1
-        fold = 4
-        n_count = (self.n_train + self.n_test)
-        n_rates = 0
-
-        split_state = []
-        for idx, n_iids in enumerate(sorted(user_n_iid)):
-            temp += user_n_iid[n_iids]
-            n_rates += n_iids * len(user_n_iid[n_iids])
-            n_count -= n_iids * len(user_n_iid[n_iids])
-
-            if n_rates >= count * 0.25 * (self.n_train + self.n_test):
-                split_uids.append(temp)
-
-                state = '#inter per user<=[%d], #users=[%d], #all rates=[%d]' %(n_iids, len(temp), n_rates)
-                split_state.append(state)
-                print(state)
-
-                temp = []
-                n_rates = 0
-                fold -= 1
-
-            if idx == len(user_n_iid.keys()) - 1 or n_count == 0:
-                split_uids.append(temp)
-
-                state = '#inter per user<=[%d], #users=[%d], #all rates=[%d]' % (n_iids, len(temp), n_rates)
-                split_state.append(state)
-                print(state)
-
-
-        return split_uids, split_state
\ No newline at end of file
+        return stats.sparsity_split(self.train_store, self.test_store)
@@ -1,5 +1,8 @@
 import numpy as np
 from utility.load_data import Data
+from utility.sampler import degree_sampler
+from utility.interactions import CSR
+from utility import reorder
 
 import scipy.sparse as sp
 import random as rd
@@ -9,18 +12,109 @@ from time import time
 class KGAT_loader(Data):
     def __init__(self, args, path):
         super().__init__(args, path)        # super()调用父类
-        self.all_kg_dict = self._get_all_kg_dict()
-        # generate the sparse adjacency matrices for user-item interaction.
-        self.adj_list= self._get_cf_adj_list()
-        self.kg_adj_list, self.adj_r_list = self._get_kg_adj_list()
-
-        # generate the sparse laplacian matrices.
-        self.lap_list = self._get_lap_list()
-        self.kg_lap_list = self._get_kg_lap_list()
-        
+        # --node_order: the loaded ids are renumbered, user_order/entity_order map the new ids
+        # to the dataset ids and user_rank/entity_rank back (None without renumbering).
+        self.user_order, self.entity_order = None, None
+        self.user_rank, self.entity_rank = None, None
+        if args.node_order != 'none':
+            self._reorder(args.node_order)
         # generate the triples dictionary, key is 'head', value is '(tail, relation)'.
+        self.all_kg_dict = self._get_all_kg_dict()
+        # every relation also has an inverse relation.
+        self.n_relations = self.n_relations * 2
+        # the adjacency and laplacian matrices are built on first use, so the
+        # evaluation and the tools that only need the interactions start fast.
+        self._adj_list = None
+        self._kg_adj_list, self._adj_r_list = None, None
+        self._lap_list = None
+        self._kg_lap_list = None
+        self._relation_arrays = None
+        # the negative items and tails, uniform or weighted by the degree (alias tables).
+        self.item_sampler = degree_sampler(np.bincount(self.train_store.indices, minlength=self.n_items), args.neg_item_exp)
+        entity_degree = np.zeros(self.n_entities, dtype=np.int64)
+        for h, triples in self.all_kg_dict.items():
+            entity_degree[h] = len(triples)
+        self.entity_sampler = degree_sampler(entity_degree, args.neg_entity_exp)
+
+    def _reorder(self, method):
+        t1 = time()
+        n_entities = max(self.n_entities, self.n_items)
+        kg_pairs = np.concatenate([np.array(pairs, dtype=np.int64).reshape(-1, 2) for pairs in self.relation_dict.values()])
+        self.user_order, self.entity_order = reorder.node_order(method, self.n_users, self.n_items, n_entities,
+                                                                self.train_store.pairs(), kg_pairs)
+        self.user_rank, self.entity_rank = reorder.rank(self.user_order), reorder.rank(self.entity_order)
+        self.train_store, self.test_store = self._relabel(self.train_store), self._relabel(self.test_store)
+        self.train_user_dict, self.train_item_dict = self._views(self.train_store)
+        self.test_user_dict, self.test_item_dict = self._views(self.test_store)
+        self.exist_users = self.train_user_dict.keys()
+        self.exist_items = self.train_item_dict.keys()
+        for r, pairs in self.relation_dict.items():
+            self.relation_dict[r] = [tuple(p) for p in self.entity_rank[np.array(pairs, dtype=np.int64)].tolist()]
+        self.kg_dict = collections.defaultdict(list)
+        for r, pairs in self.relation_dict.items():
+            for head, tail in pairs:
+                self.kg_dict[head].append((tail, r))
+        print('renumbered the users and entities by %s [%.1fs]' % (method, time() - t1))
+
+    def _relabel(self, store):
+        pairs = store.pairs()
+        return CSR.from_pairs(self.user_rank[pairs[:, 0]], self.entity_rank[pairs[:, 1]], self.n_users, self.n_items)
+
+    def to_dataset_ids(self, user=None, item=None, store=None):
+        # rows indexed by the new user/item ids (and a users x items CSR) in the dataset ids.
+        if self.user_rank is None:
+            return user, item, store
+        if user is not None:
+            user = user[self.user_rank]
+        if item is not None:
+            item = item[self.entity_rank[:self.n_items]]
+        if store is not None:
+            pairs = store.pairs()
+            store = CSR.from_pairs(self.user_order[pairs[:, 0]], self.entity_order[pairs[:, 1]], store.n_rows, store.n_cols)
+        return user, item, store
+
+    def reorder_pretrained(self, pretrain_data):
+        # the pretrained user and item embeddings (in the dataset ids) in the new ids.
+        if pretrain_data is None or self.user_order is None:
+            return pretrain_data
+        return {'user_embed': pretrain_data['user_embed'][self.user_order],
+                'item_embed': pretrain_data['item_embed'][self.entity_order[:self.n_items]]}
+
+    @property
+    def adj_list(self):
+        # the sparse adjacency matrix for user-item interaction.
+        if self._adj_list is None:
+            self._adj_list = self._get_cf_adj_list()
+        return self._adj_list
+
+    @property
+    def kg_adj_list(self):
+        if self._kg_adj_list is None:
+            self._kg_adj_list, self._adj_r_list = self._get_kg_adj_list()
+        return self._kg_adj_list
+
+    @property
+    def adj_r_list(self):
+        if self._adj_r_list is None:
+            self._kg_adj_list, self._adj_r_list = self._get_kg_adj_list()
+        return self._adj_r_list
+
+    @property
+    def lap_list(self):
+        # the sparse laplacian matrices.
+        if self._lap_list is None:
+            self._lap_list = self._get_lap_list()
+        return self._lap_list
+
+    @property
+    def kg_lap_list(self):
+        if self._kg_lap_list is None:
+            self._kg_lap_list = self._get_kg_lap_list()
+        return self._kg_lap_list
     
-    def _get_cf_adj_list(self, is_subgraph = False, dropout_rate = None):
+    def _get_cf_adj_list(self, is_subgraph = False, dropout_rate = None, rng = None):
+        # rng: the random state of the edge dropout, np.random by default.
+        rng = rng or np.random
         def _np_mat2sp_adj(np_mat, row_pre, col_pre):
             n_all = self.n_users + self.n_items
             # single-direction
@@ -28,7 +122,7 @@ class KGAT_loader(Data):
             a_cols = np_mat[:, 1] + col_pre
             if is_subgraph is True:
                 subgraph_idx = np.arange(len(a_rows))
-                subgraph_id = np.random.choice(subgraph_idx, size = int(dropout_rate * len(a_rows)), replace = False)
+                subgraph_id = rng.choice(subgraph_idx, size = int(dropout_rate * len(a_rows)), replace = False)
                 a_rows = a_rows[subgraph_id]
                 a_cols = a_cols[subgraph_id]
                 
@@ -40,7 +134,8 @@ class KGAT_loader(Data):
         R = _np_mat2sp_adj(self.train_data, row_pre=0, col_pre=self.n_users)
         return R
 
-    def _get_kg_adj_list(self, is_subgraph = False, dropout_rate = None):
+    def _get_kg_adj_list(self, is_subgraph = False, dropout_rate = None, rng = None):
+        rng = rng or np.random
         adj_mat_list = []
         adj_r_list = []
         def _np_mat2sp_adj(np_mat):
@@ -50,7 +145,7 @@ class KGAT_loader(Data):
             a_cols = np_mat[:, 1]
             if is_subgraph is True:
                 subgraph_idx = np.arange(len(a_rows))
-                subgraph_id = np.random.choice(subgraph_idx, size = int(dropout_rate * len(a_rows)), replace = False)
+                subgraph_id = rng.choice(subgraph_idx, size = int(dropout_rate * len(a_rows)), replace = False)
                 #print(subgraph_id[:10])
                 a_rows = a_rows[subgraph_id]
                 a_cols = a_cols[subgraph_id]
@@ -65,15 +160,17 @@ class KGAT_loader(Data):
 
             return a_adj, b_adj
         
+        if self._relation_arrays is None:
+            # the (head, tail) arrays of every relation, converted once for all subgraphs.
+            self._relation_arrays = {r_id: np.array(self.relation_dict[r_id]) for r_id in self.relation_dict.keys()}
         for r_id in self.relation_dict.keys():
             #print(r_id)
-            K, K_inv = _np_mat2sp_adj(np.array(self.relation_dict[r_id]))
+            K, K_inv = _np_mat2sp_adj(self._relation_arrays[r_id])
             adj_mat_list.append(K)
             adj_r_list.append(r_id)
 
             adj_mat_list.append(K_inv)
-            adj_r_list.append(r_id + self.n_relations)
-        self.n_relations = self.n_relations * 2
+            adj_r_list.append(r_id + self.n_relations // 2)
         #print(adj_r_list)
         return adj_mat_list, adj_r_list
 
@@ -130,51 +227,34 @@ class KGAT_loader(Data):
 
     def _generate_train_cf_batch(self):
         if self.batch_size <= self.n_users:
-            users = rd.sample(self.exist_users, self.batch_size)
+            users = rd.sample(list(self.exist_users), self.batch_size)
         else:
             users_list = list(self.exist_users)
             users = [rd.choice(users_list) for _ in range(self.batch_size)]
 
-        def sample_pos_items_for_u(u, num):
-            pos_items = self.train_user_dict[u]
-            n_pos_items = len(pos_items)
-            pos_batch = []
-            while True:
-                if len(pos_batch) == num: break
-                pos_id = np.random.randint(low=0, high=n_pos_items, size=1)[0]
-                pos_i_id = pos_items[pos_id]
-
-                if pos_i_id not in pos_batch:
-                    pos_batch.append(pos_i_id)
-            return pos_batch
-        
-        def sample_neg_items_for_u(u, num):
-            neg_items = []
-            while True:
-                if len(neg_items) == num: break
-                neg_i_id = np.random.randint(low=0, high=self.n_items,size=1)[0]
-
-                if neg_i_id not in self.train_user_dict[u] and neg_i_id not in neg_items:
-                    neg_items.append(neg_i_id)
-            return neg_items
-        
-        pos_items, neg_items = [], []
-        for u in users:
-            pos_items += sample_pos_items_for_u(u, 1)
-            neg_items += sample_neg_items_for_u(u, 1)
-        return users, pos_items, neg_items
+        # one positive and one negative item per user, drawn for the whole batch at once.
+        users_np = np.asarray(users, dtype=np.int64)
+        store = self.train_store
+        pos_items = store.indices[store.indptr[users_np] + (np.random.rand(len(users_np)) * store.degree[users_np]).astype(np.int64)]
+        neg_items = self.item_sampler.draw(len(users_np))
+        while True:
+            clash = store.contains_batch(users_np, neg_items)
+            if not clash.any():
+                break
+            neg_items[clash] = self.item_sampler.draw(int(clash.sum()))
+        return users, pos_items.tolist(), neg_items.tolist()
 
 
     def _generate_train_cl_batch(self):
         if self.batch_size_cl <= len(self.exist_items):
-            items = rd.sample(self.exist_items, self.batch_size_cl)
+            items = rd.sample(list(self.exist_items), self.batch_size_cl)
         else:
             items_list = list(self.exist_items)
             items = [rd.choice(items_list) for _ in range(self.batch_size_cl)]
         return items
     
     def _generate_train_kg_batch(self):
-        exist_heads = self.all_kg_dict.keys()
+        exist_heads = list(self.all_kg_dict.keys())
 
         if self.batch_size_kg <= len(exist_heads):
             heads = rd.sample(exist_heads, self.batch_size_kg)
@@ -197,24 +277,26 @@ class KGAT_loader(Data):
                     pos_ts.append(t)
             return pos_rs, pos_ts
 
-        def sample_neg_triples_for_h(h, r, num):
+        def sample_neg_triples_for_h(h, r, num, t):
+            # t: the first candidate, drawn for the whole batch at once.
             neg_ts = []
             while True:
                 if len(neg_ts) == num: break
 
-                t = np.random.randint(low=0, high=self.n_entities, size=1)[0]
                 if (t, r) not in self.all_kg_dict[h] and t not in neg_ts:
                     neg_ts.append(t)
+                t = self.entity_sampler.draw(1)[0]
             return neg_ts
         
         pos_r_batch, pos_t_batch, neg_t_batch = [], [], []
+        neg_candidates = self.entity_sampler.draw(len(heads)).tolist()
 
-        for h in heads:
+        for h, t in zip(heads, neg_candidates):
             pos_rs, pos_ts = sample_pos_triples_for_h(h, 1)
             pos_r_batch += pos_rs
             pos_t_batch += pos_ts
 
-            neg_ts = sample_neg_triples_for_h(h, pos_rs[0], 1)
+            neg_ts = sample_neg_triples_for_h(h, pos_rs[0], 1, t)
             neg_t_batch += neg_ts
 
         return heads, pos_r_batch, pos_t_batch, neg_t_batch
@@ -1,5 +1,4 @@
 import numpy as np
-from sklearn.metrics import roc_auc_score, log_loss, mean_squared_error
 
 def recall(rank, ground_truth, N):
     return len(set(rank[:N]) & set(ground_truth)) / float(len(set(ground_truth)))
@@ -95,6 +94,8 @@ def F1(pre, rec):
         return 0.
 
 def auc(ground_truth, prediction):
+    # sklearn is imported on first use, it is only needed for the full-ranking auc.
+    from sklearn.metrics import roc_auc_score
     try:
         res = roc_auc_score(y_true=ground_truth, y_score=prediction)
     except Exception:
@@ -102,6 +103,7 @@ def auc(ground_truth, prediction):
     return res
 
 def logloss(ground_truth, prediction):
+    from sklearn.metrics import log_loss
     # preds = [max(min(p, 1. - 10e-12), 10e-12) for p in prediction]
     logloss = log_loss(np.asarray(ground_truth), np.asarray(prediction))
     return logloss
@@ -0,0 +1,87 @@
+import math
+import torch
+
+class LazyAdam(torch.optim.Optimizer):
+    # Adam that only updates the rows of the embedding tables whose gradient is non-zero
+    # (param groups with lazy=True); moments of untouched rows are neither decayed nor applied.
+    # The moments of a lazy table are only allocated for the rows that ever got a gradient:
+    # state['rows'] holds their sorted ids, state['exp_avg']/['exp_avg_sq'] one row each.
+    # Finding the touched rows syncs with the device once per table and step.
+    # Other param groups follow the dense Adam update.
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, lazy=False):
+        defaults = dict(lr=lr, betas=betas, eps=eps, lazy=lazy)
+        super(LazyAdam, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                state = self.state[p]
+                if len(state) == 0:
+                    state['step'] = 0
+                    if group['lazy']:
+                        state['rows'] = torch.zeros(0, dtype=torch.long, device=p.device)
+                        state['exp_avg'] = p.new_zeros((0,) + p.shape[1:])
+                        state['exp_avg_sq'] = p.new_zeros((0,) + p.shape[1:])
+                    else:
+                        state['exp_avg'] = torch.zeros_like(p)
+                        state['exp_avg_sq'] = torch.zeros_like(p)
+                state['step'] += 1
+                bias_correction1 = 1 - beta1 ** state['step']
+                bias_correction2 = 1 - beta2 ** state['step']
+                step_size = group['lr'] * math.sqrt(bias_correction2) / bias_correction1
+                if group['lazy']:
+                    self._lazy_update(p, state, beta1, beta2, step_size, group['eps'])
+                    continue
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+                exp_avg.mul_(beta1).add_(p.grad, alpha=1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+                denom = exp_avg_sq.sqrt().add_(group['eps'] * math.sqrt(bias_correction2))
+                p.addcdiv_(exp_avg, denom, value=-step_size)
+        return loss
+
+    def _lazy_update(self, p, state, beta1, beta2, step_size, eps):
+        grad = p.grad
+        rows = grad.view(grad.size(0), -1).ne(0).any(dim=1).nonzero().squeeze(1)
+        if rows.numel() == 0:
+            return
+        values = grad[rows]
+        # load_state_dict casts every state tensor to the dtype of the parameter.
+        known = state['rows'].long()
+        if len(known) < p.size(0):
+            merged = torch.unique(torch.cat([known, rows]))
+            if len(merged) > len(known):
+                # rows touched for the first time start with zero moments.
+                keep = torch.searchsorted(merged, known)
+                for name in ['exp_avg', 'exp_avg_sq']:
+                    moment = p.new_zeros((len(merged),) + p.shape[1:])
+                    moment[keep] = state[name]
+                    state[name] = moment
+                known = merged
+        state['rows'] = known
+        idx = torch.searchsorted(known, rows) if len(known) < p.size(0) else rows
+        exp_avg = state['exp_avg'][idx].mul_(beta1).add_(values, alpha=1 - beta1)
+        exp_avg_sq = state['exp_avg_sq'][idx].mul_(beta2).addcmul_(values, values, value=1 - beta2)
+        state['exp_avg'].index_copy_(0, idx, exp_avg)
+        state['exp_avg_sq'].index_copy_(0, idx, exp_avg_sq)
+        denom = exp_avg_sq.sqrt_().add_(eps * math.sqrt(1 - beta2 ** state['step']))
+        p.index_add_(0, rows, exp_avg.div_(denom), alpha=-step_size)
+
+def build_optimizer(model, mode, lr, sparse_adam):
+    # one optimizer per training phase, restricted to the parameters its loss touches.
+    tables, params = model.phase_parameters(mode)
+    if sparse_adam:
+        return LazyAdam([{'params': tables, 'lazy': True}, {'params': params}], lr=lr)
+    return torch.optim.Adam(tables + params, lr=lr)
+
+def build_optimizers(args, model):
+    return (build_optimizer(model, "cf", args.lr, args.sparse_adam),
+            build_optimizer(model, "kg", args.kg_lr, args.sparse_adam),
+            build_optimizer(model, "cl", args.cl_lr, args.sparse_adam))
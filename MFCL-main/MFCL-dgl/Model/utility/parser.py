@@ -10,6 +10,12 @@ def parse_args():
                         help='Project path.')
     parser.add_argument('--dataset', nargs='?', default='movie-lens',
                         help='Choose a dataset from {movie-lens, last-fm, amazon-book}')
+    parser.add_argument('--chunk_lines', type=int, default=200000,
+                        help='Lines of kg_final.txt parsed at a time.')
+    parser.add_argument('--dedup_buckets', type=int, default=16,
+                        help='Number of spill files the KG triples are hash-partitioned into for deduplication.')
+    parser.add_argument('--tmp_dir', nargs='?', default='',
+                        help='Directory of the deduplication spill files, empty for the system temporary directory.')
     parser.add_argument('--pretrain', type=int, default=-1,
                         help='0: No pretrain, -1: Pretrain with the learned embeddings, 1:Pretrain with stored models.')
     parser.add_argument('--verbose', type=int, default=1,
@@ -30,6 +36,13 @@ def parse_args():
                         help='KG batch size.')
     parser.add_argument('--batch_size_cl', type=int, default=8192,
                     help='CL batch size.')
+    parser.add_argument('--neg_item_exp', type=float, default=0.,
+                        help='CF negatives drawn with probability ~ (item popularity + 1) ** neg_item_exp from an alias table, 0: uniform.')
+    parser.add_argument('--neg_entity_exp', type=float, default=0.,
+                        help='KG negative tails drawn with probability ~ (entity degree + 1) ** neg_entity_exp from an alias table, 0: uniform.')
+    parser.add_argument('--node_order', nargs='?', default='none',
+                        help='Renumber the users and entities for locality from {none, degree, rcm, community}, see utility/reorder.py; '
+                             'checkpoints only load with the order they were trained with.')
     parser.add_argument('--regs', nargs='?', default='[1e-5,1e-5,1e-2]',
                         help='Regularization for user and item embeddings.')
     parser.add_argument('--lr', type=float, default=0.0001,
@@ -40,6 +53,12 @@ def parse_args():
                         help='Learning rate.')
     parser.add_argument('--drop_rate', type=float, default=0.7,
                         help='CL dropout rate.')
+    parser.add_argument('--aug_prefetch', type=int, default=1,
+                        help='1: Build the next epoch\'s dropout subgraphs on a background thread, 0: build them inline.')
+    parser.add_argument('--aug_pool', type=int, default=0,
+                        help='Number of dropout subgraph views built once and reused round-robin, 0 for a fresh view every epoch.')
+    parser.add_argument('--aug_refresh', nargs='?', default='step',
+                        help='When the DropLearners recompute their edge weights from {step, epoch, N (every N steps), drift:T (when their input moved by more than T, relative L2)}; the steps in between reuse the cached weights.')
     parser.add_argument('--temperature', type=float, default=0.7,
                         help='Softmax temperature.')
     parser.add_argument('--adj_type', nargs='?', default='si',
@@ -56,8 +75,24 @@ def parse_args():
                         help='Output sizes of every layer')
     parser.add_argument('--save_flag', type=int, default=0,
                         help='0: Disable model saver, 1: Activate model saver')
+    parser.add_argument('--model_type', nargs='?', default='mfcl',
+                        help='Name of the weights and output directories.')
+    parser.add_argument('--ckpt_dir', nargs='?', default='',
+                        help='Checkpoint directory, empty for {weights_path}weights/{dataset}/{model_type}/{layers}_{heads}/.')
+    parser.add_argument('--ckpt_every', type=int, default=1,
+                        help='Save the latest checkpoint every ckpt_every epochs, evaluated epochs are always saved.')
+    parser.add_argument('--keep_best', type=int, default=3,
+                        help='Number of best checkpoints (by recall@K[0]) to keep.')
+    parser.add_argument('--resume', type=int, default=0,
+                        help='0: Train from scratch, 1: Resume from the latest checkpoint.')
     parser.add_argument('--test_flag', nargs='?', default='part',
                         help='Specify the test type from {part, full}, indicating whether the reference is done in mini-batch')
+    parser.add_argument('--eval_block', type=int, default=0,
+                        help='Score the items in blocks of eval_block and keep a running top-K per user instead of '
+                             'the full score rows, 0: full rows. The auc is not computed (0) with blocks.')
+    parser.add_argument('--eval_async', type=int, default=0,
+                        help='0: Evaluate in the training loop, N > 0: evaluate snapshots of the parameters on a background '
+                             'thread while training goes on, with at most N evaluations pending.')
     parser.add_argument('--report', type=int, default=0,
                         help='0: Disable performance report w.r.t. sparsity levels, 1: Show performance report w.r.t. sparsity levels')
     parser.add_argument('--use_att', type=bool, default=False,
@@ -71,5 +106,71 @@ def parse_args():
     parser.add_argument('--kg_weight_decay', type=float, default=1e-5)
     parser.add_argument('--alpha', type=float, default=0.)
     parser.add_argument('--cl_alpha', type=float, default=1.)
+    parser.add_argument('--device', nargs='?', default='cuda',
+                        help='Specify the training device from {cuda, cpu}.')
+    parser.add_argument('--amp', nargs='?', default='none',
+                        help='Mixed precision training from {none, fp16, bf16}.')
+    parser.add_argument('--grad_checkpoint', type=int, default=0,
+                        help='0: Keep activations, 1: Recompute every GAT layer during backward to save memory.')
+    parser.add_argument('--history', type=int, default=0,
+                        help='0: Exact full-graph propagation, 1: Propagate only the batch nodes with historical embeddings of their neighbors.')
+    parser.add_argument('--hist_refresh', type=int, default=10,
+                        help='With --history 1, every hist_refresh-th step of a propagation runs on the full graph and refreshes the history.')
+    parser.add_argument('--hist_staleness', type=int, default=0,
+                        help='With --history 1, also refresh when a history row read is older than hist_staleness steps, 0 to disable.')
+    parser.add_argument('--sparse_adam', type=int, default=0,
+                        help='0: Dense Adam, 1: Only update (and keep Adam moments for) the touched rows of the embedding tables.')
+    parser.add_argument('--fused_gat', type=int, default=0,
+                        help='0: Message passing with update_all, 1: Fused SDDMM/SpMM attention in myGATConv.')
+    parser.add_argument('--profile_dir', nargs='?', default='',
+                        help='Write per-epoch phase timings (phases.json/csv) and traces to this directory, empty to disable.')
+    parser.add_argument('--world_size', type=int, default=1,
+                        help='Number of local data-parallel worker processes (gloo backend), 1 to train in this process.')
+    parser.add_argument('--dist_port', type=int, default=29500,
+                        help='Port of the rank 0 worker for --world_size > 1.')
+    parser.add_argument('--partitions', type=int, default=2,
+                        help='Number of KG partitions (and worker processes) of partition_train.py.')
+    parser.add_argument('--part_method', nargs='?', default='metis',
+                        help='Partitioning from {metis, degree}.')
+    parser.add_argument('--part_dir', nargs='?', default='',
+                        help='Partition directory, empty for {data_path}{dataset}/partitions/{part_method}{partitions}/.')
+    parser.add_argument('--kg_state', nargs='?', default='',
+                        help='kg_state.pt of partition_train.py to initialize the KG view (kg_embed, kg_gat_layers, decoder) from, empty to disable.')
+    parser.add_argument('--emb_path', nargs='?', default='',
+                        help='export.py/serve.py: exported embeddings, empty for {proj_path}output/{dataset}/embeddings.npz.')
+    parser.add_argument('--export_ckpt', nargs='?', default='best',
+                        help='export.py: checkpoint to export from {best, latest, none (untrained model)} or a checkpoint file.')
+    parser.add_argument('--export_graph', nargs='?', default='none',
+                        help='export.py: also write the DGL-free inference graph of the propagation {none, torchscript, onnx}.')
+    parser.add_argument('--serve_host', nargs='?', default='127.0.0.1',
+                        help='serve.py: address to listen on.')
+    parser.add_argument('--serve_port', type=int, default=8080,
+                        help='serve.py: port to listen on.')
+    parser.add_argument('--serve_max_batch', type=int, default=256,
+                        help='serve.py: maximum number of requests scored together.')
+    parser.add_argument('--serve_max_wait', type=float, default=2.,
+                        help='serve.py: milliseconds a batch waits for more requests after its first one.')
+    parser.add_argument('--serve_k', type=int, default=20,
+                        help='serve.py: number of items returned when a request does not give k.')
+    parser.add_argument('--cache_size', type=int, default=100000,
+                        help='serve.py: number of top-K results kept in the LRU cache, 0 to disable.')
+    parser.add_argument('--cache_ttl', type=float, default=300.,
+                        help='serve.py: seconds a cached result stays valid.')
+    parser.add_argument('--serve_reload', type=float, default=5.,
+                        help='serve.py: seconds between checks for a new export of the embeddings, 0 to disable.')
+    parser.add_argument('--sweep_grid', nargs='?', default='{"temperature": [0.5, 0.7], "drop_rate": [0.5, 0.7]}',
+                        help='sweep.py: JSON dict from argument name to the list of values to try.')
+    parser.add_argument('--sweep_trials', type=int, default=0,
+                        help='sweep.py: number of configurations sampled from the grid, 0 for the full grid.')
+    parser.add_argument('--sweep_workers', type=int, default=2,
+                        help='sweep.py: number of trials trained concurrently.')
+    parser.add_argument('--sweep_eval_every', type=int, default=10,
+                        help='sweep.py: evaluate every trial every sweep_eval_every epochs.')
+    parser.add_argument('--sweep_patience', type=int, default=10,
+                        help='sweep.py: early_stopping flag_step of every trial, in evaluations.')
+    parser.add_argument('--sweep_prune', type=int, default=1,
+                        help='sweep.py: 1: stop trials whose best recall is below the median of the other trials at the same epoch.')
+    parser.add_argument('--profile_steps', nargs='?', default='[]',
+                        help='Indices of the training steps to record a torch.profiler trace for.')
 
     return parser.parse_args()
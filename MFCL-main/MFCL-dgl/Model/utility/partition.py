@@ -0,0 +1,236 @@
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+from utility.reader import file_signature
+
+# Partitioned graphs for model-parallel propagation. Every rank owns the nodes of one part
+# ("inner" nodes) with their embedding rows and in-edges; the sources of those edges owned by
+# other ranks are its "halo" nodes, whose features are exchanged before every GAT layer.
+#
+# <part_dir>/meta.npz      owner and local index of every node, number of parts, extra **meta
+#                          (partition_train.py stores the signature of the data it was built from)
+# <part_dir>/part<p>.npz   inner/halo node ids, in-edges of the inner nodes in local ids,
+#                          the (relation, tail) lists of the inner heads for the KG sampler
+
+def data_signature(args):
+    # the data files (name, size, mtime) and --node_order, which fix the entity ids of the
+    # partitions and of the kg_state.pt trained on them.
+    path = args.data_path + args.dataset
+    return '%s;order=%s' % (file_signature([os.path.join(path, f) for f in ['train.txt', 'test.txt', 'kg_final.txt']]),
+                            args.node_order)
+
+def assign(g, n_parts, method='metis'):
+    # part of every node. metis minimizes the edge cut (halo size), degree balances the
+    # number of edges per part without looking at locality.
+    if method == 'metis':
+        import dgl
+        try:
+            sym = dgl.to_simple(dgl.to_bidirected(dgl.remove_self_loop(g).cpu()))
+            return dgl.metis_partition_assignment(sym, n_parts).numpy()
+        except Exception as e:
+            print('metis partitioning failed (%s), fall back to degree-balanced parts.' % e)
+    deg = g.in_degrees().cpu().numpy() + 1
+    assignment = np.zeros(len(deg), dtype=np.int64)
+    load = np.zeros(n_parts)
+    # longest-processing-time first: the next highest degree node goes to the lightest part.
+    for v in np.argsort(-deg, kind='stable'):
+        p = np.argmin(load)
+        assignment[v] = p
+        load[p] += deg[v]
+    return assignment
+
+def write_partitions(g, assignment, out_dir, n_parts, kg_dict=None, **meta):
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    n_nodes = g.num_nodes()
+    owner = assignment.astype(np.int32)
+    local_index = np.zeros(n_nodes, dtype=np.int64)
+    for p in range(n_parts):
+        inner = np.nonzero(owner == p)[0]
+        local_index[inner] = np.arange(len(inner))
+    np.savez(os.path.join(out_dir, 'meta.npz'), owner=owner, local_index=local_index, n_parts=n_parts, **meta)
+    src, dst = [t.cpu().numpy() for t in g.edges()]
+    order = np.argsort(owner[dst], kind='stable')
+    bounds = np.searchsorted(owner[dst][order], np.arange(n_parts + 1))
+    for p in range(n_parts):
+        inner = np.nonzero(owner == p)[0]
+        e = order[bounds[p]: bounds[p + 1]]
+        e_src, e_dst = src[e], dst[e]
+        halo = np.unique(e_src[owner[e_src] != p])
+        # local ids: inner nodes first, then the halo nodes.
+        local_src = np.where(owner[e_src] == p, local_index[e_src], len(inner) + np.searchsorted(halo, e_src))
+        part = {'inner': inner, 'halo': halo, 'src': local_src, 'dst': local_index[e_dst], 'eid': e}
+        if kg_dict is not None:
+            heads = [h for h in inner if h in kg_dict]
+            indptr = np.zeros(len(heads) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(kg_dict[h]) for h in heads])
+            pairs = np.array([rt for h in heads for rt in kg_dict[h]], dtype=np.int64).reshape(-1, 2)
+            part.update({'heads': local_index[np.array(heads, dtype=np.int64)], 'indptr': indptr,
+                         'tails': pairs[:, 0], 'relations': pairs[:, 1]})
+        np.savez(os.path.join(out_dir, 'part%d.npz' % p), **part)
+        print('part %d: %d inner nodes, %d halo nodes, %d edges' % (p, len(inner), len(halo), len(e)))
+
+def partitions_exist(out_dir, n_parts, signature=None):
+    # whether out_dir holds n_parts parts written with the same signature.
+    if not all(os.path.exists(os.path.join(out_dir, name))
+               for name in ['meta.npz'] + ['part%d.npz' % p for p in range(n_parts)]):
+        return False
+    meta = np.load(os.path.join(out_dir, 'meta.npz'))
+    if int(meta['n_parts']) != n_parts:
+        return False
+    return signature is None or ('signature' in meta.files and str(meta['signature']) == signature)
+
+class Partition(object):
+    # the part of one rank, loaded without reading the other parts.
+    def __init__(self, out_dir, part_id):
+        meta = dict(np.load(os.path.join(out_dir, 'meta.npz')))
+        self.meta = meta
+        self.n_parts = int(meta['n_parts'])
+        self.owner = torch.from_numpy(meta['owner'].astype(np.int64))
+        self.local_index = torch.from_numpy(meta['local_index'])
+        self.n_nodes = len(self.owner)
+        part = dict(np.load(os.path.join(out_dir, 'part%d.npz' % part_id)))
+        self.part_id = part_id
+        self.inner = part['inner']
+        self.halo = part['halo']
+        self.n_inner, self.n_halo = len(self.inner), len(self.halo)
+        self.src, self.dst, self.eid = part['src'], part['dst'], part['eid']
+        self.heads = part.get('heads')
+        self.indptr = part.get('indptr')
+        self.tails = part.get('tails')
+        self.relations = part.get('relations')
+        if self.heads is not None and len(self.heads) == 0:
+            raise ValueError('partition %d owns no KG heads, use fewer partitions.' % part_id)
+        if self.heads is not None:
+            # keys of the local triples, to reject sampled negatives that are positives.
+            h = np.repeat(np.arange(len(self.heads)), np.diff(self.indptr))
+            self.keys = np.sort((h * self.n_nodes + self.tails) * (self.relations.max() + 1) + self.relations)
+            self.n_rel_keys = self.relations.max() + 1
+
+    def block(self, device):
+        # in-edges of the inner nodes, sources are the inner nodes followed by the halo nodes.
+        import dgl
+        block = dgl.create_block((torch.from_numpy(self.src), torch.from_numpy(self.dst)),
+                                 num_src_nodes=self.n_inner + self.n_halo, num_dst_nodes=self.n_inner)
+        return block.to(device)
+
+    def sample_kg_batch(self, batch_size):
+        # heads (local ids), relations, positive and negative tails (global ids), like
+        # KGAT_loader._generate_train_kg_batch restricted to the inner heads.
+        idx = np.random.randint(0, len(self.heads), batch_size)
+        pick = self.indptr[idx] + (np.random.rand(batch_size) * np.diff(self.indptr)[idx]).astype(np.int64)
+        r, pos_t = self.relations[pick], self.tails[pick]
+        neg_t = np.random.randint(0, self.n_nodes, batch_size)
+        while True:
+            keys = (idx * self.n_nodes + neg_t) * self.n_rel_keys + r
+            pos = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+            clash = self.keys[pos] == keys
+            if not clash.any():
+                break
+            neg_t[clash] = np.random.randint(0, self.n_nodes, clash.sum())
+        return self.heads[idx], r, pos_t, neg_t
+
+class ExchangePlan(object):
+    # which inner rows this rank sends to every peer (send_idx) and where the rows it
+    # receives from every peer go in the requested list (recv_pos).
+    def __init__(self, send_idx, recv_pos, n_out):
+        self.send_idx = send_idx
+        self.recv_pos = recv_pos
+        self.n_out = n_out
+
+def fetch_plan(part, global_ids, device):
+    # collective: every rank asks the owners for the rows of its global_ids.
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    global_ids = torch.as_tensor(global_ids, dtype=torch.long)
+    own = part.owner[global_ids]
+    loc = part.local_index[global_ids]
+    recv_pos = [torch.nonzero(own == q).flatten() for q in range(world_size)]
+    requests = [loc[pos] for pos in recv_pos]
+    counts = torch.tensor([len(r) for r in requests])
+    all_counts = [torch.zeros_like(counts) for _ in range(world_size)]
+    dist.all_gather(all_counts, counts)
+    send_idx = [None] * world_size
+    send_idx[rank] = requests[rank]
+    reqs = []
+    for q in range(world_size):
+        if q == rank:
+            continue
+        reqs.append(dist.isend(requests[q], q))
+        send_idx[q] = torch.empty(int(all_counts[q][rank]), dtype=torch.long)
+        reqs.append(dist.irecv(send_idx[q], q))
+    for req in reqs:
+        req.wait()
+    return ExchangePlan([s.to(device) for s in send_idx], [p.to(device) for p in recv_pos], len(global_ids))
+
+def _send_recv(rank, world_size, send, recv_shapes):
+    # send[q] goes to peer q, returns the float32 tensors received from every peer.
+    reqs, recv = [], [None] * world_size
+    for q in range(world_size):
+        if q == rank:
+            continue
+        # gloo sends float32 cpu tensors.
+        send[q] = send[q].float().cpu().contiguous()
+        reqs.append(dist.isend(send[q], q))
+        recv[q] = torch.empty(recv_shapes[q], dtype=torch.float)
+        reqs.append(dist.irecv(recv[q], q))
+    for req in reqs:
+        req.wait()
+    return recv
+
+class Exchange(torch.autograd.Function):
+    # rows of the distributed (n_inner, ...) tables in plan order; the backward sends the
+    # gradients of the received rows back to their owners.
+    @staticmethod
+    def forward(ctx, h, plan):
+        ctx.plan, ctx.n_inner = plan, h.shape[0]
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        rest = tuple(h.shape[1:])
+        out = h.new_empty((plan.n_out,) + rest)
+        send = [h[idx] for idx in plan.send_idx]
+        recv = _send_recv(rank, world_size, send, [(len(pos),) + rest for pos in plan.recv_pos])
+        out[plan.recv_pos[rank]] = send[rank]
+        for q in range(world_size):
+            if q != rank:
+                out[plan.recv_pos[q]] = recv[q].to(h.device, h.dtype)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        plan = ctx.plan
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        rest = tuple(grad_out.shape[1:])
+        send = [grad_out[pos] for pos in plan.recv_pos]
+        recv = _send_recv(rank, world_size, send, [(len(idx),) + rest for idx in plan.send_idx])
+        grad_h = grad_out.new_zeros((ctx.n_inner,) + rest)
+        grad_h.index_add_(0, plan.send_idx[rank], send[rank])
+        for q in range(world_size):
+            if q != rank:
+                grad_h.index_add_(0, plan.send_idx[q], recv[q].to(grad_out.device, grad_out.dtype))
+        return grad_h, None
+
+def exchange(h, plan):
+    return Exchange.apply(h, plan)
+
+def gather_rows(part, h, dst=0):
+    # the full (n_nodes, ...) table on rank dst, None on the other ranks.
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    h = h.detach().float().cpu().contiguous()
+    inner = torch.from_numpy(part.inner)
+    sizes = [torch.zeros(1, dtype=torch.long) for _ in range(world_size)]
+    dist.all_gather(sizes, torch.tensor([len(inner)]))
+    if rank != dst:
+        dist.send(inner, dst)
+        dist.send(h, dst)
+        return None
+    full = h.new_zeros((part.n_nodes,) + tuple(h.shape[1:]))
+    full[inner] = h
+    for q in range(world_size):
+        if q == dst:
+            continue
+        ids = torch.empty(int(sizes[q]), dtype=torch.long)
+        rows = h.new_empty((int(sizes[q]),) + tuple(h.shape[1:]))
+        dist.recv(ids, q)
+        dist.recv(rows, q)
+        full[ids] = rows
+    return full
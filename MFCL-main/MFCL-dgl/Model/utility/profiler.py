@@ -0,0 +1,112 @@
+import contextlib
+import csv
+import json
+import os
+import resource
+from time import time
+import torch
+
+class PhaseTimer(object):
+    # Wall time, device time and peak memory of the named phases of every epoch. The device
+    # time is only measured on cuda, it is None (empty in the csv) on cpu.
+    # Disabled by default, phase() is then a no-op context.
+    def __init__(self):
+        self.enabled = False
+        self.out_dir = None
+        self.device = torch.device('cpu')
+        self.trace_steps = set()
+        self.n_steps = 0
+        self.depth = 0
+        self.records = {}
+        self.history = []
+
+    def configure(self, out_dir, trace_steps, device):
+        self.enabled = True
+        self.out_dir = out_dir
+        self.trace_steps = set(trace_steps)
+        self.device = device
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._phase(name)
+
+    def trace(self):
+        # torch.profiler trace of the current training step when its index is in --profile_steps.
+        if not self.enabled:
+            return contextlib.nullcontext()
+        self.n_steps += 1
+        if self.n_steps - 1 not in self.trace_steps:
+            return contextlib.nullcontext()
+        return self._trace(self.n_steps - 1)
+
+    def _sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    def _peak_memory(self):
+        if self.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated() / 2 ** 20
+        # process high-water mark, it can not be reset per phase on cpu.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        if self.device.type == 'cuda':
+            if self.depth == 0:
+                # nested phases share the peak of their outermost phase.
+                torch.cuda.reset_peak_memory_stats()
+            start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            start.record()
+        self._sync()
+        self.depth += 1
+        t1 = time()
+        try:
+            yield
+        finally:
+            self._sync()
+            wall = time() - t1
+            self.depth -= 1
+            device_ms = None
+            if self.device.type == 'cuda':
+                end.record()
+                end.synchronize()
+                device_ms = start.elapsed_time(end)
+            rec = self.records.setdefault(name, {'count': 0, 'wall_s': 0., 'device_ms': None, 'peak_mb': 0.})
+            rec['count'] += 1
+            rec['wall_s'] += wall
+            if device_ms is not None:
+                rec['device_ms'] = (rec['device_ms'] or 0.) + device_ms
+            rec['peak_mb'] = max(rec['peak_mb'], self._peak_memory())
+
+    @contextlib.contextmanager
+    def _trace(self, step_id):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+            yield
+        prof.export_chrome_trace(os.path.join(self.out_dir, 'trace_step%d.json' % step_id))
+
+    def end_epoch(self, epoch):
+        if not self.enabled:
+            return
+        summary = {'epoch': epoch, 'phases': self.records}
+        self.history.append(summary)
+        self.records = {}
+        with open(os.path.join(self.out_dir, 'phases.json'), 'w') as f:
+            json.dump(self.history, f, indent=1)
+        with open(os.path.join(self.out_dir, 'phases.csv'), 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['epoch', 'phase', 'count', 'wall_s', 'device_ms', 'peak_mb'])
+            for s in self.history:
+                for name, rec in s['phases'].items():
+                    writer.writerow([s['epoch'], name, rec['count'], '%.4f' % rec['wall_s'],
+                                     '' if rec['device_ms'] is None else '%.2f' % rec['device_ms'],
+                                     '%.1f' % rec['peak_mb']])
+        print('Epoch %d phases: %s' % (epoch, ', '.join(
+            '%s=%.1fs' % (name, rec['wall_s']) for name, rec in summary['phases'].items())))
+
+phase_timer = PhaseTimer()
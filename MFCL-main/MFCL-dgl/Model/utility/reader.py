@@ -0,0 +1,114 @@
+import gzip
+import io
+import itertools
+import math
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+
+# Chunked readers for the dataset files. A file "x.txt" may also be given as "x.txt.zip"
+# (as amazon-book ships kg_final.txt) or "x.txt.gz" and is then read from the archive
+# without unpacking it to disk.
+
+def resolve(path):
+    for p in [path, path + '.zip', path + '.gz']:
+        if os.path.exists(p):
+            return p
+    raise FileNotFoundError('%s (nor .zip/.gz)' % path)
+
+def file_signature(files):
+    # name, size and mtime of the files that exist (also as .zip/.gz), to tell when data
+    # derived from them is stale.
+    sig = []
+    for f in files:
+        try:
+            p = resolve(f)
+        except FileNotFoundError:
+            continue
+        st = os.stat(p)
+        sig.append('%s:%d:%d' % (os.path.basename(p), st.st_size, int(st.st_mtime)))
+    return ';'.join(sig)
+
+def open_text(path):
+    path = resolve(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    if path.endswith('.zip'):
+        archive = zipfile.ZipFile(path)
+        members = [m for m in archive.namelist() if not m.endswith('/')]
+        # the member named like the archive, or the only file in it.
+        name = os.path.basename(path)[:-len('.zip')]
+        member = next((m for m in members if os.path.basename(m) == name), members[0])
+        return io.TextIOWrapper(archive.open(member), encoding='utf-8')
+    return open(path, 'r')
+
+def iter_lines(path):
+    with open_text(path) as f:
+        for line in f:
+            yield line
+
+def iter_int_chunks(path, width, chunk_lines, dtype=np.int32):
+    # (n, width) arrays of the integers of at most chunk_lines lines each.
+    with open_text(path) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                return
+            yield np.loadtxt(lines, dtype=dtype, ndmin=2).reshape(-1, width)
+
+def unique_rows(path, width, chunk_lines=200000, n_buckets=16, tmp_dir=None, dtype=np.int32):
+    # np.unique(np.loadtxt(path), axis=0) without holding the text or more than one
+    # bucket of parsed rows at a time: rows are hash-partitioned by their first column into
+    # n_buckets spill files, every bucket is deduplicated on its own and the unique rows are
+    # sorted into the same lexicographic order np.unique returns.
+    chunks = iter_int_chunks(path, width, chunk_lines, dtype)
+    first = next(chunks, np.zeros((0, width), dtype=dtype))
+    second = next(chunks, None)
+    if second is None:
+        return np.unique(first, axis=0)
+    spill_dir = tempfile.mkdtemp(prefix='mfcl_unique_', dir=tmp_dir or None)
+    try:
+        radix = np.zeros(width, dtype=np.int64)
+        files = [open(os.path.join(spill_dir, '%d.bin' % b), 'wb') for b in range(n_buckets)]
+        for chunk in itertools.chain([first, second], chunks):
+            radix = np.maximum(radix, chunk.max(0).astype(np.int64) + 1)
+            bucket = chunk[:, 0].astype(np.int64) % n_buckets
+            order = np.argsort(bucket, kind='stable')
+            bounds = np.searchsorted(bucket[order], np.arange(n_buckets + 1))
+            for b in range(n_buckets):
+                chunk[order[bounds[b]: bounds[b + 1]]].tofile(files[b])
+        for f in files:
+            f.close()
+        del first, second, chunk
+        # rows packed into one int64 key sort like the rows, so the buckets are deduplicated
+        # and merged as flat keys when the value ranges allow it.
+        packed = math.prod(int(r) for r in radix) < 2 ** 63
+        parts = []
+        for b in range(n_buckets):
+            rows = np.fromfile(os.path.join(spill_dir, '%d.bin' % b), dtype=dtype).reshape(-1, width)
+            os.remove(os.path.join(spill_dir, '%d.bin' % b))
+            if packed:
+                key = np.zeros(len(rows), dtype=np.int64)
+                for c in range(width):
+                    key *= radix[c]
+                    key += rows[:, c]
+                parts.append(np.unique(key))
+            else:
+                parts.append(np.unique(rows, axis=0))
+            del rows
+        if not packed:
+            rows = np.concatenate(parts)
+            del parts
+            return rows[np.lexsort(rows.T[::-1])]
+        key = np.concatenate(parts)
+        del parts
+        key.sort()
+        rows = np.empty((len(key), width), dtype=dtype)
+        for c in reversed(range(width)):
+            rows[:, c] = key % radix[c]
+            key //= radix[c]
+        return rows
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
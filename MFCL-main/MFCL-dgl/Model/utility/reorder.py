@@ -0,0 +1,63 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+# Renumbering of the users and entities so that the neighbors of a node, and the nodes of a
+# batch, sit close together in the embedding tables and the DGL graphs. The order is computed
+# on the joint graph (users + entities, CF and KG edges, undirected) and split back into the
+# id ranges the model relies on: users stay 0..n_users-1, items stay the first n_items
+# entities (the CF node of item i is n_users + i), the other entities follow.
+#   degree:    highest degree first, the hubs share cache lines.
+#   rcm:       reverse Cuthill-McKee, neighbors get close ids (small bandwidth).
+#   community: METIS parts of about block nodes one after another, rcm inside a part;
+#              falls back to rcm when DGL has no METIS.
+# An order maps the new ids to the old ones, its rank (inverse) the old ids to the new ones.
+
+METHODS = ['none', 'degree', 'rcm', 'community']
+
+def joint_graph(n_users, n_entities, cf_pairs, kg_pairs):
+    # symmetric adjacency of users (0..n_users-1) and entities (n_users + e).
+    rows = np.concatenate([cf_pairs[:, 0], n_users + kg_pairs[:, 0]])
+    cols = np.concatenate([n_users + cf_pairs[:, 1], n_users + kg_pairs[:, 1]])
+    n = n_users + n_entities
+    adj = sp.coo_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n, n)).tocsr()
+    adj = adj + adj.T
+    adj.data[:] = 1.
+    return adj
+
+def community_order(adj, block=1024):
+    import dgl
+    import torch
+    n_parts = max(2, adj.shape[0] // block)
+    try:
+        coo = sp.triu(adj, k=1).tocoo()
+        g = dgl.to_bidirected(dgl.graph((torch.from_numpy(coo.row.astype(np.int64)), torch.from_numpy(coo.col.astype(np.int64))),
+                                        num_nodes=adj.shape[0]))
+        part = dgl.metis_partition_assignment(g, n_parts).numpy()
+    except Exception as e:
+        print('metis partitioning failed (%s), fall back to the rcm order.' % e)
+        return rcm_order(adj)
+    return np.lexsort((rank(rcm_order(adj)), part))
+
+def rcm_order(adj):
+    return reverse_cuthill_mckee(adj, symmetric_mode=True).astype(np.int64)
+
+def rank(order):
+    r = np.empty(len(order), dtype=np.int64)
+    r[order] = np.arange(len(order))
+    return r
+
+def node_order(method, n_users, n_items, n_entities, cf_pairs, kg_pairs):
+    # (user_order, entity_order): new -> old ids of the users and of the entities.
+    adj = joint_graph(n_users, n_entities, cf_pairs, kg_pairs)
+    if method == 'degree':
+        order = np.argsort(-np.diff(adj.indptr), kind='stable')
+    elif method == 'rcm':
+        order = rcm_order(adj)
+    elif method == 'community':
+        order = community_order(adj)
+    else:
+        raise ValueError('unknown node order %s, expected one of %s.' % (method, METHODS))
+    users = order[order < n_users]
+    entities = order[order >= n_users] - n_users
+    return users, np.concatenate([entities[entities < n_items], entities[entities >= n_items]])
@@ -0,0 +1,45 @@
+import numpy as np
+
+class UniformSampler(object):
+    # ids 0..n-1 with equal probability.
+    def __init__(self, n):
+        self.n = n
+
+    def draw(self, size):
+        return np.random.randint(0, self.n, size)
+
+class AliasTable(object):
+    # Walker's alias method: ids 0..n-1 drawn with probability proportional to weights, O(n)
+    # to build and O(1) per draw. Every slot i keeps id i with probability prob[i] and gives
+    # the rest of its 1/n mass to alias[i].
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) == 0 or weights.min() < 0 or weights.sum() <= 0:
+            raise ValueError('alias table needs non-negative weights with a positive sum.')
+        self.n = len(weights)
+        scaled = weights * (self.n / weights.sum())
+        self.prob = np.ones(self.n)
+        self.alias = np.arange(self.n)
+        small = list(np.nonzero(scaled < 1.)[0])
+        large = list(np.nonzero(scaled >= 1.)[0])
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1. - scaled[s]
+            if scaled[l] < 1.:
+                small.append(l)
+            else:
+                large.append(l)
+        # the leftovers are 1 up to rounding, they keep their own slot.
+
+    def draw(self, size):
+        slot = np.random.randint(0, self.n, size)
+        return np.where(np.random.rand(len(slot)) < self.prob[slot], slot, self.alias[slot])
+
+def degree_sampler(degree, exponent):
+    # negatives proportional to (degree + 1) ** exponent, exponent 0 is uniform; the +1 keeps
+    # the ids without training edges in the pool.
+    if exponent == 0:
+        return UniformSampler(len(degree))
+    return AliasTable((np.asarray(degree, dtype=np.float64) + 1.) ** exponent)
@@ -0,0 +1,400 @@
+import asyncio
+import collections
+import json
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import torch
+from utility.interactions import CSR
+
+# Top-K serving of exported user/item embeddings (see export.py and serve.py): the scorer,
+# the micro-batcher coalescing concurrent requests and a minimal asyncio HTTP/1.1 front end.
+
+def emb_path(args):
+    return args.emb_path or '%soutput/%s/embeddings.npz' % (args.proj_path, args.dataset)
+
+def save_embeddings(path, user, item, seen, **meta):
+    # user/item: the rows of model("test") the Evaluator scores with, seen: the CSR of the
+    # training interactions (users x items). Every export gets a new version, which keys the
+    # cached results of a server; the file is replaced atomically so a running server never
+    # reloads a half-written one.
+    meta.setdefault('version', '%x' % time.time_ns())
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, user=user, item=item, seen_indptr=seen.indptr, seen_indices=seen.indices, **meta)
+    os.replace(tmp, path)
+
+def load_embeddings(path):
+    f = np.load(path)
+    meta = {k: f[k].item() for k in f.files if k not in ['user', 'item', 'seen_indptr', 'seen_indices']}
+    meta.setdefault('version', '%x' % os.stat(path).st_mtime_ns)
+    seen = CSR(f['seen_indptr'], f['seen_indices'], len(f['item']))
+    return f['user'], f['item'], seen, meta
+
+def load_topk(path):
+    user, item, seen, meta = load_embeddings(path)
+    return TopK(user, item, seen, meta['version'])
+
+class TopK(object):
+    # top-K items of a batch of users by inner product, by default without the items the user
+    # interacted with in training or added through update_user.
+    def __init__(self, user, item, seen, version=''):
+        self.user = torch.from_numpy(np.ascontiguousarray(user, dtype=np.float32))
+        self.item_t = torch.from_numpy(np.ascontiguousarray(item, dtype=np.float32).T.copy())
+        self.seen = seen
+        self.extra_seen = {}
+        self.version = version
+        self.n_users, self.n_items = len(user), len(item)
+
+    def __call__(self, users, k, exclude=None):
+        # exclude[i]: whether the seen items of users[i] are filtered out.
+        users = np.asarray(users, dtype=np.int64)
+        exclude = np.ones(len(users), dtype=bool) if exclude is None else np.asarray(exclude, dtype=bool)
+        with torch.no_grad():
+            scores = torch.mm(self.user[users], self.item_t)
+            rows = np.nonzero(exclude & (users < self.seen.n_rows))[0]
+            pos, cols = self.seen.gather(users[rows])
+            scores[torch.from_numpy(rows[pos]), torch.from_numpy(cols.astype(np.int64))] = -np.inf
+            for i in np.nonzero(exclude)[0]:
+                if users[i] in self.extra_seen:
+                    scores[i, torch.from_numpy(self.extra_seen[users[i]])] = -np.inf
+            top, items = torch.topk(scores, min(k, self.n_items), dim=1)
+        return items.numpy(), top.numpy()
+
+    def update_user(self, user, embedding=None, items=None):
+        # fold-in of one user: a new embedding row and/or items to exclude from now on.
+        if embedding is not None:
+            self.user[user] = torch.as_tensor(embedding, dtype=self.user.dtype)
+        if items is not None and len(items) > 0:
+            self.extra_seen[user] = np.union1d(self.extra_seen.get(user, np.zeros(0, dtype=np.int64)),
+                                               np.asarray(items, dtype=np.int64))
+
+class ResultCache(object):
+    # LRU cache of top-K results keyed by (model version, user, k, filter flags). At most
+    # max_size results are kept, the least recently used are evicted first and a result
+    # expires ttl seconds after it was computed. max_size 0 disables the cache.
+    def __init__(self, max_size=100000, ttl=300.):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.by_user = collections.defaultdict(set)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits, self.misses = 0, 0
+        self.evictions, self.expirations, self.invalidations = 0, 0, 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        self.by_user[key[1]].add(key)
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate_user(self, user):
+        keys = self.by_user.pop(user, ())
+        for key in keys:
+            del self.entries[key]
+        self.invalidations += len(keys)
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.by_user.clear()
+
+    def _remove(self, key):
+        del self.entries[key]
+        keys = self.by_user[key[1]]
+        keys.discard(key)
+        if not keys:
+            del self.by_user[key[1]]
+
+    def summary(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / max(self.hits + self.misses, 1), 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations}
+
+class LatencyStats(object):
+    # latencies (ms) and batch sizes of the last `window` requests/batches.
+    def __init__(self, window=100000):
+        self.latency = collections.deque(maxlen=window)
+        self.batch = collections.deque(maxlen=window)
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def add(self, latency_ms):
+        self.latency.append(latency_ms)
+        self.count += 1
+
+    def summary(self):
+        lat = np.array(self.latency) if self.latency else np.zeros(1)
+        p50, p90, p99, p999 = np.percentile(lat, [50, 90, 99, 99.9])
+        return {'count': self.count, 'qps': self.count / max(time.perf_counter() - self.start, 1e-9),
+                'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'p999_ms': p999, 'max_ms': float(lat.max()),
+                'mean_batch': float(np.mean(self.batch)) if self.batch else 0.}
+
+    def reset(self):
+        self.latency.clear()
+        self.batch.clear()
+        self.count = 0
+        self.start = time.perf_counter()
+
+class MicroBatcher(object):
+    # Coalesces concurrent submit(user, k) calls into batches of at most max_batch users: a
+    # batch is closed max_wait seconds after its first request or when it is full, and scored
+    # with one matrix multiply and top-K on a worker thread while the next batch fills.
+    def __init__(self, topk, max_batch=256, max_wait=0.002, stats=None):
+        self.topk = topk
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats or LatencyStats()
+        self.queue = None
+        self.task = None
+        self.busy = False
+        self.pending = []
+
+    def between_batches(self, fn):
+        # runs fn, which changes the scorer, now if no batch is being scored on the worker
+        # thread and otherwise as soon as that batch is done, before the next one.
+        if self.busy:
+            self.pending.append(fn)
+        else:
+            fn()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, user, k, exclude=True):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((user, k, exclude, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            users = [b[0] for b in batch]
+            k = max(b[1] for b in batch)
+            self.busy = True
+            try:
+                items, scores = await loop.run_in_executor(None, self.topk, users, k, [b[2] for b in batch])
+            except Exception as e:
+                for _, _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.busy = False
+                for fn in self.pending:
+                    fn()
+                self.pending = []
+            now = time.perf_counter()
+            self.stats.batch.append(len(batch))
+            for i, (_, k_i, _, future, t0) in enumerate(batch):
+                if future.done():
+                    continue
+                self.stats.add(1000. * (now - t0))
+                # a user with fewer than k unseen items gets fewer.
+                k_i = min(k_i, int(np.isfinite(scores[i]).sum()))
+                future.set_result((items[i, :k_i].tolist(), scores[i, :k_i].tolist()))
+
+class Server(object):
+    # HTTP/1.1 with keep-alive on asyncio streams, no framework needed:
+    #   GET  /recommend?user=U&k=K[&exclude_seen=0]  {"user": U, "items": [...], "scores": [...]}
+    #   POST /recommend {"users": [...], "k": K}    {"results": [{"user": ..., "items": ..., "scores": ...}]}
+    #   POST /fold_in {"user": U, "embedding": [...], "items": [...]}
+    #                                                replace the embedding of U and/or exclude more items
+    #   POST /reload                                 load the embeddings file if it changed
+    #   GET  /stats                                  latency percentiles, throughput, batch size, cache
+    #   POST /stats/reset
+    #   GET  /health
+    # Results are cached under the version of the loaded embeddings. The embeddings file is
+    # checked every reload_every seconds and reloaded when export.py replaced it, which drops
+    # the cache; a fold-in drops the cached results of its user and bumps its generation, so a
+    # result that was being computed during the fold-in is not cached. The fold-in is applied
+    # to the scorer between batches.
+    def __init__(self, batcher, default_k=20, max_k=1000, cache=None, path=None, reload_every=0.):
+        self.batcher = batcher
+        self.default_k = default_k
+        self.max_k = max_k
+        self.cache = cache or ResultCache(0)
+        self.path = path
+        self.reload_every = reload_every
+        self.loaded = self._file_state()
+        self.generation = collections.Counter()
+
+    async def serve(self, host, port, ready=None):
+        self.batcher.start()
+        if self.path is not None and self.reload_every > 0:
+            asyncio.get_running_loop().create_task(self._watch())
+        server = await asyncio.start_server(self._connection, host, port)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    async def recommend(self, user, k, exclude=True):
+        key = (self.batcher.topk.version, user, k, exclude)
+        result = self.cache.get(key)
+        if result is None:
+            generation = self.generation[user]
+            result = await self.batcher.submit(user, k, exclude)
+            if self.generation[user] == generation and self.batcher.topk.version == key[0]:
+                self.cache.put(key, result)
+        items, scores = result
+        return {'user': user, 'items': items, 'scores': scores}
+
+    def fold_in(self, user, embedding=None, items=None):
+        topk = self.batcher.topk
+        self.batcher.between_batches(lambda: topk.update_user(user, embedding, items))
+        self.generation[user] += 1
+        self.cache.invalidate_user(user)
+
+    async def reload(self):
+        # returns whether a new version was loaded.
+        state = self._file_state()
+        if state == self.loaded:
+            return False
+        topk = await asyncio.get_running_loop().run_in_executor(None, load_topk, self.path)
+        self.batcher.topk, self.loaded = topk, state
+        self.cache.clear()
+        return True
+
+    def _file_state(self):
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_every)
+            try:
+                if await self.reload():
+                    print('reloaded %s, version %s' % (self.path, self.batcher.topk.version), flush=True)
+            except Exception as e:
+                print('reloading %s failed: %s' % (self.path, e), flush=True)
+
+    def _parse_user(self, user, k):
+        user, k = int(user), int(k)
+        if not 0 <= user < self.batcher.topk.n_users:
+            raise KeyError('unknown user %d' % user)
+        if not 0 < k <= self.max_k:
+            raise ValueError('k must be in [1, %d]' % self.max_k)
+        return user, k
+
+    async def _handle(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'version': self.batcher.topk.version}
+        if url.path == '/stats':
+            return 200, dict(self.batcher.stats.summary(), cache=self.cache.summary())
+        if method == 'POST' and url.path == '/stats/reset':
+            self.batcher.stats.reset()
+            self.cache.reset_stats()
+            return 200, {'status': 'ok'}
+        if method == 'POST' and url.path == '/reload':
+            return 200, {'reloaded': await self.reload(), 'version': self.batcher.topk.version}
+        if method == 'POST' and url.path == '/fold_in':
+            request = json.loads(body or b'{}')
+            user, _ = self._parse_user(request['user'], 1)
+            embedding, items = request.get('embedding'), request.get('items')
+            if embedding is not None:
+                embedding = np.asarray(embedding, dtype=np.float32)
+                if embedding.shape != (self.batcher.topk.user.shape[1],):
+                    raise ValueError('the embedding must have %d values' % self.batcher.topk.user.shape[1])
+            if items is not None:
+                items = np.asarray(items, dtype=np.int64)
+                if items.ndim != 1 or (len(items) > 0 and not (0 <= items.min() and items.max() < self.batcher.topk.n_items)):
+                    raise ValueError('items must be in [0, %d)' % self.batcher.topk.n_items)
+            self.fold_in(user, embedding, items)
+            return 200, {'status': 'ok'}
+        if url.path != '/recommend':
+            return 404, {'error': 'not found: %s' % url.path}
+        if method == 'GET':
+            query = parse_qs(url.query)
+            user, k = self._parse_user(query['user'][0], query.get('k', [self.default_k])[0])
+            return 200, await self.recommend(user, k, query.get('exclude_seen', ['1'])[0] != '0')
+        request = json.loads(body or b'{}')
+        k = request.get('k', self.default_k)
+        exclude = bool(request.get('exclude_seen', True))
+        users = [self._parse_user(u, k) for u in request.get('users', [request.get('user')])]
+        results = await asyncio.gather(*[self.recommend(u, k, exclude) for u, k in users])
+        return 200, {'results': list(results)}
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = h.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    status, payload = await self._handle(method, target, body)
+                except KeyError as e:
+                    status, payload = 404, {'error': str(e.args[0]) if e.args else 'missing parameter'}
+                except (ValueError, TypeError) as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': '%s: %s' % (type(e).__name__, e)}
+                data = json.dumps(payload).encode()
+                close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n' % (
+                    status, {200: b'OK', 400: b'Bad Request', 404: b'Not Found', 500: b'Internal Server Error'}[status], len(data),
+                    b'Connection: close\r\n' if close else b''))
+                writer.write(data)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+from utility.reader import file_signature
+
+# Dataset statistics on the CSR interaction stores: degree histograms, relation frequencies
+# and the sparsity split of the test users used by --report. They are cached in
+# <dataset>/stats.npz next to the data files and recomputed when one of them changes.
+
+def degree_histogram(degree):
+    # number of rows with degree 0, 1, 2, ...
+    return np.bincount(degree)
+
+def relation_frequency(relations, n_relations=None):
+    return np.bincount(relations, minlength=n_relations or 0)
+
+def sparsity_split(train_store, test_store, fold=4):
+    # the test users grouped by their number of interactions (train + test) into buckets of
+    # about 1/fold of the interactions each, sparsest first; users with the same number of
+    # interactions always share a bucket. returns the user id arrays and their descriptions.
+    # These are the buckets of the former create_sparsity_split loop, except that the loop
+    # also appended an empty bucket when the last group closed a bucket; that one is dropped.
+    users = test_store.nonempty()
+    n_iids = test_store.degree[users].astype(np.int64)
+    in_train = users < train_store.n_rows
+    n_iids[in_train] += train_store.degree[users[in_train]]
+    order = np.argsort(n_iids, kind='stable')
+    users, n_iids = users[order], n_iids[order]
+    # end of every group of equal n_iids and the interactions up to it.
+    ends = np.append(np.nonzero(np.diff(n_iids))[0] + 1, len(n_iids))
+    cum_rates = np.cumsum(n_iids)[ends - 1]
+    threshold = (len(train_store) + len(test_store)) / float(fold)
+    split_uids, split_state = [], []
+    start, base = 0, 0
+    while start < len(n_iids):
+        # the first group at which the bucket reaches the threshold, or the last group.
+        g = min(np.searchsorted(cum_rates, base + threshold), len(ends) - 1)
+        end = ends[g]
+        split_uids.append(users[start: end])
+        split_state.append('#inter per user<=[%d], #users=[%d], #all rates=[%d]' % (
+            n_iids[end - 1], end - start, cum_rates[g] - base))
+        start, base = end, cum_rates[g]
+    return split_uids, split_state
+
+def compute(data, fold=4):
+    split_uids, split_state = sparsity_split(data.train_store, data.test_store, fold)
+    return {'user_degree_hist': degree_histogram(data.train_store.degree),
+            'item_degree_hist': degree_histogram(data.train_store.transpose(data.n_items).degree),
+            'relation_freq': data.relation_freq,
+            'split_users': np.concatenate(split_uids) if split_uids else np.zeros(0, dtype=np.int64),
+            'split_offsets': np.cumsum([0] + [len(u) for u in split_uids]),
+            'split_state': np.array(split_state)}
+
+def load_or_compute(data, fold=4):
+    path = os.path.join(data.path, 'stats.npz')
+    sig = file_signature([os.path.join(data.path, f) for f in ['train.txt', 'test.txt', 'kg_final.txt']])
+    if data.args.node_order != 'none':
+        # the split holds user ids, which depend on the renumbering.
+        sig += ';order=' + data.args.node_order
+    if os.path.exists(path):
+        cached = dict(np.load(path))
+        if str(cached.pop('signature')) == sig and int(cached.pop('fold')) == fold:
+            return cached
+    stats = compute(data, fold)
+    try:
+        np.savez(path, signature=sig, fold=fold, **stats)
+    except OSError as e:
+        print('could not cache the dataset statistics in %s: %s' % (path, e))
+    return stats
+
+def split_lists(stats):
+    offsets = stats['split_offsets']
+    return ([stats['split_users'][offsets[i]: offsets[i + 1]] for i in range(len(offsets) - 1)],
+            [str(s) for s in stats['split_state']])
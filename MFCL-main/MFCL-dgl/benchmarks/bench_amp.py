@@ -0,0 +1,67 @@
+"""
+Compare full precision and mixed precision (fp16/bf16) training of MFCL:
+mean step time, peak memory and recall@20 after --epoch epochs.
+Every precision mode runs in its own process so the peak memory is not shared,
+fp16 is skipped on cpu.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_amp.py --dataset movie-lens --device cpu --epoch 10
+"""
+import sys
+from time import time
+from bench_utils import is_child, setup_model_dir, peak_memory, sync, report, run_child, print_table
+
+MODES = ['none', 'bf16', 'fp16']
+
+def run_mode():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, build_subgraphs, train_epoch, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.batch_test import Evaluator
+    from utility.amp import get_device, get_scaler
+    from utility.optim import build_optimizers
+
+    args = parse_args()
+    data_generator = load_data(args)
+    device = get_device(args)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    optimizers = build_optimizers(args, model)
+    scalers = tuple(get_scaler(args, device) for _ in optimizers)
+    n_steps = (data_generator.n_train // args.batch_size + 1) + (data_generator.n_triples // args.batch_size_kg + 1) \
+              + (data_generator.n_items // args.batch_size_cl + 1)
+    epoch_time = []
+    for epoch in range(args.epoch):
+        sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+        sync(device)
+        t1 = time()
+        train_epoch(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizers, scalers, device)
+        sync(device)
+        epoch_time.append(time() - t1)
+    evaluator = Evaluator(args, data_generator)
+    ret = evaluator.test(g, kg, model, list(data_generator.test_user_dict.keys()))
+    return {'amp': args.amp,
+            'step_ms': 1000. * np.mean(epoch_time) / n_steps,
+            'peak_mb': peak_memory(device),
+            'recall@20': float(ret['recall'][evaluator.Ks.index(20)])}
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_mode())
+        sys.exit(0)
+
+    argv = sys.argv[1:]
+    results = []
+    for mode in MODES:
+        if mode == 'fp16' and 'cpu' in argv:
+            continue
+        r = run_child(__file__, argv + ['--amp', mode])
+        if r is None:
+            print('%s: failed' % mode)
+            continue
+        results.append(r)
+    print_table(results, ['amp', 'step_ms', 'peak_mb', 'recall@20'])
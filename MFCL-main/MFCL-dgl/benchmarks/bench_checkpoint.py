@@ -0,0 +1,67 @@
+"""
+Step time and peak memory of the CF/KG/CL steps with and without
+--grad_checkpoint for GAT stacks of growing depth.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_checkpoint.py --dataset movie-lens --device cpu \
+      --layer_sizes "[64, 32, 16]" "[64, 32, 32, 32, 16]" "[64, 32, 32, 32, 32, 32, 16]" --steps 5
+"""
+import argparse
+import os
+import sys
+from bench_utils import is_child, setup_model_dir, peak_memory, time_steps, report, run_child, print_table
+
+def run_variant():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, build_subgraphs, cf_step, kg_step, cl_step, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.amp import get_device, get_scaler
+    from utility.optim import build_optimizers
+
+    args = parse_args()
+    data_generator = load_data(args)
+    n_steps = int(os.environ['MFCL_BENCH_STEPS'])
+    device = get_device(args)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    model, num_layers = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+    optimizer, optimizer2, optimizer3 = build_optimizers(args, model)
+    scaler = get_scaler(args, device)
+    return {'num_layers': num_layers,
+            'checkpoint': args.grad_checkpoint,
+            'cf_ms': time_steps(lambda: cf_step(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizer, scaler, device), n_steps, device),
+            'kg_ms': time_steps(lambda: kg_step(args, data_generator, model, kg, sub_kg, optimizer2, scaler, device), n_steps, device),
+            'cl_ms': time_steps(lambda: cl_step(args, data_generator, model, kg, sub_cf_g, sub_kg, optimizer3, scaler, device), n_steps, device),
+            'peak_mb': peak_memory(device)}
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_variant())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layer_sizes', nargs='+', default=['[64, 32, 16]', '[64, 32, 32, 32, 16]'])
+    parser.add_argument('--steps', type=int, default=5)
+    bench_args, argv = parser.parse_known_args()
+    results = []
+    for layer_size in bench_args.layer_sizes:
+        for flag in [0, 1]:
+            r = run_child(__file__, argv + ['--layer_size', layer_size, '--grad_checkpoint', str(flag)],
+                          env={'MFCL_BENCH_STEPS': str(bench_args.steps)})
+            if r is None:
+                print('%s checkpoint=%d: failed' % (layer_size, flag))
+                continue
+            results.append(r)
+    print_table(results, ['num_layers', 'checkpoint', 'cf_ms', 'kg_ms', 'cl_ms', 'peak_mb'])
+    # step-time overhead of recomputation against the same depth without it.
+    base = {r['num_layers']: r for r in results if r['checkpoint'] == 0}
+    for r in results:
+        if r['checkpoint'] == 1 and r['num_layers'] in base:
+            b = base[r['num_layers']]
+            print('num_layers=%d: step time x%.2f, peak memory x%.2f' % (
+                r['num_layers'], (r['cf_ms'] + r['kg_ms'] + r['cl_ms']) / (b['cf_ms'] + b['kg_ms'] + b['cl_ms']),
+                r['peak_mb'] / b['peak_mb']))
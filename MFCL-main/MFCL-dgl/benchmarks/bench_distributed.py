@@ -0,0 +1,77 @@
+"""
+Scaling of gloo data-parallel training (--world_size) from 1 to --max_workers local
+processes: epoch time, training samples per second, speedup and scaling efficiency
+(speedup / workers). Every rank runs 1/N of the CF/KG/CL steps of an epoch.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_distributed.py --dataset movie-lens --device cpu --max_workers 4 --epoch 1
+"""
+import argparse
+import sys
+from time import time
+from bench_utils import is_child, setup_model_dir, sync, report, run_child, print_table
+
+def run_workers():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, build_subgraphs, train_epoch, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.amp import get_device, get_scaler
+    from utility.optim import build_optimizers
+    from utility import distributed
+
+    args = parse_args()
+    if args.world_size > 1 and not distributed.is_worker():
+        # the workers inherit stdout, rank 0 reports.
+        sys.exit(distributed.launch(args.world_size, args.dist_port))
+    rank, world_size = distributed.init()
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    data_generator = load_data(args)
+    device = get_device(args)
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    distributed.broadcast_parameters(model)
+    distributed.seed(2023)
+    optimizers = build_optimizers(args, model)
+    scalers = tuple(get_scaler(args, device) for _ in optimizers)
+    epoch_time = []
+    for epoch in range(args.epoch):
+        sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+        distributed.barrier()
+        sync(device)
+        t1 = time()
+        train_epoch(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizers, scalers, device)
+        sync(device)
+        distributed.barrier()
+        epoch_time.append(time() - t1)
+    if rank == 0:
+        n_samples = data_generator.n_train + data_generator.n_triples + data_generator.n_items
+        report({'workers': world_size, 'epoch_s': float(np.mean(epoch_time)),
+                'samples_per_s': n_samples / float(np.mean(epoch_time))})
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        run_workers()
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_workers', type=int, default=4)
+    bench_args, argv = parser.parse_known_args()
+    results = []
+    n = 1
+    while n <= bench_args.max_workers:
+        r = run_child(__file__, argv + ['--world_size', str(n)])
+        if r is None:
+            print('workers=%d: failed' % n)
+        else:
+            results.append(r)
+        n *= 2
+    columns = ['workers', 'epoch_s', 'samples_per_s']
+    if results and results[0]['workers'] == 1:
+        for r in results:
+            r['speedup'] = results[0]['epoch_s'] / r['epoch_s']
+            r['efficiency'] = r['speedup'] / r['workers']
+        columns += ['speedup', 'efficiency']
+    print_table(results, columns)
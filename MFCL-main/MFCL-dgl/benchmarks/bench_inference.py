@@ -0,0 +1,67 @@
+"""
+CPU latency of the full-graph propagation model("test") the Evaluator and export.py run:
+the eager DGL path of myGAT against the DGL-free graph of inference.py, eager and compiled
+with torch.jit.script, with the CSR SpMM aggregation and with the index_add one that is
+exported to ONNX. max_diff is the largest absolute difference to the DGL embedding. Every
+--heads setting runs in its own process.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_inference.py --dataset movie-lens --device cpu --steps 10
+$ python bench_inference.py --dataset movie-lens --device cpu --heads 1 2 --threads 1 4
+"""
+import argparse
+import os
+import sys
+from bench_utils import is_child, setup_model_dir, time_steps, report, run_child, print_table
+
+def run_variant():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from inference import InferenceGAT
+
+    args = parse_args()
+    n_steps = int(os.environ['MFCL_BENCH_STEPS'])
+    torch.set_num_threads(int(os.environ['MFCL_BENCH_THREADS']))
+    device = torch.device('cpu')
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    data_generator = load_data(args)
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    model.eval()
+    results = {'heads': args.heads, 'threads': torch.get_num_threads()}
+    with torch.no_grad():
+        ref = model("test", g, kg)[:]
+        results['dgl_ms'] = time_steps(lambda: model("test", g, kg)[:], n_steps, device)
+        for name, spmm in [('csr', True), ('scatter', False)]:
+            infer = InferenceGAT.from_model(model, g, kg, spmm=spmm)
+            scripted = torch.jit.script(infer)
+            results[name + '_ms'] = time_steps(infer, n_steps, device)
+            results[name + '_script_ms'] = time_steps(scripted, n_steps, device)
+            results[name + '_max_diff'] = max(float((ref - infer()).abs().max()), float((ref - scripted()).abs().max()))
+    return results
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_variant())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--heads', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--steps', type=int, default=10)
+    bench_args, argv = parser.parse_known_args()
+    results = []
+    for heads in bench_args.heads:
+        for threads in bench_args.threads:
+            r = run_child(__file__, argv + ['--heads', str(heads)],
+                          env={'MFCL_BENCH_STEPS': str(bench_args.steps), 'MFCL_BENCH_THREADS': str(threads)})
+            if r is None:
+                print('heads=%d threads=%d: failed' % (heads, threads))
+                continue
+            results.append(r)
+    print_table(results, ['heads', 'threads', 'dgl_ms', 'csr_ms', 'csr_script_ms', 'scatter_ms', 'scatter_script_ms',
+                          'csr_max_diff', 'scatter_max_diff'])
@@ -0,0 +1,148 @@
+"""
+Microbenchmarks of the MFCL building blocks on a synthetic dataset (see synthetic.py)
+or on one of the bundled datasets: data loading, CF/KG samplers, subgraph construction,
+myGATConv forward/backward, DropLearner filtering, Contrast_2view loss, DistMult and evaluation.
+Every run is appended to --results together with the current commit, so throughput and
+memory can be followed across commits; the table shows the change against the previous run
+of the same configuration.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_micro.py --device cpu --steps 5                           # synthetic, default sizes
+$ python bench_micro.py --n_users 50000 --n_entities 60000 --skew 1.5 --device cpu
+$ python bench_micro.py --no_synthetic --dataset movie-lens --device cpu
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import time
+from bench_utils import is_child, setup_model_dir, peak_memory, reset_peak_memory, time_steps, report, run_child
+import synthetic
+
+def run_benchmarks():
+    import numpy as np
+    import torch
+    t1 = time()
+    from main import build_model, build_graphs, build_subgraphs, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.batch_test import Evaluator
+    from utility.amp import get_device, l2_normalize
+
+    args = parse_args()
+    n_steps = int(os.environ['MFCL_BENCH_STEPS'])
+    device = get_device(args)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    results = {}
+
+    def bench(name, fn, n_items, steps=n_steps, warmup=True):
+        reset_peak_memory(device)
+        ms = time_steps(fn, steps, device, warmup)
+        results[name] = {'ms': ms, 'per_s': 1000. * n_items / ms, 'peak_mb': peak_memory(device)}
+
+    t2 = time()
+    data_generator = load_data(args)
+    results['load'] = {'ms': 1000. * (time() - t2), 'peak_mb': peak_memory(device)}
+    results['load']['per_s'] = 1000. * (data_generator.n_train + data_generator.n_triples) / results['load']['ms']
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+    bench('cf_sampler', data_generator.generate_train_batch, args.batch_size)
+    bench('kg_sampler', data_generator.generate_train_kg_batch, args.batch_size_kg)
+    bench('subgraph', lambda: build_subgraphs(data_generator, args.drop_rate, device),
+          sub_cf_g.num_edges() + sub_kg.num_edges(), steps=1)
+
+    layer = model.gat_layers[0]
+    x = model.embed
+    def gat_fwd():
+        with torch.no_grad():
+            layer(g, x)
+    def gat_fwd_bwd():
+        model.zero_grad()
+        h, _ = layer(g, x)
+        h.sum().backward()
+    bench('gatconv_fwd', gat_fwd, g.num_edges())
+    bench('gatconv_fwd_bwd', gat_fwd_bwd, g.num_edges())
+    layer.set_fused(True)
+    bench('gatconv_fused_fwd_bwd', gat_fwd_bwd, g.num_edges())
+    layer.set_fused(args.fused_gat == 1)
+
+    def drop_learner_cf():
+        with torch.no_grad():
+            model.learner2(l2_normalize(model.embed, model.epsilon), sub_cf_g, temperature=0.7)
+    def drop_learner_kg():
+        with torch.no_grad():
+            model.learner1(l2_normalize(model.kg_embed, model.epsilon), kg, temperature=0.7)
+    bench('drop_learner_cf', drop_learner_cf, sub_cf_g.num_edges())
+    bench('drop_learner_kg', drop_learner_kg, kg.num_edges())
+
+    dim = model.cfe_size + model.layer_dim
+    z1 = torch.randn(args.batch_size_cl, dim, device=device, requires_grad=True)
+    z2 = torch.randn(args.batch_size_cl, model.kge_size + model.layer_dim, device=device, requires_grad=True)
+    bench('contrast', lambda: model.contrast1(z1, z2).backward(), args.batch_size_cl)
+
+    n = args.batch_size_kg
+    h_emb = torch.randn(2 * n, model.kge_size + model.layer_dim, device=device, requires_grad=True)
+    t_emb = torch.randn(2 * n, model.kge_size + model.layer_dim, device=device)
+    r = np.random.randint(0, data_generator.n_relations, n)
+    bench('distmult', lambda: model.decoder(h_emb, t_emb, r).sum().backward(), 2 * n)
+
+    users = list(data_generator.test_user_dict.keys())
+    evaluator = Evaluator(args, data_generator)
+    bench('evaluation', lambda: evaluator.test(g, kg, model, users), len(users), steps=1, warmup=False)
+    return {'total_s': time() - t1, 'benchmarks': results}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], universal_newlines=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return 'unknown'
+
+def previous_run(results_file, config):
+    if not os.path.exists(results_file):
+        return None
+    prev = None
+    with open(results_file) as f:
+        for line in f:
+            run = json.loads(line)
+            if run['config'] == config:
+                prev = run
+    return prev
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_benchmarks())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    synthetic.add_arguments(parser)
+    parser.add_argument('--no_synthetic', action='store_true', help='benchmark the dataset given by --dataset.')
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--results', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl'))
+    bench_args, argv = parser.parse_known_args()
+    config = {'argv': argv}
+    if not bench_args.no_synthetic:
+        argv = argv + synthetic.generate_from_args(bench_args)
+        config.update({k: getattr(bench_args, k) for k in ['n_users', 'n_items', 'n_entities', 'n_relations',
+                                                           'n_triples', 'inter_per_user', 'skew', 'seed']})
+    r = run_child(__file__, argv, env={'MFCL_BENCH_STEPS': str(bench_args.steps)})
+    if r is None:
+        print('benchmarks failed')
+        sys.exit(1)
+
+    prev = previous_run(bench_args.results, config)
+    run = {'commit': git_commit(), 'time': time(), 'config': config, 'results': r}
+    with open(bench_args.results, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+
+    print('%-22s %12s %14s %10s %10s' % ('benchmark', 'ms', 'items/s', 'peak[MB]', 'vs prev'))
+    for name, b in r['benchmarks'].items():
+        change = ''
+        if prev is not None and name in prev['results']['benchmarks']:
+            change = '%+.1f%%' % (100. * (b['ms'] / prev['results']['benchmarks'][name]['ms'] - 1))
+        print('%-22s %12.2f %14.1f %10.1f %10s' % (name, b['ms'], b['per_s'], b['peak_mb'], change))
+    if prev is not None:
+        print('previous run: commit %s' % prev['commit'])
@@ -0,0 +1,61 @@
+"""
+Step time of the CF/KG/CL steps and the size of the optimizer states,
+dense Adam against --sparse_adam 1 (row-wise updates of the embedding tables).
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_optim.py --dataset movie-lens --device cpu --steps 5
+"""
+import argparse
+import os
+import sys
+from bench_utils import is_child, setup_model_dir, time_steps, report, run_child, print_table
+
+def state_mb(optimizers):
+    n_bytes = 0
+    for optimizer in optimizers:
+        for state in optimizer.state.values():
+            n_bytes += sum(v.numel() * v.element_size() for v in state.values() if hasattr(v, 'numel'))
+    return n_bytes / 2 ** 20
+
+def run_variant():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, build_subgraphs, cf_step, kg_step, cl_step, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.amp import get_device, get_scaler
+    from utility.optim import build_optimizers
+
+    args = parse_args()
+    data_generator = load_data(args)
+    n_steps = int(os.environ['MFCL_BENCH_STEPS'])
+    device = get_device(args)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+    optimizers = build_optimizers(args, model)
+    scaler = get_scaler(args, device)
+    return {'sparse_adam': args.sparse_adam,
+            'cf_ms': time_steps(lambda: cf_step(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizers[0], scaler, device), n_steps, device),
+            'kg_ms': time_steps(lambda: kg_step(args, data_generator, model, kg, sub_kg, optimizers[1], scaler, device), n_steps, device),
+            'cl_ms': time_steps(lambda: cl_step(args, data_generator, model, kg, sub_cf_g, sub_kg, optimizers[2], scaler, device), n_steps, device),
+            'state_mb': state_mb(optimizers)}
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_variant())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=5)
+    bench_args, argv = parser.parse_known_args()
+    results = []
+    for flag in [0, 1]:
+        r = run_child(__file__, argv + ['--sparse_adam', str(flag)], env={'MFCL_BENCH_STEPS': str(bench_args.steps)})
+        if r is None:
+            print('sparse_adam=%d: failed' % flag)
+            continue
+        results.append(r)
+    print_table(results, ['sparse_adam', 'cf_ms', 'kg_ms', 'cl_ms', 'state_mb'])
@@ -0,0 +1,77 @@
+"""
+Message passing under the node orders of --node_order (see utility/reorder.py): for every
+dataset and order, the time of the renumbering itself, the mean id distance between the ends
+of an edge of the CF graph and the KG, and the milliseconds of the full-graph GAT propagation
+of the CF and KG views (forward + backward, as in training) and of model("test"). The
+speedup is against the dataset ids (none). Every run is its own process.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_reorder.py --datasets movie-lens last-fm --device cpu --steps 5
+$ python bench_reorder.py --datasets movie-lens --orders none rcm community --device cuda
+"""
+import argparse
+import sys
+import os
+from time import time
+from bench_utils import is_child, setup_model_dir, time_steps, report, run_child, print_table
+
+def run_variant():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.amp import get_device
+
+    args = parse_args()
+    n_steps = int(os.environ['MFCL_BENCH_STEPS'])
+    device = get_device(args)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    t1 = time()
+    data_generator = load_data(args)
+    load_s = time() - t1
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+
+    def gap(graph):
+        src, dst = graph.edges()
+        return float((src - dst).abs().float().mean())
+
+    def propagate(calc, graph):
+        def fn():
+            model.zero_grad()
+            calc(graph)[:].sum().backward()
+        return fn
+
+    result = {'dataset': args.dataset, 'order': args.node_order, 'load_s': load_s, 'cf_gap': gap(g), 'kg_gap': gap(kg),
+              'cf_ms': time_steps(propagate(model.calc_cf_emb, g), n_steps, device),
+              'kg_ms': time_steps(propagate(model.calc_kg_emb, kg), n_steps, device)}
+    model.eval()
+    with torch.no_grad():
+        result['test_ms'] = time_steps(lambda: model("test", g, kg)[:], n_steps, device)
+    return result
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_variant())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasets', nargs='+', default=['movie-lens'])
+    parser.add_argument('--orders', nargs='+', default=['none', 'degree', 'rcm', 'community'])
+    parser.add_argument('--steps', type=int, default=5)
+    bench_args, argv = parser.parse_known_args()
+    results = []
+    for dataset in bench_args.datasets:
+        base = None
+        for order in bench_args.orders:
+            r = run_child(__file__, argv + ['--dataset', dataset, '--node_order', order],
+                          env={'MFCL_BENCH_STEPS': str(bench_args.steps)})
+            if r is None:
+                print('%s %s: failed' % (dataset, order))
+                continue
+            base = base or (r if order == 'none' else None)
+            r['speedup'] = (base['cf_ms'] + base['kg_ms']) / (r['cf_ms'] + r['kg_ms']) if base else float('nan')
+            results.append(r)
+    print_table(results, ['dataset', 'order', 'load_s', 'cf_gap', 'kg_gap', 'cf_ms', 'kg_ms', 'test_ms', 'speedup'])
@@ -0,0 +1,84 @@
+"""
+Uniform against degree-weighted negatives (alias tables, see utility/sampler.py): for every
+setting item_exp:entity_exp (--neg_item_exp, --neg_entity_exp) MFCL is trained for up to
+--epoch epochs and evaluated every --eval_every epochs; the table shows the time and the
+epochs it took to reach recall@20 >= --target (- if never), the best recall@20 and the
+milliseconds the CF/KG batch samplers take per batch. Every setting runs in its own process.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_sampler.py --dataset movie-lens --device cpu --epoch 100 --target 0.1
+$ python bench_sampler.py --dataset movie-lens --device cpu --variants 0:0 0.75:0 0.75:0.75 1:1
+"""
+import argparse
+import os
+import sys
+from time import time
+from bench_utils import is_child, setup_model_dir, sync, time_steps, report, run_child, print_table
+
+def run_variant():
+    import numpy as np
+    import torch
+    from main import build_model, build_graphs, build_subgraphs, train_epoch, load_data, load_pretrained_data
+    from utility.parser import parse_args
+    from utility.batch_test import Evaluator
+    from utility.amp import get_device, get_scaler
+    from utility.optim import build_optimizers
+
+    args = parse_args()
+    eval_every, target = int(os.environ['MFCL_BENCH_EVAL_EVERY']), float(os.environ['MFCL_BENCH_TARGET'])
+    data_generator = load_data(args)
+    device = get_device(args)
+    torch.manual_seed(2023)
+    np.random.seed(2023)
+    result = {'variant': '%g:%g' % (args.neg_item_exp, args.neg_entity_exp),
+              'cf_batch_ms': time_steps(data_generator.generate_train_batch, 20, device),
+              'kg_batch_ms': time_steps(data_generator.generate_train_kg_batch, 20, device)}
+    model, _ = build_model(args, data_generator, load_pretrained_data(args), device)
+    g, kg, _ = build_graphs(data_generator, device)
+    optimizers = build_optimizers(args, model)
+    scalers = tuple(get_scaler(args, device) for _ in optimizers)
+    evaluator = Evaluator(args, data_generator)
+    users = list(data_generator.test_user_dict.keys())
+    k = evaluator.Ks.index(20)
+    train_time, best = 0., 0.
+    result.update(target_s='-', target_epoch='-')
+    for epoch in range(args.epoch):
+        sub_cf_g, sub_kg = build_subgraphs(data_generator, args.drop_rate, device)
+        sync(device)
+        t1 = time()
+        train_epoch(args, data_generator, model, g, kg, sub_cf_g, sub_kg, optimizers, scalers, device)
+        sync(device)
+        # the training time only, the evaluations are the same for every setting.
+        train_time += time() - t1
+        if (epoch + 1) % eval_every != 0:
+            continue
+        recall = float(evaluator.test(g, kg, model, users)['recall'][k])
+        best = max(best, recall)
+        if recall >= target:
+            result.update(target_s=train_time, target_epoch=epoch + 1)
+            break
+    result['best_recall@20'] = best
+    return result
+
+if __name__ == '__main__':
+    if is_child():
+        setup_model_dir()
+        report(run_variant())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants', nargs='+', default=['0:0', '0.75:0', '0.75:0.75'],
+                        help='neg_item_exp:neg_entity_exp settings, 0:0 is uniform.')
+    parser.add_argument('--target', type=float, default=0.1, help='recall@20 to reach.')
+    parser.add_argument('--eval_every', type=int, default=5)
+    bench_args, argv = parser.parse_known_args()
+    results = []
+    for variant in bench_args.variants:
+        item_exp, entity_exp = variant.split(':')
+        r = run_child(__file__, argv + ['--neg_item_exp', item_exp, '--neg_entity_exp', entity_exp],
+                      env={'MFCL_BENCH_EVAL_EVERY': str(bench_args.eval_every), 'MFCL_BENCH_TARGET': str(bench_args.target)})
+        if r is None:
+            print('%s: failed' % variant)
+            continue
+        results.append(r)
+    print_table(results, ['variant', 'target_s', 'target_epoch', 'best_recall@20', 'cf_batch_ms', 'kg_batch_ms'])
@@ -0,0 +1,137 @@
+"""
+Load test of serve.py on one box: for every setting max_batch:max_wait_ms[:cache_size] a
+server is started on the exported embeddings and hammered by --concurrency keep-alive
+clients asking for the top-K of random users (power-law popular with --user_skew > 0);
+throughput and client-side latency percentiles are reported next to the mean batch size the
+server formed and the hit rate of its result cache. Without --emb_path random embeddings of
+the given size are exported first.
+
+$ cd MFCL-main/MFCL-dgl/benchmarks
+$ python bench_serve.py --variants 1:0 64:1 256:2 --concurrency 1 16 64 --requests 5000
+$ python bench_serve.py --variants 64:1:0 64:1:10000 --user_skew 1.2
+$ python bench_serve.py --emb_path ../Model/output/movie-lens/embeddings.npz
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import time, perf_counter, sleep
+import numpy as np
+from bench_utils import MODEL_DIR, print_table
+
+def random_embeddings(path, n_users, n_items, dim, n_seen, seed=2023):
+    sys.path.insert(0, MODEL_DIR)
+    from utility.interactions import CSR
+    from utility.serving import save_embeddings
+    rng = np.random.RandomState(seed)
+    seen = CSR.from_pairs(np.repeat(np.arange(n_users), n_seen), rng.randint(0, n_items, n_users * n_seen), n_users, n_items)
+    save_embeddings(path, rng.randn(n_users, dim).astype(np.float32), rng.randn(n_items, dim).astype(np.float32), seen)
+
+async def request(reader, writer, target):
+    writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % target).encode())
+    await writer.drain()
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    body = await reader.readexactly(length)
+    return int(status.split()[1]), body
+
+async def load(port, n_users, concurrency, n_requests, k, skew=0., seed=0):
+    rng = np.random.RandomState(seed)
+    p = 1. / np.arange(1, n_users + 1) ** skew
+    users = rng.choice(n_users, n_requests, p=p / p.sum())
+    latencies, errors = [], 0
+    next_request = iter(range(n_requests))
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for i in next_request:
+            t0 = perf_counter()
+            status, _ = await request(reader, writer, '/recommend?user=%d&k=%d' % (users[i], k))
+            latencies.append(1000. * (perf_counter() - t0))
+            errors += status != 200
+        writer.close()
+    t0 = perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = perf_counter() - t0
+    p50, p90, p99, p999 = np.percentile(latencies, [50, 90, 99, 99.9])
+    return {'qps': n_requests / elapsed, 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'p999_ms': p999, 'errors': errors}
+
+async def server_stats(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    _, body = await request(reader, writer, '/stats')
+    writer.close()
+    return json.loads(body)
+
+async def reset_stats(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'POST /stats/reset HTTP/1.1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+def start_server(emb_path, port, max_batch, max_wait, cache_size, timeout=60.):
+    server = subprocess.Popen([sys.executable, 'serve.py', '--emb_path', emb_path, '--serve_port', str(port),
+                               '--serve_max_batch', str(max_batch), '--serve_max_wait', str(max_wait),
+                               '--cache_size', str(cache_size)],
+                              cwd=MODEL_DIR, stdout=subprocess.DEVNULL)
+    t0 = time()
+    while time() - t0 < timeout:
+        try:
+            asyncio.run(server_stats(port))
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            sleep(0.2)
+    server.kill()
+    raise RuntimeError('serve.py did not come up on port %d' % port)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emb_path', default='')
+    parser.add_argument('--n_users', type=int, default=50000)
+    parser.add_argument('--n_items', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--n_seen', type=int, default=30)
+    parser.add_argument('--variants', nargs='+', default=['1:0', '64:1', '256:2'],
+                        help='max_batch:max_wait_ms[:cache_size] settings of the server, no cache by default.')
+    parser.add_argument('--user_skew', type=float, default=0.,
+                        help='power-law exponent of the user popularity, 0 for uniform users.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--port', type=int, default=18080)
+    bench_args = parser.parse_args()
+
+    emb_path = bench_args.emb_path
+    if not emb_path:
+        emb_path = os.path.join(tempfile.mkdtemp(prefix='mfcl_serve_'), 'embeddings.npz')
+        random_embeddings(emb_path, bench_args.n_users, bench_args.n_items, bench_args.dim, bench_args.n_seen)
+    n_users = len(np.load(emb_path)['user'])
+    results = []
+    for variant in bench_args.variants:
+        max_batch, max_wait, cache_size = (variant.split(':') + ['0'])[:3]
+        server = start_server(emb_path, bench_args.port, int(max_batch), float(max_wait), int(cache_size))
+        try:
+            for concurrency in bench_args.concurrency:
+                asyncio.run(reset_stats(bench_args.port))
+                r = asyncio.run(load(bench_args.port, n_users, concurrency, bench_args.requests, bench_args.k,
+                                     bench_args.user_skew, seed=concurrency))
+                stats = asyncio.run(server_stats(bench_args.port))
+                r.update(variant=variant, concurrency=concurrency, mean_batch=stats['mean_batch'],
+                         hit_rate=stats['cache']['hit_rate'])
+                results.append(r)
+        finally:
+            server.terminate()
+            server.wait()
+    print_table(results, ['variant', 'concurrency', 'qps', 'p50_ms', 'p99_ms', 'p999_ms', 'mean_batch', 'hit_rate', 'errors'])
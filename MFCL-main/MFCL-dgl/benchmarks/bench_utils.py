@@ -0,0 +1,63 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+from time import time
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model')
+
+def is_child():
+    return os.environ.get('MFCL_BENCH_CHILD') == '1'
+
+def setup_model_dir():
+    # the model code imports its siblings and reads ../Data/ relative to Model/.
+    os.chdir(MODEL_DIR)
+    sys.path.insert(0, MODEL_DIR)
+
+def peak_memory(device):
+    if device.type == 'cuda':
+        import torch
+        return torch.cuda.max_memory_allocated() / 2 ** 20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+def reset_peak_memory(device):
+    # the cpu high-water mark (ru_maxrss) can not be reset, it only grows within a process.
+    if device.type == 'cuda':
+        import torch
+        torch.cuda.reset_peak_memory_stats()
+
+def sync(device):
+    if device.type == 'cuda':
+        import torch
+        torch.cuda.synchronize()
+
+def time_steps(fn, n_steps, device, warmup=True):
+    # returns the mean milliseconds of one call, after a warm-up call by default.
+    if warmup:
+        fn()
+    sync(device)
+    t1 = time()
+    for _ in range(n_steps):
+        fn()
+    sync(device)
+    return 1000. * (time() - t1) / n_steps
+
+def report(result):
+    print('MFCL_BENCH ' + json.dumps(result))
+    sys.stdout.flush()
+
+def run_child(script, argv, env=None):
+    # every variant runs in a fresh process so the peak memory is its own.
+    env = dict(os.environ, MFCL_BENCH_CHILD='1', **(env or {}))
+    out = subprocess.run([sys.executable, os.path.abspath(script)] + argv,
+                         env=env, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    lines = [l for l in out.splitlines() if l.startswith('MFCL_BENCH ')]
+    if not lines:
+        return None
+    return json.loads(lines[-1][len('MFCL_BENCH '):])
+
+def print_table(results, columns):
+    print(' '.join('%14s' % c for c in columns))
+    for r in results:
+        print(' '.join('%14.5g' % r[c] if isinstance(r[c], float) else '%14s' % r[c] for c in columns))
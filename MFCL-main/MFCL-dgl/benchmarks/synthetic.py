@@ -0,0 +1,103 @@
+"""
+Synthetic user-item and knowledge graphs in the layout KGAT_loader reads:
+
+    <out>/Data/<name>/train.txt      u i1 i2 ...
+    <out>/Data/<name>/test.txt       u i1 i2 ...
+    <out>/Data/<name>/kg_final.txt   h r t
+    <out>/pretrain/<name>/mf.npz     user_embed, item_embed
+
+Item and entity popularity follow a power law with exponent --skew (0 is uniform),
+items are the entities 0 .. n_items-1 as in the bundled datasets.
+Run main.py on it with --data_path <out>/Data/ --proj_path <out>/Model/ --dataset <name>.
+
+The DropLearner filters need more than 20000 entities and 12000 users + items
+(their cut-off frequencies are fixed at 10000 and 6000).
+
+$ python synthetic.py --out /tmp/mfcl_synth --n_users 20000 --n_items 8000 --n_entities 30000
+"""
+import argparse
+import os
+import numpy as np
+
+def powerlaw_probs(n, skew, rng):
+    p = 1. / np.arange(1, n + 1) ** skew
+    # popular ids are scattered over the id range instead of being the smallest ones.
+    p = p[rng.permutation(n)]
+    return p / p.sum()
+
+def generate_cf(n_users, n_items, inter_per_user, skew, test_ratio, rng):
+    # the number of interactions per user is Pareto with mean inter_per_user and a tail
+    # that gets heavier with skew, every user keeps at least one train and one test item.
+    shape = 1. + 1. / max(skew, 1e-3)
+    degree = 2 + (inter_per_user - 2) * (shape - 1) * rng.pareto(shape, n_users)
+    degree = np.clip(np.round(degree), 2, n_items // 2).astype(np.int64)
+    item_p = powerlaw_probs(n_items, skew, rng)
+    train, test = [], []
+    for u in range(n_users):
+        items = np.unique(rng.choice(n_items, size=degree[u], p=item_p))
+        if len(items) < 2:
+            items = rng.choice(n_items, size=2, replace=False)
+        items = rng.permutation(items)
+        n_test = max(1, int(len(items) * test_ratio))
+        test.append((u, items[:n_test]))
+        train.append((u, items[n_test:]))
+    # the loader takes n_items from the largest item id that occurs.
+    if not any((items == n_items - 1).any() for _, items in train + test):
+        train[0] = (0, np.append(train[0][1], n_items - 1))
+    return train, test
+
+def generate_kg(n_items, n_entities, n_relations, n_triples, skew, rng):
+    ent_p = powerlaw_probs(n_entities, skew, rng)
+    heads = np.concatenate([np.arange(n_items), rng.choice(n_entities, size=max(0, n_triples - n_items), p=ent_p)])
+    tails = rng.choice(n_entities, size=len(heads), p=ent_p)
+    rels = rng.choice(n_relations, size=len(heads), p=powerlaw_probs(n_relations, skew, rng))
+    kg = np.stack([heads, rels, tails], 1)
+    kg = kg[kg[:, 0] != kg[:, 2]]
+    # make sure the largest ids appear so n_entities/n_relations come out as requested.
+    kg = np.concatenate([kg, [[0, n_relations - 1, n_entities - 1]]], 0)
+    return np.unique(kg, axis=0)
+
+def write_interactions(file_name, inters):
+    with open(file_name, 'w') as f:
+        for u, items in inters:
+            f.write('%d %s\n' % (u, ' '.join(str(i) for i in items)))
+
+def generate(out, name, n_users=20000, n_items=8000, n_entities=30000, n_relations=10, n_triples=150000,
+             inter_per_user=10, skew=1.0, test_ratio=0.2, embed_size=64, seed=2023):
+    rng = np.random.RandomState(seed)
+    data_dir = os.path.join(out, 'Data', name)
+    pretrain_dir = os.path.join(out, 'pretrain', name)
+    for d in [data_dir, pretrain_dir, os.path.join(out, 'Model')]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    train, test = generate_cf(n_users, n_items, inter_per_user, skew, test_ratio, rng)
+    write_interactions(os.path.join(data_dir, 'train.txt'), train)
+    write_interactions(os.path.join(data_dir, 'test.txt'), test)
+    kg = generate_kg(n_items, n_entities, n_relations, n_triples, skew, rng)
+    np.savetxt(os.path.join(data_dir, 'kg_final.txt'), kg, fmt='%d')
+    np.savez(os.path.join(pretrain_dir, 'mf.npz'),
+             user_embed=(0.1 * rng.randn(n_users, embed_size)).astype(np.float32),
+             item_embed=(0.1 * rng.randn(n_items, embed_size)).astype(np.float32))
+    return ['--data_path', os.path.join(out, 'Data') + os.sep, '--proj_path', os.path.join(out, 'Model') + os.sep,
+            '--dataset', name]
+
+def add_arguments(parser):
+    parser.add_argument('--out', default='/tmp/mfcl_synth')
+    parser.add_argument('--name', default='synthetic')
+    parser.add_argument('--n_users', type=int, default=20000)
+    parser.add_argument('--n_items', type=int, default=8000)
+    parser.add_argument('--n_entities', type=int, default=30000)
+    parser.add_argument('--n_relations', type=int, default=10)
+    parser.add_argument('--n_triples', type=int, default=150000)
+    parser.add_argument('--inter_per_user', type=int, default=10)
+    parser.add_argument('--skew', type=float, default=1.0, help='power-law exponent of the degrees, 0 for uniform.')
+    parser.add_argument('--seed', type=int, default=2023)
+
+def generate_from_args(a):
+    return generate(a.out, a.name, a.n_users, a.n_items, a.n_entities, a.n_relations, a.n_triples,
+                    a.inter_per_user, a.skew, seed=a.seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    print(' '.join(generate_from_args(parser.parse_args())))
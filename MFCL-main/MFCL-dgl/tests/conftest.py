@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the model code imports its siblings as top-level modules, as when run from Model/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model'))
@@ -0,0 +1,32 @@
+import torch
+from utility.augment import SubgraphProducer, EdgeWeightRefresh
+
+def draws(pool_size=0, prefetch=True, start=0, epochs=range(0, 5)):
+    producer = SubgraphProducer(lambda rng: rng.randint(0, 2 ** 31, 3).tolist(), pool_size, seed=7,
+                                prefetch=prefetch, start=start)
+    views = [producer.get(epoch) for epoch in epochs]
+    producer.close()
+    return views
+
+def test_resumed_producer_builds_the_same_views():
+    full = draws()
+    assert len(set(map(tuple, full))) == 5
+    assert draws(start=3, epochs=range(3, 5)) == full[3:]
+    pool = draws(pool_size=2)
+    assert pool == [pool[0], pool[1]] * 2 + [pool[0]]
+    assert draws(pool_size=2, start=3, epochs=range(3, 5)) == pool[3:]
+    assert draws(pool_size=2, prefetch=False) == pool
+
+def test_refresh_policy_state_roundtrip():
+    g, x = object(), torch.ones(4, 2)
+    policy = EdgeWeightRefresh('3')
+    policy.refreshed(g, x, torch.tensor(0.5))
+    policy.reused()
+    restored = EdgeWeightRefresh('3')
+    restored.load_state_dict(policy.state_dict())
+    # without the graph the weights are recomputed, on the rebound graph the policy goes on.
+    assert restored.due(g, x)
+    restored.rebind(g)
+    assert not restored.due(g, x)
+    restored.reused()
+    assert restored.due(g, x) and float(restored.reg) == 0.5
@@ -0,0 +1,30 @@
+import numpy as np
+import torch
+from utility.batch_test import blocked_topk
+from utility.interactions import CSR
+
+def brute_topk(scores, k, seen_sets):
+    out = []
+    for i, row in enumerate(scores):
+        order = [j for j in np.argsort(-row, kind='stable') if j not in seen_sets[i]][:k]
+        out.append(order + [-1] * (k - len(order)))
+    return np.array(out)
+
+def test_blocked_topk_matches_brute_force():
+    rng = np.random.RandomState(0)
+    user, item = torch.randn(12, 8), torch.randn(37, 8)
+    seen = CSR.from_pairs(rng.randint(0, 10, 80), rng.randint(0, 37, 80), 10, 37)
+    # users 10 and 11 are past the seen store (no training interactions).
+    users = np.array([3, 0, 9, 10, 5, 1, 2, 11, 4, 6, 7, 8])
+    seen_sets = [set(seen.neighbors(u).tolist()) for u in users]
+    scores = torch.mm(user, item.t()).numpy()
+    for block_size in [1, 5, 37, 100]:
+        assert np.array_equal(blocked_topk(user, item, 10, block_size), brute_topk(scores, 10, [set()] * 12))
+        assert np.array_equal(blocked_topk(user, item, 10, block_size, seen, users), brute_topk(scores, 10, seen_sets))
+
+def test_blocked_topk_pads_rows_without_enough_items():
+    user, item = torch.randn(2, 4), torch.randn(5, 4)
+    seen = CSR.from_pairs([0, 0, 0, 0], [0, 1, 2, 3], 2, 5)
+    top = blocked_topk(user, item, 3, 2, seen, np.array([0, 1]))
+    assert top[0].tolist() == [4, -1, -1]
+    assert sorted(top[1].tolist()) == sorted(np.argsort(-(user[1] @ item.t()).numpy())[:3].tolist())
@@ -0,0 +1,73 @@
+import json
+import os
+import torch
+from utility.checkpoint import Checkpointer
+
+def saved_epoch(path):
+    return torch.load(path, weights_only=False)['epoch']
+
+def test_best_k_rotation(tmp_path):
+    ckpt_dir = str(tmp_path)
+    checkpointer = Checkpointer(ckpt_dir, keep_best=2)
+    scores = {0: 0.1, 1: 0.3, 2: None, 3: 0.2, 4: 0.5, 5: 0.05}
+    for epoch, score in scores.items():
+        checkpointer.save({'epoch': epoch, 'w': torch.full((2,), float(epoch))}, score=score)
+    checkpointer.close()
+    # the two highest scores are kept, the rest is rotated out.
+    assert sorted(f for f in os.listdir(ckpt_dir)) == ['best_epoch1.pt', 'best_epoch4.pt', 'index.json', 'latest.pt']
+    with open(os.path.join(ckpt_dir, 'index.json')) as f:
+        index = json.load(f)
+    assert index == {'latest': 5, 'best': [[0.5, 4], [0.3, 1]]}
+    assert saved_epoch(os.path.join(ckpt_dir, 'latest.pt')) == 5
+    assert saved_epoch(os.path.join(ckpt_dir, 'best_epoch4.pt')) == 4
+    reopened = Checkpointer(ckpt_dir, keep_best=2)
+    assert reopened.best() == os.path.join(ckpt_dir, 'best_epoch4.pt')
+    assert reopened.load()['epoch'] == 5
+    reopened.close()
+
+def test_late_scores_do_not_replace_latest(tmp_path):
+    # --eval_async scores an epoch after later epochs were saved.
+    ckpt_dir = str(tmp_path)
+    checkpointer = Checkpointer(ckpt_dir, keep_best=1)
+    checkpointer.save({'epoch': 9})
+    checkpointer.save({'epoch': 4}, score=0.4)
+    checkpointer.save({'epoch': 6}, score=0.2)
+    checkpointer.close()
+    assert saved_epoch(os.path.join(ckpt_dir, 'latest.pt')) == 9
+    assert saved_epoch(os.path.join(ckpt_dir, 'best_epoch4.pt')) == 4
+    assert not os.path.exists(os.path.join(ckpt_dir, 'best_epoch6.pt'))
+
+def test_new_run_does_not_inherit_the_index(tmp_path):
+    ckpt_dir = str(tmp_path)
+    first = Checkpointer(ckpt_dir, keep_best=2, resume=False)
+    for epoch, score in [(9, 0.1), (19, 0.5), (29, 0.3)]:
+        first.save({'epoch': epoch, 'run': 'a'}, score=score)
+    first.close()
+    second = Checkpointer(ckpt_dir, keep_best=2, resume=False)
+    assert second.latest() is None and second.best() is None
+    second.save({'epoch': 9, 'run': 'b'}, score=0.2)
+    second.save({'epoch': 10, 'run': 'b'})
+    second.close()
+    assert second.load()['run'] == 'b' and second.load()['epoch'] == 10
+    assert torch.load(second.best(), weights_only=False)['run'] == 'b'
+    assert sorted(os.listdir(ckpt_dir)) == ['best_epoch9.pt', 'index.json', 'latest.pt', 'previous0']
+    # the earlier run is kept aside, whole.
+    assert sorted(os.listdir(os.path.join(ckpt_dir, 'previous0'))) == [
+        'best_epoch19.pt', 'best_epoch29.pt', 'index.json', 'latest.pt']
+    resumed = Checkpointer(ckpt_dir, keep_best=2)
+    assert resumed.load()['run'] == 'b'
+    resumed.close()
+
+def test_stale_only_against_this_process(tmp_path):
+    # an index on disk with a later epoch than this process saves, e.g. resumed from best.
+    ckpt_dir = str(tmp_path)
+    first = Checkpointer(ckpt_dir, keep_best=1)
+    first.save({'epoch': 29})
+    first.close()
+    second = Checkpointer(ckpt_dir, keep_best=1)
+    second.save({'epoch': 10})
+    second.save({'epoch': 12})
+    second.save({'epoch': 11}, score=0.3)
+    second.close()
+    assert saved_epoch(os.path.join(ckpt_dir, 'latest.pt')) == 12
+    assert saved_epoch(second.best()) == 11
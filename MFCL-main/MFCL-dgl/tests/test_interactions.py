@@ -0,0 +1,43 @@
+import numpy as np
+from utility.interactions import CSR
+
+def random_store(seed=0, n_rows=30, n_cols=50, n_pairs=200):
+    rng = np.random.RandomState(seed)
+    rows, cols = rng.randint(0, n_rows, n_pairs), rng.randint(0, n_cols, n_pairs)
+    sets = {}
+    for r, c in zip(rows, cols):
+        sets.setdefault(int(r), set()).add(int(c))
+    # some rows stay empty, n_rows leaves room past the last row with interactions.
+    return CSR.from_pairs(rows, cols, n_rows + 5, n_cols), sets
+
+def test_neighbors_sorted_and_deduplicated():
+    store, sets = random_store()
+    assert len(store) == sum(len(s) for s in sets.values())
+    for r in range(store.n_rows):
+        assert store.neighbors(r).tolist() == sorted(sets.get(r, ()))
+    assert len(store.neighbors(-1)) == 0 and len(store.neighbors(store.n_rows)) == 0
+
+def test_contains_and_contains_batch():
+    store, sets = random_store(1)
+    rng = np.random.RandomState(2)
+    rows, cols = rng.randint(-2, store.n_rows + 3, 1000), rng.randint(0, store.n_cols, 1000)
+    expected = [c in sets.get(r, ()) for r, c in zip(rows.tolist(), cols.tolist())]
+    assert [bool(store.contains(r, c)) for r, c in zip(rows, cols)] == expected
+    assert store.contains_batch(rows, cols).tolist() == expected
+
+def test_gather():
+    store, sets = random_store(3)
+    rows = np.array([4, 0, 33, 4, 17])
+    pos, cols = store.gather(rows)
+    expected = [(i, c) for i, r in enumerate(rows.tolist()) for c in sorted(sets.get(r, ()))]
+    assert list(zip(pos.tolist(), cols.tolist())) == expected
+
+def test_transpose_and_dict_view():
+    store, sets = random_store(4)
+    items = store.transpose()
+    for c in range(store.n_cols):
+        assert items.neighbors(c).tolist() == sorted(r for r, s in sets.items() if c in s)
+    view = store.as_dict()
+    assert sorted(view) == sorted(sets)
+    assert all(view[r].tolist() == sorted(sets[r]) for r in sets)
+    assert store.n_rows - 1 not in view
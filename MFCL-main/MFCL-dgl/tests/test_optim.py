@@ -0,0 +1,49 @@
+import torch
+from utility.optim import LazyAdam
+
+def make_params(seed=0):
+    torch.manual_seed(seed)
+    return torch.nn.Parameter(torch.randn(20, 4)), torch.nn.Parameter(torch.randn(4, 3))
+
+def test_matches_adam_on_dense_gradients():
+    table, weight = make_params()
+    ref_table, ref_weight = [torch.nn.Parameter(p.detach().clone()) for p in (table, weight)]
+    lazy = LazyAdam([{'params': [table], 'lazy': True}, {'params': [weight]}], lr=0.01)
+    adam = torch.optim.Adam([ref_table, ref_weight], lr=0.01)
+    for step in range(5):
+        x = torch.randn(20, 3)
+        for t, w, optimizer in [(table, weight, lazy), (ref_table, ref_weight, adam)]:
+            optimizer.zero_grad()
+            ((t @ w - x) ** 2).sum().backward()
+            optimizer.step()
+    assert torch.allclose(table, ref_table, atol=1e-6)
+    assert torch.allclose(weight, ref_weight, atol=1e-6)
+
+def test_moments_only_for_touched_rows():
+    table, _ = make_params()
+    before = table.detach().clone()
+    optimizer = LazyAdam([{'params': [table], 'lazy': True}], lr=0.01)
+    for rows in [[3, 7], [7, 1], [3]]:
+        optimizer.zero_grad()
+        table[rows].sum().backward()
+        optimizer.step()
+    state = optimizer.state[table]
+    assert state['rows'].tolist() == [1, 3, 7]
+    assert state['exp_avg'].shape == (3, 4)
+    untouched = [r for r in range(20) if r not in (1, 3, 7)]
+    assert torch.equal(table[untouched], before[untouched])
+    assert not torch.equal(table[[1, 3, 7]], before[[1, 3, 7]])
+
+def test_state_dict_roundtrip():
+    table, _ = make_params()
+    optimizer = LazyAdam([{'params': [table], 'lazy': True}], lr=0.01)
+    table[[2, 5]].sum().backward()
+    optimizer.step()
+    restored = LazyAdam([{'params': [table], 'lazy': True}], lr=0.01)
+    restored.load_state_dict(optimizer.state_dict())
+    for o in (optimizer, restored):
+        table.grad = None
+        table[[5, 9]].sum().backward()
+        o.step()
+    assert optimizer.state[table]['rows'].tolist() == restored.state[table]['rows'].tolist() == [2, 5, 9]
+    assert torch.allclose(optimizer.state[table]['exp_avg'], restored.state[table]['exp_avg'])
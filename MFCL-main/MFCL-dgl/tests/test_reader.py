@@ -0,0 +1,37 @@
+import gzip
+import os
+import zipfile
+import numpy as np
+from utility.reader import unique_rows, iter_int_chunks
+
+def write_rows(path, rows):
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write(' '.join(str(x) for x in row) + '\n')
+
+def test_unique_rows_matches_np_unique(tmp_path):
+    rng = np.random.RandomState(0)
+    rows = rng.randint(0, 40, (3000, 3))
+    path = str(tmp_path / 'kg_final.txt')
+    write_rows(path, rows)
+    expected = np.unique(rows, axis=0)
+    # one chunk, several spilled chunks and value ranges too large to pack into one key.
+    assert np.array_equal(unique_rows(path, 3), expected)
+    assert np.array_equal(unique_rows(path, 3, chunk_lines=257, n_buckets=5, tmp_dir=str(tmp_path)), expected)
+    big = rows.astype(np.int64) * (2 ** 30)
+    write_rows(path, big)
+    assert np.array_equal(unique_rows(path, 3, chunk_lines=500, dtype=np.int64), np.unique(big, axis=0))
+    assert os.listdir(str(tmp_path)) == ['kg_final.txt']
+
+def test_archives(tmp_path):
+    rows = np.random.RandomState(1).randint(0, 10, (100, 3))
+    plain = str(tmp_path / 'plain.txt')
+    write_rows(plain, rows)
+    with zipfile.ZipFile(str(tmp_path / 'a.txt.zip'), 'w') as z:
+        z.write(plain, 'a.txt')
+    with open(plain, 'rb') as f, gzip.open(str(tmp_path / 'b.txt.gz'), 'wb') as g:
+        g.write(f.read())
+    for name in ['a.txt', 'b.txt']:
+        chunks = list(iter_int_chunks(str(tmp_path / name), 3, 30))
+        assert np.array_equal(np.concatenate(chunks), rows)
+        assert np.array_equal(unique_rows(str(tmp_path / name), 3, chunk_lines=30), np.unique(rows, axis=0))
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from utility.sampler import AliasTable, degree_sampler, UniformSampler
+
+@pytest.mark.parametrize('weights', [[1., 2., 3., 4.], [0., 5., 0., 1., 1e-3], [7.], [1.] * 6])
+def test_alias_table_probabilities(weights):
+    table = AliasTable(weights)
+    # the exact probability of every id from the prob/alias slots.
+    p = table.prob / table.n
+    np.add.at(p, table.alias, (1. - table.prob) / table.n)
+    assert np.allclose(p, np.asarray(weights) / np.sum(weights))
+
+def test_alias_table_draws():
+    np.random.seed(0)
+    weights = np.array([1., 0., 3., 6.])
+    draws = AliasTable(weights).draw(200000)
+    freq = np.bincount(draws, minlength=4) / len(draws)
+    assert freq[1] == 0
+    assert np.allclose(freq, weights / weights.sum(), atol=0.01)
+
+def test_invalid_weights():
+    for weights in [[], [0., 0.], [1., -1., 2.]]:
+        with pytest.raises(ValueError):
+            AliasTable(weights)
+
+def test_degree_sampler():
+    assert isinstance(degree_sampler([3, 0, 1], 0), UniformSampler)
+    table = degree_sampler([3, 0, 1], 0.5)
+    p = table.prob / table.n
+    np.add.at(p, table.alias, (1. - table.prob) / table.n)
+    expected = np.array([4., 1., 2.]) ** 0.5
+    assert np.allclose(p, expected / expected.sum())
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from utility.interactions import CSR
+from utility.serving import TopK, MicroBatcher, ResultCache, Server
+
+class GatedTopK(TopK):
+    # scores a batch only once the test opens the gate.
+    gate = None
+
+    def __call__(self, *args):
+        if self.gate is not None:
+            self.gate.wait(5)
+        return TopK.__call__(self, *args)
+
+def make_server():
+    rng = np.random.RandomState(0)
+    seen = CSR.from_pairs([0, 0, 1], [1, 2, 0], 4, 6)
+    topk = GatedTopK(rng.randn(4, 3), rng.randn(6, 3), seen, version='v1')
+    return Server(MicroBatcher(topk, max_wait=0.001), cache=ResultCache(100))
+
+def test_fold_in_rejects_unknown_items():
+    async def run():
+        server = make_server()
+        server.batcher.start()
+        for items in [b'[6]', b'[-1]', b'[[1, 2]]', b'["a"]']:
+            with pytest.raises(ValueError):
+                await server._handle('POST', '/fold_in', b'{"user": 0, "items": %s}' % items)
+        # the batcher still serves the user.
+        status, result = await server._handle('GET', '/recommend?user=0&k=3', b'')
+        await server.batcher.stop()
+        return status, result
+    status, result = asyncio.run(run())
+    assert status == 200 and len(result['items']) == 3
+
+def test_fold_in_during_a_batch_is_not_cached_stale():
+    async def run():
+        server = make_server()
+        server.batcher.topk.gate = threading.Event()
+        server.batcher.start()
+        request = asyncio.ensure_future(server.recommend(0, 6))
+        # the batch of the request is being scored on the worker thread.
+        while not server.batcher.busy:
+            await asyncio.sleep(0.001)
+        server.fold_in(0, items=[3])
+        assert 3 not in server.batcher.topk.extra_seen.get(0, [])
+        server.batcher.topk.gate.set()
+        await request
+        after = await server.recommend(0, 6)
+        await server.batcher.stop()
+        return after
+    after = asyncio.run(run())
+    assert 3 not in after['items'] and 1 not in after['items']
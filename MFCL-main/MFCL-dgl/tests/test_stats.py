@@ -0,0 +1,39 @@
+import numpy as np
+from utility.interactions import CSR
+from utility.stats import sparsity_split
+
+def loop_split(train_sets, test_sets, n_train, n_test):
+    # the former KGAT_loader.create_sparsity_split, without its trailing empty bucket.
+    user_n_iid = {}
+    for uid in test_sets:
+        user_n_iid.setdefault(len(train_sets.get(uid, ())) + len(test_sets[uid]), []).append(uid)
+    split_uids, split_state, temp, n_rates = [], [], [], 0
+    for n_iids in sorted(user_n_iid):
+        temp += user_n_iid[n_iids]
+        n_rates += n_iids * len(user_n_iid[n_iids])
+        if n_rates >= 0.25 * (n_train + n_test):
+            split_uids.append(temp)
+            split_state.append('#inter per user<=[%d], #users=[%d], #all rates=[%d]' % (n_iids, len(temp), n_rates))
+            temp, n_rates = [], 0
+    if temp:
+        split_uids.append(temp)
+        split_state.append('#inter per user<=[%d], #users=[%d], #all rates=[%d]' % (n_iids, len(temp), n_rates))
+    return split_uids, split_state
+
+def random_sets(rng, n_users, n_items, max_degree):
+    return {u: set(rng.randint(0, n_items, rng.randint(1, max_degree)).tolist())
+            for u in range(n_users) if rng.rand() < 0.8}
+
+def as_store(sets, n_rows):
+    pairs = [(u, i) for u, s in sets.items() for i in s]
+    return CSR.from_pairs([p[0] for p in pairs], [p[1] for p in pairs], n_rows, 100)
+
+def test_sparsity_split_matches_loop():
+    for seed in range(20):
+        rng = np.random.RandomState(seed)
+        train_sets, test_sets = random_sets(rng, 60, 100, 20), random_sets(rng, 70, 100, 5)
+        train, test = as_store(train_sets, 60), as_store(test_sets, 70)
+        split_uids, split_state = sparsity_split(train, test)
+        expected_uids, expected_state = loop_split(train_sets, test_sets, len(train), len(test))
+        assert split_state == expected_state
+        assert [sorted(u.tolist()) for u in split_uids] == [sorted(u) for u in expected_uids]